@@ -50,8 +50,8 @@ def run(device, main, sidechain, threshold, mode, release=0.3, ratio=2, duck_lev
     def on_levels(level: FairlightMeterLevelsField):
         global release_timer
         if level.index == side_index and level.subchannel == side_sub:
-            # Grab the output peak level
-            val = sum(level.output[0:2]) / 2.0
+            # Grab the output level, the left and right output levels are at index 7 and 8 of the levels
+            val = float(sum(level.levels_array[7:9])) / 2.0
 
             if val > threshold:
                 gr = val - threshold
@@ -13,12 +13,16 @@ import pyatem.media
 from pyatem.cameracontrol import CameraControlData
 from pyatem.protocol import AtemProtocol
 import pyatem.field as fieldmodule
+from pyatem.mediasync import MediaSync, entries_from_directory, entries_from_manifest
+from pyatem.stillcache import StillCache
 
 connection = None
 slot_index = None
 image_path = None
 args = None
 pbar = None
+pending = None
+cache = None
 logging.basicConfig(level=logging.INFO)
 
 
@@ -33,6 +37,11 @@ def prepare_image(path, resolution):
     return bytes(flat)
 
 
+def convert_image(path, resolution):
+    frame = prepare_image(path, resolution)
+    return pyatem.media.rgb_to_atem(frame, *resolution, threads=0)
+
+
 def save_image(path, resolution, data):
     im = Image.frombytes('RGBA', resolution, data)
     im.save(path)
@@ -59,37 +68,75 @@ def connected():
 
     logging.info(f'Connected to {product.name} at {mode.get_label()}')
 
+    if args.action == "sync":
+        sync_media()
+        return
+
     if slot_index < 0 or slot_index > slots.stills:
         logging.fatal(f'Slot index out of range, This hardware supports slot 1-{slots.stills}')
 
     if args.action == "upload":
-        frame = prepare_image(image_path, mode.get_resolution())
         connection.send_commands([TimeRequestCommand()])
         logging.basicConfig(level=logging.DEBUG)
-        frame_atem = pyatem.media.rgb_to_atem(frame, *mode.get_resolution())
         if args.name:
             name = args.name
         else:
             name = Path(args.file).stem
-        connection.upload(0, slot_index, frame_atem, name=name, compress=True)
+        resolution = mode.get_resolution()
+        if args.raw or args.rgba:
+            # Raw frames are memory mapped instead of read into memory
+            data, size, md5 = pyatem.media.import_frame(image_path, *resolution, rgba=args.rgba, threads=0)
+            connection.upload(0, slot_index, data, name=name, compress=False, compressed=True, size=size, hash=md5)
+        elif cache is not None:
+            # Uploading the same file again skips the conversion and compression
+            cached = cache.frame_for_file(image_path, resolution, False, lambda path: convert_image(path, resolution))
+            cached.upload(connection, slot_index, name=name)
+        else:
+            frame_atem = convert_image(image_path, resolution)
+            connection.upload(0, slot_index, frame_atem, name=name, compress=True)
     elif args.action == "download":
-        connection.download(0, slot_index)
+        info = connection.mixerstate.get('mediaplayer-file-info', {}).get(slot_index)
+        cached = cache.get_frame(info.hash) if cache is not None and info is not None and info.is_used else None
+        if cached is not None:
+            logging.info(f'Slot {slot_index + 1} is in the stills cache, skipping the download')
+            downloaded(0, slot_index, pyatem.media.rle_decode(cached.data))
+        else:
+            connection.download(0, slot_index)
+
+
+def sync_media():
+    global pending
+    if os.path.isdir(args.path):
+        entries = entries_from_directory(args.path)
+    else:
+        entries = entries_from_manifest(args.path)
+    sync = MediaSync(connection, premultiply=args.premultiply, cache=cache)
+    pending = len(sync.sync(entries))
+    logging.info(f'{len(entries) - pending} of {len(entries)} stills are already up to date')
+    if pending == 0:
+        exit(0)
 
 
 def uploaded(store, slot):
-    logging.info("Upload completed")
+    logging.info(f"Upload of slot {slot + 1} completed")
+    global pending
+    if pending is not None:
+        pending -= 1
+        if pending > 0:
+            return
     exit(0)
 
 
 def downloaded(store, slot, data):
     logging.info(f'Download complete, received {len(data)} bytes')
-    if args.raw:
+    if cache is not None:
+        cache.put_frame(data)
+    mode = connection.mixerstate['video-mode']
+    if args.raw or args.rgba:
         logging.info(f'Saving raw data to {args.file}')
-        with open(args.file, 'wb') as handle:
-            handle.write(data)
+        pyatem.media.export_frame(data, args.file, *mode.get_resolution(), rgba=args.rgba, threads=0)
     else:
-        mode = connection.mixerstate['video-mode']
-        image = pyatem.media.atem_to_image(data, *mode.get_resolution())
+        image = pyatem.media.atem_to_rgb(data, *mode.get_resolution(), threads=0)
         save_image(args.file, mode.get_resolution(), image)
     exit(0)
 
@@ -111,9 +158,10 @@ def upload_progress(store, slot, percent, done, size):
 
 
 def main():
-    global connection, slot_index, image_path, args
+    global connection, slot_index, image_path, args, cache
     parser = argparse.ArgumentParser()
     parser.add_argument('--debug', help="More debug output", action="store_true")
+    parser.add_argument('--no-cache', help="Don't use the converted stills cache", action="store_true")
     subparsers = parser.add_subparsers(dest="action")
     subparsers.required = True
     upload_parser = subparsers.add_parser('upload')
@@ -121,11 +169,19 @@ def main():
     upload_parser.add_argument('index', help='Media store slot number', type=int)
     upload_parser.add_argument('file', help='Still to upload')
     upload_parser.add_argument('--name', help='Still name')
+    upload_parser.add_argument('--raw', help='The file is an uncompressed ATEM frame', action='store_true')
+    upload_parser.add_argument('--rgba', help='The file is raw RGBA data at the switcher resolution',
+                               action='store_true')
     download_parser = subparsers.add_parser('download')
     download_parser.add_argument('ip', help='ATEM IP address')
     download_parser.add_argument('index', help='Media store slot number', type=int)
     download_parser.add_argument('file', help='Local filename for the still')
     download_parser.add_argument('--raw', help='Don\'t decode', action='store_true')
+    download_parser.add_argument('--rgba', help='Save raw RGBA data instead of an image', action='store_true')
+    sync_parser = subparsers.add_parser('sync', help='Upload only the stills that differ from the media pool')
+    sync_parser.add_argument('ip', help='ATEM IP address')
+    sync_parser.add_argument('path', help='Directory with stills for slot 1 and up, or a JSON manifest')
+    sync_parser.add_argument('--premultiply', help='Premultiply the alpha channel', action='store_true')
 
     args = parser.parse_args()
 
@@ -133,8 +189,12 @@ def main():
         sys.stderr.write('File not found\n')
         exit(1)
 
-    slot_index = args.index - 1
-    image_path = args.file
+    if args.action != "sync":
+        slot_index = args.index - 1
+        image_path = args.file
+
+    if not args.no_cache:
+        cache = StillCache()
 
     logging.info(f'Connecting to ATEM at {args.ip}...')
     if args.ip == 'usb':
@@ -61,7 +61,7 @@ class AtemConnection(threading.Thread):
             if AtemProtocol.usb_exists():
                 self.log.info(f'Connect to USB device')
                 try:
-                    self.mixer = AtemProtocol(usb="auto")
+                    self.mixer = AtemProtocol(usb="auto", skip_unchanged=True, coalesce_changes=True)
                 except PermissionError:
                     self.log.error("Could not connect to USB device: permission denied")
                     self.log.error("The udev rules for this ATEM device might be missing on your system")
@@ -72,8 +72,8 @@ class AtemConnection(threading.Thread):
                 return
         else:
             self.log.info(f'Connect to {self.ip}')
-            self.mixer = AtemProtocol(self.ip)
-        self.mixer.on('change', self.do_callback)
+            self.mixer = AtemProtocol(self.ip, skip_unchanged=True, coalesce_changes=True)
+        self.mixer.on('changes', self.do_changes)
         self.mixer.on('connected', self.do_connected)
         self.mixer.on('disconnected', self.do_disconnected)
         self.mixer.on('transfer-progress', self.do_transfer_progress)
@@ -92,8 +92,14 @@ class AtemConnection(threading.Thread):
                 traceback.print_exc()
                 self.log.error(repr(e))
 
-    def do_callback(self, *args, **kwargs):
-        GLib.idle_add(self.callback, *args, **kwargs)
+    def do_changes(self, changes):
+        # Handle all the fields of a packet in a single main loop iteration
+        GLib.idle_add(self._apply_changes, changes)
+
+    def _apply_changes(self, changes):
+        for key, contents in changes:
+            self.callback(key, contents)
+        return False
 
     def do_disconnected(self):
         self.connected = False
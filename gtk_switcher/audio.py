@@ -641,29 +641,32 @@ class AudioPage:
             cmd = SendFairlightLevelsCommand(False)
         self.connection.mixer.send_commands([cmd])
 
+    def _set_vu(self, strip_id, levels, offset):
+        # Left and right level in dB from the flat list of levels of a meter field
+        self.vu[strip_id][0].set_fraction((levels[offset] + 60) / 60)
+        self.vu[strip_id][1].set_fraction((levels[offset + 1] + 60) / 60)
+
     def on_audio_meter_levels_change(self, data):
         if 'master' not in self.vu:
             return
-        self.vu['master'][0].set_fraction((data.master[0] + 60) / 60)
-        self.vu['master'][1].set_fraction((data.master[1] + 60) / 60)
-        self.vu['monitor'][0].set_fraction((data.monitor[0] + 60) / 60)
-        self.vu['monitor'][1].set_fraction((data.monitor[1] + 60) / 60)
-        for strip in data.input:
-            strip_id = f'{strip}.0'
-            self.vu[strip_id][0].set_fraction((data.input[strip][0] + 60) / 60)
-            self.vu[strip_id][1].set_fraction((data.input[strip][1] + 60) / 60)
+        levels = data.levels_array.tolist()
+        if len(levels) > 0 and isinstance(levels[0], list):
+            # With numpy the levels are in rows of 4 for master, monitor and the inputs
+            levels = [level for row in levels for level in row]
+        self._set_vu('master', levels, 0)
+        self._set_vu('monitor', levels, 4)
+        for i, strip in enumerate(data.sources):
+            self._set_vu(f'{strip}.0', levels, 8 + i * 4)
 
     def on_fairlight_meter_levels_change(self, data):
         if data.strip_id not in self.vu:
             return
-        self.vu[data.strip_id][0].set_fraction((data.level[0] + 60) / 60)
-        self.vu[data.strip_id][1].set_fraction((data.level[1] + 60) / 60)
+        self._set_vu(data.strip_id, data.levels_array, 11)
 
     def on_fairlight_master_levels_change(self, data):
         if 'master' not in self.vu:
             return
-        self.vu['master'][0].set_fraction((data.level[0] + 60) / 60)
-        self.vu['master'][1].set_fraction((data.level[1] + 60) / 60)
+        self._set_vu('master', data.levels_array, 10)
 
     def on_open_eq_overlay(self, widget, *args):
         EqWindow(widget.strip_id, self.window, self.connection, self.provider)
@@ -1,5 +1,6 @@
 # Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
 # SPDX-License-Identifier: GPL-3.0-only
+import concurrent.futures
 import logging
 import os
 import struct
@@ -13,7 +14,8 @@ from gtk_switcher.colorwheel import ColorWheelWidget
 from gtk_switcher.decorators import field
 from pyatem.command import MediaplayerSelectCommand
 from pyatem.field import InputPropertiesField
-from pyatem.media import atem_to_rgb
+from pyatem.media import atem_to_rgb, atem_to_image
+from pyatem.stillcache import StillCache
 
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, GLib, GObject, Gio, Gdk, GdkPixbuf
@@ -36,11 +38,21 @@ class MediaPage:
         self.media_player_img = {}
         self.media_player_desc = {}
         self.media_last_upload = None
+        self.media_slot_hash = {}
 
         self.media_context = None
 
         self.log_mp = logging.getLogger('MediaPage')
 
+        try:
+            self.media_cache = StillCache(os.path.join(GLib.get_user_cache_dir(), 'openswitcher', 'stills'))
+        except OSError as e:
+            self.log_mp.error(f'Could not open the stills cache: {e}')
+            self.media_cache = None
+
+        # Reading and decoding cached frames is too slow for the main thread when all slots come in at once
+        self.media_loader = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='media-loader')
+
     @field('mediaplayer-slots')
     def on_mediaplayer_slots_change(self, data):
         for child in self.media_flow:
@@ -162,16 +174,22 @@ class MediaPage:
         self.model_media[data.index][1] = f'{data.index + 1}: {data.name.decode()}'
         self.model_changing = False
 
+        # Results of earlier loads for this slot are dropped when the hash changed
+        self.media_slot_hash[data.index] = data.hash if data.is_used else None
+
         if self.media_last_upload is not None and data.index == self.media_last_upload:
             # Don't download the frame that was just uploaded
             self.media_last_upload = None
             return
         if data.is_used:
             self.media_slot_name[data.index].set_label(data.name.decode())
-            if self.mainstack.get_visible_child_name() == 'media':
-                self.connection.mixer.download(0, data.index)
+            if data.index in self.media_queue:
+                self.media_queue.remove(data.index)
+            if self.media_cache is not None:
+                width, height = self.connection.mixer.mixerstate['video-mode'].get_resolution()
+                self.media_loader.submit(self.media_load_cached, data.index, data.hash, width, height)
             else:
-                self.media_queue.append(data.index)
+                self.media_slot_download(data.index, data.hash)
         else:
             if data.index in self.media_queue:
                 self.media_queue.remove(data.index)
@@ -179,6 +197,36 @@ class MediaPage:
             for child in self.media_slot_box[data.index]:
                 self.media_slot_box[data.index].remove(child)
 
+    def media_load_cached(self, index, hash, width, height):
+        # Runs on the loader thread, only the result is handed to the main thread
+        try:
+            cached = self.media_cache.get_frame(hash)
+            if cached is None:
+                GLib.idle_add(self.media_slot_download, index, hash)
+                return
+            raw = bytearray(width * 4 * height)
+            atem_to_image(cached.data, width, height, raw)
+            pixbuf = self.media_frame_to_pixbuf(raw, width, height)
+        except Exception as e:
+            self.log_mp.error(f'Could not load the cached frame for slot {index}: {e}')
+            GLib.idle_add(self.media_slot_download, index, hash)
+            return
+        GLib.idle_add(self.media_slot_show_cached, index, hash, pixbuf)
+
+    def media_slot_show_cached(self, index, hash, pixbuf):
+        # The slot might have changed while the frame was loading
+        if self.media_slot_hash.get(index) != hash:
+            return
+        self.media_slot_show_pixbuf(index, pixbuf)
+
+    def media_slot_download(self, index, hash):
+        if self.media_slot_hash.get(index) != hash:
+            return
+        if self.mainstack.get_visible_child_name() == 'media':
+            self.connection.mixer.call_threadsafe(self.connection.mixer.download, 0, index)
+        else:
+            self.media_queue.append(index)
+
     def on_media_transfer_progress(self, index, progress):
         if index not in self.media_slot_progress:
             return
@@ -232,16 +280,25 @@ class MediaPage:
             return
 
         width, height = self.connection.mixer.mixerstate['video-mode'].get_resolution()
-        raw = atem_to_rgb(data, width, height)
+        if self.media_cache is not None and len(data) == width * 4 * height:
+            self.media_cache.put_frame(data)
 
-        # Pad the frame to the right size instead of failing hard when the transfer is corrupted
-        if len(raw) != (width * 4 * height):
-            missing = (width * 4 * height) - len(raw)
-            raw += b'\0' * missing
+        # Convert into a buffer of the full frame size, when the transfer is corrupted the rest of the frame
+        # stays black instead of failing hard
+        raw = bytearray(width * 4 * height)
+        atem_to_rgb(memoryview(data)[0:len(raw)], width, height, raw, threads=0)
+        self.media_slot_show_frame(index, raw)
 
+    def media_frame_to_pixbuf(self, raw, width, height):
         gdk_raw = GLib.Bytes.new(raw)
-        pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(gdk_raw, GdkPixbuf.Colorspace.RGB, True, 8, width, height,
-                                                 width * 4)
+        return GdkPixbuf.Pixbuf.new_from_bytes(gdk_raw, GdkPixbuf.Colorspace.RGB, True, 8, width, height, width * 4)
+
+    def media_slot_show_frame(self, index, raw):
+        width, height = self.connection.mixer.mixerstate['video-mode'].get_resolution()
+        self.media_slot_show_pixbuf(index, self.media_frame_to_pixbuf(raw, width, height))
+
+    def media_slot_show_pixbuf(self, index, pixbuf):
+        width, height = self.connection.mixer.mixerstate['video-mode'].get_resolution()
         self.media_pixbuf[index] = pixbuf
         aw = 184
         thumb = pixbuf.scale_simple(aw, int(aw * height / width), GdkPixbuf.InterpType.BILINEAR)
@@ -276,7 +333,7 @@ class MediaPage:
     def on_page_media_open(self):
         for index in self.media_queue:
             self.media_slot_progress[index].show()
-            self.connection.mixer.download(0, index)
+            self.connection.mixer.call_threadsafe(self.connection.mixer.download, 0, index)
         self.media_queue = []
 
     def dnd_uri_to_path(self, uri):
@@ -345,11 +402,31 @@ class MediaPage:
         premultiply = False
         if ext.lower() == '.png':
             premultiply = True
-            
-        self.media_slot_upload_pixbuf(index, pixbuf, name=name, premultiply=premultiply)
+
+        if self.media_cache is None:
+            self.media_slot_upload_pixbuf(index, pixbuf, name=name, premultiply=premultiply)
+            return
+
+        # Repeat uploads of the same file skip the conversion and compression
+        cached = self.media_cache.frame_for_file(path, (width, height), premultiply,
+                                                 lambda p: self.media_pixbuf_to_frame(pixbuf, premultiply))
+        self.log_mp.info(f"Uploading {path} to media slot {index}")
+        self.media_pixbuf[index] = pixbuf
+        self.media_slot_progress[index].show()
+        self.media_slot[index].get_style_context().add_class('uploading')
+        cached.upload(self.connection.mixer, index, name=name)
+        self.media_last_upload = index
 
     def media_slot_upload_pixbuf(self, index, pixbuf, name=None, premultiply=False):
         self.log_mp.info(f"Uploading pixbuf to media slot {index}")
+        frame = self.media_pixbuf_to_frame(pixbuf, premultiply)
+        self.media_pixbuf[index] = pixbuf
+        self.media_slot_progress[index].show()
+        self.media_slot[index].get_style_context().add_class('uploading')
+        self.connection.mixer.call_threadsafe(self.connection.mixer.upload, 0, index, frame, name=name)
+        self.media_last_upload = index
+
+    def media_pixbuf_to_frame(self, pixbuf, premultiply=False):
         mode = self.connection.mixer.mixerstate['video-mode']
         width, height = mode.get_resolution()
         aspect = width / height
@@ -372,11 +449,5 @@ class MediaPage:
         dest = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, width, height)
         pixbuf.scale(dest, dest_x, dest_y, dest_w, dest_h, dest_x, dest_y, scale, scale, GdkPixbuf.InterpType.BILINEAR)
 
-        self.media_pixbuf[index] = pixbuf
-
         pixels = dest.get_pixels()
-        frame = pyatem.media.rgb_to_atem(pixels, width, height, premultiply)
-        self.media_slot_progress[index].show()
-        self.media_slot[index].get_style_context().add_class('uploading')
-        self.connection.mixer.upload(0, index, frame, name=name)
-        self.media_last_upload = index
+        return pyatem.media.rgb_to_atem(pixels, width, height, premultiply, threads=0)
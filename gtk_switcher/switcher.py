@@ -1177,7 +1177,7 @@ class SwitcherPage:
 
     def on_macro_edit(self, widget):
         self.macro_edit = True
-        self.connection.mixer.download(0xffff, widget.index)
+        self.connection.mixer.call_threadsafe(self.connection.mixer.download, 0xffff, widget.index)
 
     def on_macro_create_clicked(self, widget):
         name = self.macro_name.get_text()
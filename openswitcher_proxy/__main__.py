@@ -14,7 +14,7 @@ from openswitcher_proxy.frontend_midi import MidiFrontendThread
 from openswitcher_proxy.frontend_status import StatusFrontendThread
 from openswitcher_proxy.frontend_tcp import TcpFrontendThread
 from openswitcher_proxy.frontend_mqtt import MqttFrontendThread
-from openswitcher_proxy.hardware import HardwareThread
+from openswitcher_proxy.hardware import HardwareThread, HardwareLoop, LoopHardware
 
 logging.basicConfig(
     format="%(asctime)s [%(levelname)-8s %(threadName)-15s] %(message)s",
@@ -30,11 +30,22 @@ def run(config_path):
     with open(config_path, 'rb') as handle:
         config = tomllib.load(handle)
     logging.info('Loading config file ' + config_path)
+    hwloop = None
+    if config.get('proxy', {}).get('mode', 'threaded') == 'shared-loop':
+        logging.info('  running the hardware connections on a shared event loop')
+        hwloop = HardwareLoop()
+        hwloop.daemon = True
+        threads.append(hwloop)
+        hwloop.start()
+
     if 'hardware' in config:
         nthreads['hardware'] = {}
         for hardware in config['hardware']:
             logging.info(f'  hardware: {hardware["id"]} ({hardware["label"]})')
-            t = HardwareThread(hardware)
+            if hwloop is not None and HardwareLoop.supports(hardware):
+                t = LoopHardware(hardware, hwloop)
+            else:
+                t = HardwareThread(hardware)
             t.daemon = True
             threads.append(t)
             nthreads['hardware'][hardware['id']] = t
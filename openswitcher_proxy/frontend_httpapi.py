@@ -14,7 +14,7 @@ import pyatem.command as commandmodule
 class FieldEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, FieldBase):
-            temp = obj.__dict__
+            temp = obj.decode().__dict__
             result = {}
             for key in temp:
                 if key == 'raw':
@@ -23,6 +23,9 @@ class FieldEncoder(json.JSONEncoder):
             return result
         elif isinstance(obj, bytes):
             return base64.b64encode(obj).decode()
+        elif hasattr(obj, 'tolist'):
+            # numpy and array.array values
+            return obj.tolist()
         return obj
 
 
@@ -30,7 +30,8 @@ class StatusRequestHandler(AuthRequestHandler):
         self.wfile.write("<h2>Hardware</h2>".encode())
         if 'hardware' in self.threadpool:
             self.wfile.write(
-                '<table border="1"><tr><th>id</th><th>label</th><th>address</th><th>status</th></tr>'.encode())
+                '<table border="1"><tr><th>id</th><th>label</th><th>address</th><th>status</th>'
+                '<th>loop latency</th></tr>'.encode())
             for hwid in self.threadpool['hardware']:
                 hardware = self.threadpool['hardware'][hwid]
                 self.wfile.write('<tr>'.encode())
@@ -38,6 +39,9 @@ class StatusRequestHandler(AuthRequestHandler):
                 self.wfile.write(f'<td>{hardware.config["label"]}</td>'.encode())
                 self.wfile.write(f'<td>{hardware.config["address"]}</td>'.encode())
                 self.wfile.write(f'<td>{hardware.get_status()}</td>'.encode())
+                latency = hardware.get_latency()
+                latency = 'n/a' if latency is None else f'{latency * 1000:.1f} ms'
+                self.wfile.write(f'<td>{latency}</td>'.encode())
                 self.wfile.write('</tr>'.encode())
             self.wfile.write('</table>'.encode())
         else:
@@ -59,6 +63,23 @@ class StatusRequestHandler(AuthRequestHandler):
         else:
             self.wfile.write("No hardware is defined".encode())
 
+        clients = []
+        for bind in self.threadpool.get('frontend', {}):
+            frontend = self.threadpool['frontend'][bind]
+            if hasattr(frontend, 'get_clients'):
+                clients.extend((bind,) + client for client in frontend.get_clients())
+        if len(clients) > 0:
+            self.wfile.write("<h2>Clients</h2>".encode())
+            self.wfile.write(
+                '<table border="1"><tr><th>frontend</th><th>address</th><th>device</th><th>queue depth</th>'
+                '<th>dropped</th></tr>'.encode())
+            for bind, address, device, depth, dropped in clients:
+                self.wfile.write('<tr>'.encode())
+                self.wfile.write(f'<td>{bind}</td><td>{address}</td><td>{device}</td>'.encode())
+                self.wfile.write(f'<td>{depth}</td><td>{dropped}</td>'.encode())
+                self.wfile.write('</tr>'.encode())
+            self.wfile.write('</table>'.encode())
+
 
 class StatusFrontendThread(threading.Thread):
     def __init__(self, config, threadlist):
@@ -1,4 +1,7 @@
+import collections
+import hashlib
 import hmac
+import socket
 import struct
 import threading
 import logging
@@ -6,24 +9,362 @@ import socketserver
 from functools import partial
 
 from pyatem.command import TransferCompleteCommand
-from pyatem.field import InitCompleteField
+from pyatem.field import FieldBase, InitCompleteField
+from pyatem.media import apply_delta, rle_decode, rle_encode
+from pyatem.protocol import AtemProtocol
+from pyatem.stillcache import StillCache, CachedFrame
 from pyatem.transfer import TransferTask
+from pyatem.transport import FrameReader, TcpProtocol
+
+
+# Fields that are sent many times per second and are replaced by the next update, these are dropped first when a
+# client can't keep up
+METER_FIELDS = {'audio-meter-levels', 'fairlight-meter-levels', 'fairlight-master-levels'}
+
+
+# Largest frame accepted from clients, only reachable with the 32 bit lengths of version 2 of the protocol
+MAX_RECEIVE = 64 * 1024 * 1024
+
+
+def frame(data, version):
+    """Add the TCP frame header for the protocol version"""
+    if version >= 2:
+        return TcpProtocol.STRUCT_HEADER_V2.pack(len(data)) + data
+    return TcpProtocol.STRUCT_HEADER.pack(len(data)) + data
+
+
+class ClientQueue:
+    """
+    Bounded queue of encoded TCP packets for a single client. A writer thread sends the packets so a slow client never
+    blocks the hardware thread that produces them. With version 2 of the protocol the writer combines all the queued
+    packets in a single frame.
+
+    When the queue is full the queued meter packets are dropped first. If it's still full a new meter packet is
+    dropped, any other packet means the client can't keep up with the state changes and it's disconnected.
+    """
+
+    def __init__(self, sock, name, limit, version=1):
+        self.sock = sock
+        self.limit = limit
+        self.version = version
+        self.items = collections.deque()
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name=name + '.tx', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def depth(self):
+        return len(self.items)
+
+    def put(self, data, droppable=False):
+        """Queue a packet, data can also be a list of packets that is sent in one go like the fields of a transfer"""
+        with self.condition:
+            if self.closed:
+                return
+            if len(self.items) >= self.limit:
+                kept = collections.deque(item for item in self.items if not item[1])
+                self.dropped += len(self.items) - len(kept)
+                self.items = kept
+            if len(self.items) >= self.limit:
+                if droppable:
+                    self.dropped += 1
+                    return
+                logging.warning(f'Client queue full with {len(self.items)} packets, disconnecting slow client')
+                self._close()
+                return
+            self.items.append((data, droppable))
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self._close()
+
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.items.clear()
+        self.condition.notify()
+        # Wake up the handler thread blocked on receiving from this client
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while len(self.items) == 0 and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                data, droppable = self.items.popleft()
+                packets = data if isinstance(data, list) else [data]
+                if self.version >= 2:
+                    size = sum(len(packet) for packet in packets)
+                    while len(self.items) > 0 and not isinstance(self.items[0][0], list) \
+                            and size + len(self.items[0][0]) <= TcpProtocol.MAX_FRAME:
+                        item, droppable = self.items.popleft()
+                        packets.append(item)
+                        size += len(item)
+                    data = frame(b''.join(packets), self.version)
+                else:
+                    data = b''.join(frame(packet, self.version) for packet in packets)
+            try:
+                self.sock.sendall(data)
+            except OSError as e:
+                logging.warning(f'Could not send to client: {e}')
+                self.close()
+                return
+
+
+class Broadcaster:
+    """
+    Fan-out of the state changes of a single device to all the TCP clients that selected it. Every change is encoded
+    once and put in the queue of every client.
+
+    The broadcaster also keeps the encoded packet of every field in the state up to date, new clients get the
+    initial state as a few large packets that are only rebuilt when something changed since the last client connected.
+    """
+
+    def __init__(self, switcher):
+        self.switcher = switcher
+        self.queues = set()
+        self.lock = threading.Lock()
+        self.state = {}
+        self.snapshot = None
+        self.connection = 0
+        self.callback_id = switcher.on('changes', self.on_changes)
+        self.callback_disconnected = switcher.on('disconnected', self.on_disconnected)
+        self._seed()
+
+    def _seed(self):
+        # The state is copied without holding the lock, a device on the shared loop copies it on the loop and that
+        # would wait for an on_changes call that waits for the lock. A change that was handled before the copy is
+        # already in the mixerstate, a change handled after it is newer than the copied field so it is kept.
+        connection = self.connection
+        while True:
+            # The hardware thread can change the state while it's being copied, try again in that case
+            try:
+                fields = self._flatten(self.switcher.mixerstate)
+                break
+            except RuntimeError:
+                continue
+        with self.lock:
+            # The copied state is gone when the hardware disconnected in the meantime
+            if connection != self.connection:
+                return
+            for field in fields:
+                self._update(field, replace=False)
+
+    def _flatten(self, idict):
+        result = []
+        for value in list(idict.values()):
+            if isinstance(value, dict):
+                result.extend(self._flatten(value))
+            elif isinstance(value, list):
+                result.extend(value)
+            else:
+                result.append(value)
+        return result
+
+    def _update(self, field, replace=True):
+        if not isinstance(field, FieldBase):
+            return
+        code = field.CODE.encode()
+        key = (code, AtemProtocol.field_index(code, field))
+        if not replace and key in self.state:
+            return
+        self.state[key] = field.make_packet()
+        self.snapshot = None
+
+    def get_snapshot(self):
+        """The full state as a list of TCP packets, ending with the InCm field"""
+        with self.lock:
+            return self._get_snapshot()
+
+    def _get_snapshot(self):
+        if self.snapshot is None:
+            self.snapshot = self.pack(list(self.state.values()) + [InitCompleteField(b'\0\0\0\0').make_packet()])
+        return self.snapshot
+
+    def add(self, queue):
+        """Send the initial state to the client and start sending it the changes"""
+        with self.lock:
+            for data in self._get_snapshot():
+                queue.put(data)
+            self.queues.add(queue)
+
+    def remove(self, queue):
+        with self.lock:
+            self.queues.discard(queue)
+
+    @staticmethod
+    def pack(packets):
+        """Combine encoded fields in as few TCP packets as possible, the frame header is added by the ClientQueue"""
+        result = []
+        data = b''
+        for packet in packets:
+            if len(data) + len(packet) > 0xffff:
+                result.append(data)
+                data = b''
+            data += packet
+        if len(data) > 0:
+            result.append(data)
+        return result
+
+    @classmethod
+    def encode(cls, changes):
+        """Encode changed fields in as few TCP packets as possible, returns a list of (data, is meter) tuples"""
+        result = []
+        for meter in (False, True):
+            # Don't send packets we can't decode yet
+            packets = [val.make_packet() for key, val in changes
+                       if not isinstance(val, bytes) and (key in METER_FIELDS) == meter]
+            result.extend((data, meter) for data in cls.pack(packets))
+        return result
+
+    def on_changes(self, changes):
+        with self.lock:
+            for key, val in changes:
+                self._update(val)
+            queues = list(self.queues)
+        if len(queues) == 0:
+            return
+        for data, meter in self.encode(changes):
+            for queue in queues:
+                queue.put(data, droppable=meter)
+
+    def on_disconnected(self):
+        with self.lock:
+            self.state = {}
+            self.snapshot = None
+            self.connection += 1
+
+
+class Downloads:
+    """
+    Downloads from the hardware for all the clients of the frontend. Every slot is only downloaded once when multiple
+    clients request it at the same time, and stills are kept in the stills cache by their hash so downloads of a slot
+    that didn't change are served without touching the hardware.
+    """
+
+    def __init__(self, threadlist, stills):
+        self.threadlist = threadlist
+        self.stills = stills
+        self.lock = threading.Lock()
+        self.subscribe_lock = threading.Lock()
+        self.pending = {}
+        self.callbacks = {}
+
+    def request(self, device, store, slot, callback):
+        """Get the data of a slot, callback is called with (store, slot, CachedFrame) or a None frame on failure"""
+        switcher = self.threadlist['hardware'][device].switcher
+        if store == 0:
+            info = switcher.mixerstate.get('mediaplayer-file-info', {}).get(slot)
+            if info is not None and not info.is_used:
+                callback(store, slot, None)
+                return
+            cached = None
+            if info is not None and self.stills is not None:
+                cached = self.stills.get_frame(info.hash)
+            if cached is not None:
+                logging.info(f'Serving still {slot} from the cache')
+                callback(store, slot, cached)
+                return
+
+        self._subscribe(device, switcher)
+        with self.lock:
+            key = (device, store, slot)
+            if key in self.pending:
+                self.pending[key].append(callback)
+                return
+            self.pending[key] = [callback]
+        # The download is queued on the thread or the event loop of the device, the future resolves to the task
+        queued = switcher.call_threadsafe(switcher.download, store, slot)
+        queued.add_done_callback(partial(self.on_download_queued, device, store, slot))
+
+    def _subscribe(self, device, switcher):
+        # This doesn't use self.lock, the event callbacks take that lock and a device on the shared loop runs them
+        # on the same loop that registers the callbacks
+        with self.subscribe_lock:
+            if device not in self.callbacks:
+                self.callbacks[device] = (
+                    switcher.on('download-done', partial(self.on_download_done, device)),
+                    switcher.on('disconnected', partial(self.on_disconnected, device)),
+                )
+
+    def on_download_queued(self, device, store, slot, future):
+        if future.exception() is not None:
+            self.on_download_finished(device, store, slot, future)
+            return
+        future.result().future.add_done_callback(partial(self.on_download_finished, device, store, slot))
+
+    def on_download_done(self, device, store, slot, data):
+        with self.lock:
+            callbacks = self.pending.pop((device, store, slot), None)
+        if callbacks is None:
+            return
+        # Compressing and writing the still to the cache takes a while, don't block the hardware thread for that
+        threading.Thread(target=self._finish, args=(store, slot, data, callbacks), daemon=True).start()
+
+    def on_download_finished(self, device, store, slot, future):
+        if not future.cancelled() and future.exception() is None:
+            return
+        logging.error(f'Download of store {store} slot {slot} from {device} failed')
+        with self.lock:
+            callbacks = self.pending.pop((device, store, slot), [])
+        for callback in callbacks:
+            callback(store, slot, None)
+
+    def on_disconnected(self, device):
+        # The transfers are lost with the connection, fail the downloads that are waiting for it
+        with self.lock:
+            keys = [key for key in self.pending if key[0] == device]
+            failed = [(key, self.pending.pop(key)) for key in keys]
+        for (device, store, slot), callbacks in failed:
+            logging.error(f'Download of store {store} slot {slot} failed, {device} disconnected')
+            for callback in callbacks:
+                callback(store, slot, None)
+
+    def _finish(self, store, slot, data, callbacks):
+        if store == 0 and self.stills is not None:
+            cached = self.stills.put_frame(data)
+        elif store == 0:
+            # Stills are sent to the clients compressed like the hardware sends them
+            cached = CachedFrame(hashlib.md5(data).digest(), len(data), rle_encode(data))
+        else:
+            cached = CachedFrame(hashlib.md5(data).digest(), len(data), data)
+        for callback in callbacks:
+            callback(store, slot, cached)
 
 
 class TCPHandler(socketserver.BaseRequestHandler):
-    def __init__(self, config, threadpool, *args, **kwargs):
+    def __init__(self, config, threadpool, frontend, *args, **kwargs):
         self.config = config
         self.threadpool = threadpool
+        self.frontend = frontend
+        self.stills = frontend.stills
         self.device = None
-        self.callback_id = None
-        self.callback_uploaded = None
+        self.version = 1
+        self.reader = None
+        self.queue = None
+        self.broadcaster = None
+        self.callback_upload = None
         self.transfer_buffer = {}
+        self.uploads = []
+        self.uploads_lock = threading.Lock()
         super().__init__(*args, **kwargs)
 
     def setup(self):
         if not hasattr(self.server, 'numclients'):
             self.server.numclients = 0
         self.server.numclients += 1
+        self.frontend.clients.add(self)
+        self.reader = FrameReader(self.request, TcpProtocol.STRUCT_HEADER, limit=MAX_RECEIVE)
 
     def decode_packet(self, data):
         offset = 0
@@ -38,77 +379,29 @@ class TCPHandler(socketserver.BaseRequestHandler):
             offset += datalen
 
     def list_to_packets(self, data):
-        result = b''
-        for key, value in data:
-            result += struct.pack('!H2x 4s', len(value) + 8, key)
-            result += value
-        return result
-
-    def _flatten(self, idict):
         result = []
-        for key in idict:
-            if isinstance(idict[key], dict):
-                result.extend(self._flatten(idict[key]))
-            elif isinstance(idict[key], list):
-                result.extend(idict[key])
-            else:
-                result.append(idict[key])
-        return result
+        for key, value in data:
+            result.append(struct.pack('!H2x 4s', len(value) + 8, key))
+            result.append(value)
+        return b''.join(result)
 
     def send_packets(self, data):
         data = self.list_to_packets(data)
         self.send_raw(data)
 
     def send_raw(self, data):
-        header = struct.pack('!H', len(data))
-        self.request.sendall(header + data)
-
-    def send_fields(self, fields):
-        data = b''
-        for field in fields:
-            data += field.make_packet()
-        header = struct.pack('!H', len(data))
-        self.request.sendall(header + data)
-
-    def send_initial_sync(self):
-        mixerstate = self.threadpool['hardware'][self.device].switcher.mixerstate
-        state = self._flatten(mixerstate)
-
-        buffer = []
-        size = 0
-        for field in state:
-            if isinstance(field, bytes):
-                continue
-            fsize = len(field.raw) + 8
-            if size + fsize > 1000:
-                self.send_fields(buffer)
-                buffer = []
-                size = 0
-            buffer.append(field)
-            size += fsize
-        self.send_fields(buffer)
-
-        buffer = [InitCompleteField(b'\0\0\0\0')]
-        self.send_fields(buffer)
+        if self.queue is not None:
+            self.queue.put(data)
+        else:
+            self.request.sendall(frame(data, self.version))
 
     def receive(self):
         try:
-            header = self.request.recv(2)
+            data = self.reader.read()
         except ConnectionResetError:
             raise ValueError("Client disconnected")
-        if len(header) == 0:
+        if data is None:
             raise ValueError("Client disconnected")
-        datalength, = struct.unpack('!H', header)
-        data_left = datalength
-        data = b''
-        while data_left > 0:
-            block = self.request.recv(data_left)
-            if len(block) == 0:
-                logging.warning("Connection closed")
-                return
-            data_left -= len(block)
-            data += block
-
         return data
 
     def handle(self):
@@ -128,6 +421,16 @@ class TCPHandler(socketserver.BaseRequestHandler):
                 logging.warning('Invalid magic on new connection, rejecting')
                 return
 
+            # Clients that support a newer version of the protocol send the version in the magic packet, switch to
+            # the new framing after acknowledging it
+            if len(packets[0][1]) >= TcpProtocol.STRUCT_VERSION.size:
+                version, = TcpProtocol.STRUCT_VERSION.unpack_from(packets[0][1], 0)
+                version = min(version, TcpProtocol.VERSION)
+                if version >= 2:
+                    self.send_packets([(b'*SW*', TcpProtocol.STRUCT_VERSION.pack(version))])
+                    self.version = version
+                    self.reader.header = TcpProtocol.STRUCT_HEADER_V2
+
             # Optionally run the auth
             if self.config['auth']:
                 self.send_packets([(b'AUTH', b'')])
@@ -161,67 +464,193 @@ class TCPHandler(socketserver.BaseRequestHandler):
             self.device = packets[0][1].decode()
             logging.info('selected device ' + str(self.device))
 
-            # Initial sync
-            self.send_initial_sync()
+            # From here on everything is sent from the writer thread of this client, this starts with the initial sync
+            name = threading.current_thread().name
+            self.queue = ClientQueue(self.request, name, self.config.get('queue-size', 512), self.version)
+            self.queue.start()
+            self.broadcaster = self.frontend.get_broadcaster(self.device)
+            self.broadcaster.add(self.queue)
 
             # Register events
-            self.callback_id = self.threadpool['hardware'][self.device].switcher.on('change', self.proxy_change)
             self.callback_upload = self.threadpool['hardware'][self.device].switcher.on('upload-done',
                                                                                         self.proxy_uploaded)
 
             # Proxying
             while True:
                 packet = self.receive()
-                pid = packet[4:8]
-                if pid.startswith(b'*'):
-                    cmd = pid[1:4].decode()
-                    handler_name = f'handle_{cmd.lower()}'
-                    if hasattr(self, handler_name):
-                        handler = getattr(self, handler_name)
-                        handler(packet)
-                    else:
-                        logging.error(f"Unknown command: {cmd}")
-                else:
-                    self.threadpool['hardware'][self.device].switcher.send_raw(packet)
+                self.handle_frame(packet)
 
 
         except ValueError as e:
             logging.error("Protocol error: " + str(e))
             return
 
+    def handle_frame(self, data):
+        # A frame can contain multiple fields, the commands for the hardware are forwarded as-is and the custom
+        # *XXX fields for the proxy are handled here
+        offset = 0
+        forward = offset
+        while offset < len(data):
+            datalen, pid = struct.unpack_from('!H2x 4s', data, offset)
+            if datalen < 8:
+                raise ValueError("Invalid field length")
+            if pid.startswith(b'*'):
+                if forward < offset:
+                    self.threadpool['hardware'][self.device].switcher.send_raw(data[forward:offset])
+                cmd = pid[1:4].decode()
+                handler_name = f'handle_{cmd.lower()}'
+                if hasattr(self, handler_name):
+                    handler = getattr(self, handler_name)
+                    handler(data[offset:offset + datalen])
+                else:
+                    logging.error(f"Unknown command: {cmd}")
+                forward = offset + datalen
+            offset += datalen
+        if forward < len(data):
+            self.threadpool['hardware'][self.device].switcher.send_raw(data[forward:])
+
     def handle_xfr(self, packet):
         task = TransferTask.from_tcp(packet)
-        id = (task.store, task.slot, task.upload)
+        id = (task.store, task.slot, task.upload, task.tid)
         if id not in self.transfer_buffer:
             self.transfer_buffer[id] = task
         else:
             self.transfer_buffer[id].data += task.data
+        self.transfer_received(id)
 
-        received = len(self.transfer_buffer[id].data)
+    def handle_xfs(self, packet):
+        # Start of a streaming transfer in version 2 of the protocol, the data follows in *XFD fields
+        task = TransferTask.from_tcp(packet)
+        task.data = bytearray()
+        self.transfer_buffer[(task.store, task.slot, task.upload, task.tid)] = task
+
+    def handle_xfd(self, packet):
+        id = TransferTask.STRUCT_STREAM.unpack_from(packet, 8)
+        task = self.transfer_buffer.get(id)
+        if task is None:
+            raise ValueError("Transfer data without *XFS")
+        task.data += packet[8 + TransferTask.STRUCT_STREAM.size:]
+        self.transfer_received(id)
+
+    def transfer_received(self, id):
+        task = self.transfer_buffer[id]
+        received = len(task.data)
         if received == task.send_length:
+            task.data = bytes(task.data)
             logging.info(f'Uploading to store {task.store} slot {task.slot}')
             hw = self.threadpool['hardware'][self.device].switcher
+            del self.transfer_buffer[id]
             if task.upload:
-                hw.upload(task.store, task.slot, b'', task=self.transfer_buffer[id])
+                if task.delta and not self.apply_delta(task):
+                    # Let the client send the full frame instead
+                    status = TransferCompleteCommand.STATUS_BASE_MISSING
+                    self.send_raw(TransferCompleteCommand(task.store, task.slot, True, status, task.tid).get_command())
+                    return
+                if task.store == 0 and self.stills is not None:
+                    # Keep the stills around as base for delta uploads
+                    self.cache_upload(task)
+                with self.uploads_lock:
+                    self.uploads.append(task)
+                queued = hw.call_threadsafe(hw.upload, task.store, task.slot, b'', task=task)
+                queued.add_done_callback(partial(self.on_upload_queued, task))
+            else:
+                logging.info(f'Download of store {task.store} slot {task.slot} requested')
+                self.frontend.downloads.request(self.device, task.store, task.slot,
+                                                partial(self.send_download, task.tid))
+
+    def cache_upload(self, task):
+        # The cache is shared by all clients, only store the frame under the hash the client sent if it matches
+        frame = bytearray(task.data_length)
+        try:
+            length = rle_decode(task.data, frame)
+        except ValueError as e:
+            logging.error(f'Not caching invalid upload: {e}')
+            return
+        if length != task.data_length or hashlib.md5(frame).digest() != task.hash:
+            logging.error('Not caching upload that does not match the frame hash')
+            return
+        self.stills.put_compressed(CachedFrame(task.hash, task.data_length, task.data))
+
+    def apply_delta(self, task):
+        base_hash = task.data[0:16]
+        base = self.stills.get_frame(base_hash) if self.stills is not None else None
+        if base is None:
+            logging.info(f'Base frame {base_hash.hex()} for delta upload is not cached')
+            return False
+        try:
+            frame = apply_delta(rle_decode(base.data), task.data[16:])
+        except ValueError as e:
+            logging.error(f'Invalid delta upload: {e}')
+            return False
+        if hashlib.md5(frame).digest() != task.hash:
+            logging.error('Delta upload does not match the frame hash')
+            return False
+        logging.info(f'Received delta upload of {len(task.data)} bytes')
+        task.data = rle_encode(frame)
+        task.send_length = len(task.data)
+        task.delta = False
+        return True
 
     def finish(self):
-        if self.callback_id is not None:
-            self.threadpool['hardware'][self.device].switcher.off('change', self.callback_id)
+        if self.broadcaster is not None:
+            self.broadcaster.remove(self.queue)
+        if self.queue is not None:
+            self.queue.close()
         if self.callback_upload is not None:
             self.threadpool['hardware'][self.device].switcher.off('upload-done', self.callback_upload)
+        self.frontend.clients.discard(self)
         self.server.numclients -= 1
 
-    def proxy_change(self, key, val):
-        if isinstance(val, bytes):
-            pass
-            # Don't send packets we can't decode yet
-            # self.send_raw(val)
+    def get_status(self):
+        address = '{}:{}'.format(*self.client_address[0:2])
+        depth = self.queue.depth() if self.queue is not None else 0
+        dropped = self.queue.dropped if self.queue is not None else 0
+        return address, self.device, depth, dropped
+
+    def send_download(self, tid, store, slot, cached):
+        if self.queue is None:
+            return
+        if cached is None:
+            status = TransferCompleteCommand.STATUS_FAILED
+            self.send_raw(TransferCompleteCommand(store, slot, False, status, tid).get_command())
+            return
+        task = TransferTask(store, slot)
+        task.tid = tid
+        task.data = cached.data
+        task.send_length = len(cached.data)
+        task.data_length = cached.length
+        task.hash = cached.hash
+        done = TransferCompleteCommand(store, slot, False, transfer=tid).get_command()
+        if self.version >= 2:
+            self.queue.put([self.list_to_packets(task.to_tcp_stream()) + done])
         else:
-            self.send_raw(val.make_packet())
+            self.queue.put([self.list_to_packets([packet]) for packet in task.to_tcp()] + [done])
 
     def proxy_uploaded(self, store, slot):
-        del self.transfer_buffer[(store, slot, True)]
-        self.send_raw(TransferCompleteCommand(store, slot, True).get_command())
+        # Only the client that sent the upload gets the completion, the uploads to a store are done in order
+        with self.uploads_lock:
+            task = next((task for task in self.uploads if (task.store, task.slot) == (store, slot)), None)
+            if task is None:
+                return
+            self.uploads.remove(task)
+        self.send_raw(TransferCompleteCommand(store, slot, True, transfer=task.tid).get_command())
+
+    def on_upload_queued(self, task, future):
+        if future.exception() is not None:
+            self.on_upload_finished(task, future)
+            return
+        task.future.add_done_callback(partial(self.on_upload_finished, task))
+
+    def on_upload_finished(self, task, future):
+        if not future.cancelled() and future.exception() is None:
+            return
+        with self.uploads_lock:
+            if task not in self.uploads:
+                return
+            self.uploads.remove(task)
+        logging.error(f'Upload to store {task.store} slot {task.slot} failed')
+        status = TransferCompleteCommand.STATUS_FAILED
+        self.send_raw(TransferCompleteCommand(task.store, task.slot, True, status, task.tid).get_command())
 
 
 class TcpFrontendThread(threading.Thread):
@@ -232,6 +661,17 @@ class TcpFrontendThread(threading.Thread):
         self.threadlist = threadlist
         self.stop = False
         self.server = None
+        self.stills = None
+        self.downloads = None
+        self.clients = set()
+        self.broadcasters = {}
+        self.lock = threading.Lock()
+
+    def get_broadcaster(self, device):
+        with self.lock:
+            if device not in self.broadcasters:
+                self.broadcasters[device] = Broadcaster(self.threadlist['hardware'][device].switcher)
+            return self.broadcasters[device]
 
     def run(self):
         logging.info('TCP frontend run')
@@ -240,10 +680,20 @@ class TcpFrontendThread(threading.Thread):
         logging.info(f'binding to {address}')
 
         socketserver.TCPServer.allow_reuse_address = True
-        handler = partial(TCPHandler, self.config, self.threadlist)
+        try:
+            self.stills = StillCache(self.config.get('stills-cache'))
+        except OSError as e:
+            logging.error(f'Could not open the stills cache, running without it: {e}')
+            self.stills = None
+        self.downloads = Downloads(self.threadlist, self.stills)
+        handler = partial(TCPHandler, self.config, self.threadlist, self)
         self.server = socketserver.ThreadingTCPServer(address, handler)
         self.server.numclients = 0
         self.server.serve_forever()
 
     def get_status(self):
         return 'running, {} clients'.format(self.server.numclients)
+
+    def get_clients(self):
+        """List of (address, device, queue depth, dropped packets) for the connected clients"""
+        return [client.get_status() for client in list(self.clients)]
@@ -1,10 +1,37 @@
+import asyncio
+import concurrent.futures
+import functools
 import threading
 import logging
 
-from pyatem.protocol import AtemProtocol
+from pyatem.protocol import AtemProtocol, AsyncAtemProtocol
 
 
-class HardwareThread(threading.Thread):
+class HardwareBase:
+    def get_status(self):
+        if self.status == 'connected':
+            name = self.switcher.mixerstate["product-name"].name
+            fw = self.switcher.mixerstate["firmware-version"].version
+            self.status += f' ({name} fw {fw})'
+        return self.status
+
+    def get_latency(self):
+        """Scheduling delay of the event loop as seen by this device in seconds, None if not running on a loop"""
+        return None
+
+    def on_connected(self):
+        self.status = 'connected'
+        logging.info(f'{self.name}: Initial state sync complete')
+
+    def on_disconnected(self):
+        self.status = 'lost connection'
+        logging.error(f'{self.name}: Lost connection with the hardware')
+
+    def on_change(self, key, value):
+        pass
+
+
+class HardwareThread(HardwareBase, threading.Thread):
     def __init__(self, config):
         threading.Thread.__init__(self)
         self.name = 'hw.' + str(config['id'])
@@ -17,9 +44,10 @@ class HardwareThread(threading.Thread):
         logging.info('HardwareThread run')
         self.status = 'connecting...'
         if self.config['address'] == 'usb':
-            self.switcher = AtemProtocol(usb='auto')
+            self.switcher = AtemProtocol(usb='auto', lazy_fields=True, skip_unchanged=True, coalesce_changes=True)
         else:
-            self.switcher = AtemProtocol(ip=self.config['address'])
+            self.switcher = AtemProtocol(ip=self.config['address'], lazy_fields=True, skip_unchanged=True,
+                                         coalesce_changes=True)
         self.switcher.on('connected', self.on_connected)
         self.switcher.on('change', self.on_change)
         self.switcher.on('disconnected', self.on_disconnected)
@@ -27,20 +55,146 @@ class HardwareThread(threading.Thread):
         while not self.stop:
             self.switcher.loop()
 
-    def get_status(self):
-        if self.status == 'connected':
-            name = self.switcher.mixerstate["product-name"].name
-            fw = self.switcher.mixerstate["firmware-version"].version
-            self.status += f' ({name} fw {fw})'
-        return self.status
 
-    def on_connected(self):
-        self.status = 'connected'
-        logging.info('Initial state sync complete')
+class HardwareLoop(threading.Thread):
+    """
+    Thread running a single asyncio event loop for the connections of all the hardware that is configured to use
+    the shared loop.
+    """
 
-    def on_disconnected(self):
-        self.status = 'lost connection'
-        logging.error('Lost connection with the hardware')
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.name = 'hw-loop'
+        self.loop = asyncio.new_event_loop()
 
-    def on_change(self, key, value):
-        pass
+    @classmethod
+    def supports(cls, config):
+        # USB and proxied devices still need their own thread
+        address = config['address']
+        return address != 'usb' and not address.startswith('tcp://')
+
+    def run(self):
+        logging.info('HardwareLoop run')
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def call(self, func, *args, **kwargs):
+        self.loop.call_soon_threadsafe(functools.partial(func, *args, **kwargs))
+
+    def submit(self, func, *args, **kwargs):
+        """Run a function on the loop, returns a concurrent.futures.Future for the return value"""
+        result = concurrent.futures.Future()
+
+        def run():
+            try:
+                result.set_result(func(*args, **kwargs))
+            except Exception as e:
+                result.set_exception(e)
+
+        self.loop.call_soon_threadsafe(run)
+        return result
+
+
+class LoopSwitcher:
+    """
+    Wrapper for an AsyncAtemProtocol that can be used from the frontend threads, the calls that send data to the
+    hardware or touch the callbacks and the state are handed over to the event loop.
+    """
+
+    def __init__(self, switcher, hwloop):
+        self.switcher = switcher
+        self.hwloop = hwloop
+
+    def __getattr__(self, name):
+        return getattr(self.switcher, name)
+
+    def _run(self, func, *args, **kwargs):
+        # The event callbacks of the frontends already run on the loop, waiting for the loop there would never return
+        if threading.current_thread() is self.hwloop:
+            return func(*args, **kwargs)
+        return self.hwloop.submit(func, *args, **kwargs).result()
+
+    def on(self, event, callback):
+        return self._run(self.switcher.on, event, callback)
+
+    def off(self, event, callback_id):
+        self._run(self.switcher.off, event, callback_id)
+
+    @property
+    def mixerstate(self):
+        """Copy of the state of the switcher, the loop changes the state itself while the frontends read it"""
+        if threading.current_thread() is self.hwloop:
+            return self.switcher.mixerstate
+        return self._run(lambda: self._copy(self.switcher.mixerstate))
+
+    def _copy(self, value):
+        if isinstance(value, dict):
+            return {key: self._copy(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return list(value)
+        return value
+
+    def send_commands(self, commands):
+        self.hwloop.call(self.switcher.send_commands, commands)
+
+    def send_raw(self, data):
+        self.hwloop.call(self.switcher.send_raw, data)
+
+    def call_threadsafe(self, func, *args, **kwargs):
+        """Run a function on the loop, returns a concurrent.futures.Future with the result"""
+        return self.hwloop.submit(func, *args, **kwargs)
+
+    # The transfer methods change the transfer queues, they have to be called on the loop with call_threadsafe(). They
+    # return the TransferTask itself instead of wrapping it in an asyncio future like the AsyncAtemProtocol does, so
+    # they can be used the same way as a device in its own thread.
+
+    def upload(self, *args, **kwargs):
+        return AtemProtocol.upload(self.switcher, *args, **kwargs)
+
+    def download(self, store, index, priority=0):
+        return AtemProtocol.download(self.switcher, store, index, priority=priority)
+
+
+class LoopHardware(HardwareBase):
+    """Hardware connection running on the shared HardwareLoop instead of its own thread"""
+
+    PROBE_INTERVAL = 1
+
+    def __init__(self, config, hwloop):
+        self.name = 'hw.' + str(config['id'])
+        self.config = config
+        self.hwloop = hwloop
+        self.switcher = None
+        self.status = 'init'
+        self.latency = None
+
+    def start(self):
+        self.hwloop.call(self._start)
+
+    def get_latency(self):
+        return self.latency
+
+    def _start(self):
+        self.status = 'connecting...'
+        switcher = AsyncAtemProtocol(self.config['address'], lazy_fields=True, skip_unchanged=True,
+                                     coalesce_changes=True)
+        switcher.on('connected', self.on_connected)
+        switcher.on('change', self.on_change)
+        switcher.on('disconnected', self.on_disconnected)
+        self.switcher = LoopSwitcher(switcher, self.hwloop)
+        self.hwloop.loop.create_task(self._connect(switcher))
+        self._probe(None)
+
+    async def _connect(self, switcher):
+        try:
+            await switcher.connect()
+        except OSError as e:
+            self.status = f'error: {e}'
+            logging.error(f'{self.name}: Could not connect to the hardware: {e}')
+
+    def _probe(self, expected):
+        # Measure how late the loop runs a timer for this device
+        now = self.hwloop.loop.time()
+        if expected is not None:
+            self.latency = now - expected
+        self.hwloop.loop.call_later(self.PROBE_INTERVAL, self._probe, now + self.PROBE_INTERVAL)
@@ -0,0 +1,180 @@
+# Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pyatem.media
+from pyatem.command import MediaplayerClipClearCommand, MediaplayerClipSetCommand
+from pyatem.mediasync import image_files, load_image
+from pyatem.transfer import TransferTask
+
+
+def frames_from_directory(path, resolution):
+    """Generator that loads an image sequence from a directory one frame at a time, sorted by filename"""
+    for file in image_files(path):
+        yield load_image(file, resolution)
+
+
+class ClipUploader:
+    """
+    Upload the frames of a clip from an iterable, like a generator reading an image sequence, without having the
+    whole clip in memory.
+
+    The frames are pulled from the iterable, converted and compressed on a worker thread just ahead of the transfers.
+    At most `lookahead` frames are being converted, queued or transferred at the same time, the next frame is only
+    pulled when the upload of a frame has finished. This keeps the memory use the same for any clip length.
+
+    The frames are uploaded to store clip + 1 with the frame number as slot, this is the store the clip lock is taken
+    for by the control software. The clip is cleared before the first frame is queued and the name and the number of
+    frames are set after the last frame is uploaded, like the control software does. Only the conversion runs on the
+    worker thread, the uploads are queued on the thread of the connection with call_threadsafe() so this works for
+    both AtemProtocol and AsyncAtemProtocol.
+
+    :param switcher: Connected AtemProtocol or AsyncAtemProtocol instance
+    :param clip: Zero based index of the clip
+    :param frames: Iterable of RGBA frames, or of uncompressed ATEM frames if convert is False
+    :param resolution: (width, height) of the frames
+    :param lookahead: Number of frames that are converted ahead of the transfer cursor
+    :param name: Name used for the uploaded frames
+    """
+
+    def __init__(self, switcher, clip, frames, resolution, lookahead=2, premultiply=False, convert=True, name=None):
+        self.switcher = switcher
+        self.clip = clip
+        self.store = clip + 1
+        self.frames = iter(frames)
+        self.resolution = resolution
+        self.lookahead = max(1, lookahead)
+        self.premultiply = premultiply
+        self.convert = convert
+        self.name = name
+
+        self.future = Future()
+        self.progress_callbacks = []
+        self.frames_done = 0
+        self.tasks = {}
+
+        self.log = logging.getLogger('ClipUploader')
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='clip-upload')
+        self.next_frame = 0
+        self.pending = 0
+        self.exhausted = False
+        self.finishing = False
+
+    def add_progress_callback(self, callback):
+        """The callback is called with the uploader and the number of uploaded frames"""
+        self.progress_callbacks.append(callback)
+
+    def start(self):
+        """Start the upload, returns a future that resolves to the number of uploaded frames"""
+        # The frames are queued after this on the same thread so the clear is always sent first
+        queued = self.switcher.call_threadsafe(self.switcher.send_commands, [MediaplayerClipClearCommand(self.clip)])
+        queued.add_done_callback(self._frame_queued)
+        for i in range(self.lookahead):
+            self._request_frame()
+        return self.future
+
+    def cancel(self):
+        """Stop pulling frames and cancel the queued uploads"""
+        with self.lock:
+            tasks = list(self.tasks.values())
+            self.exhausted = True
+        for task in tasks:
+            self.switcher.call_threadsafe(self.switcher.cancel_transfer, task)
+        self.future.cancel()
+        self.pool.shutdown(wait=False)
+
+    def _request_frame(self):
+        with self.lock:
+            if self.exhausted or self.future.done():
+                return
+            self.pending += 1
+        self.pool.submit(self._prepare_frame)
+
+    def _prepare_frame(self):
+        # Runs on the worker thread, only one frame is pulled and converted at a time
+        try:
+            try:
+                frame = next(self.frames)
+            except StopIteration:
+                with self.lock:
+                    self.exhausted = True
+                    self.pending -= 1
+                self._check_done()
+                return
+
+            if self.convert:
+                frame = pyatem.media.rgb_to_atem(frame, *self.resolution, premultiply=self.premultiply)
+            index = self.next_frame
+            self.next_frame += 1
+            task = TransferTask(self.store, index, upload=True)
+            task.data_length = len(frame)
+            task.hash = hashlib.md5(frame).digest()
+            task.data = pyatem.media.rle_encode(frame)
+            task.send_length = len(task.data)
+            task.name = self.name
+            del frame
+
+            self.log.debug(f'Queue frame {index} of clip {self.store - 1}, {task.send_length} bytes compressed')
+            with self.lock:
+                self.tasks[index] = task
+            task.future.add_done_callback(lambda future: self._frame_done(index, future))
+            queued = self.switcher.call_threadsafe(self.switcher.upload, self.store, index, task.data, task=task)
+            queued.add_done_callback(self._frame_queued)
+        except Exception as e:
+            self.log.error(f'Could not prepare clip frame: {e}')
+            self._fail(e)
+
+    def _frame_queued(self, future):
+        if future.exception() is not None:
+            self.log.error(f'Could not queue clip frame: {future.exception()}')
+            self._fail(future.exception())
+
+    def _frame_done(self, index, future):
+        with self.lock:
+            self.tasks.pop(index, None)
+            self.pending -= 1
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self._fail(future.exception())
+            return
+
+        with self.lock:
+            self.frames_done += 1
+        for callback in self.progress_callbacks:
+            callback(self, self.frames_done)
+        self._request_frame()
+        self._check_done()
+
+    def _check_done(self):
+        with self.lock:
+            done = self.exhausted and self.pending == 0 and not self.finishing
+            if done:
+                self.finishing = True
+        if not done or self.future.done():
+            return
+
+        # The clip is only usable on the switcher when the name and the frame count are set
+        self.log.info(f'Uploaded {self.frames_done} frames to clip {self.clip}')
+        setup = MediaplayerClipSetCommand(self.clip, self.name or '', self.frames_done)
+        queued = self.switcher.call_threadsafe(self.switcher.send_commands, [setup])
+        queued.add_done_callback(self._clip_set)
+
+    def _clip_set(self, future):
+        if future.exception() is not None:
+            self.log.error(f'Could not set up clip {self.clip}: {future.exception()}')
+            self._fail(future.exception())
+            return
+        if not self.future.done():
+            self.future.set_result(self.frames_done)
+        self.pool.shutdown(wait=False)
+
+    def _fail(self, exception):
+        if self.future.done():
+            return
+        self.future.set_exception(exception)
+        self.cancel()
@@ -452,6 +452,63 @@ class MediaplayerSelectCommand(Command):
         return self._make_command('MPSS', data)
 
 
+class MediaplayerClipClearCommand(Command):
+    """
+    Implementation of the `CMPC` command. This removes all frames of a clip from the media pool, it's sent before
+    uploading the frames of a new clip.
+
+    ====== ==== ====== ===========
+    Offset Size Type   Description
+    ====== ==== ====== ===========
+    0      1    u8     Clip index
+    1      3    ?      padding
+    ====== ==== ====== ===========
+
+    """
+
+    def __init__(self, index):
+        """
+        :param index: Clip index
+        """
+        self.index = index
+
+    def get_command(self):
+        data = struct.pack('>Bxxx', self.index)
+        return self._make_command('CMPC', data)
+
+
+class MediaplayerClipSetCommand(Command):
+    """
+    Implementation of the `SMPC` command. This sets the name and the number of frames of a clip in the media pool,
+    it's sent after the frames of a clip have been uploaded to make the clip usable.
+
+    ====== ==== ====== ===========
+    Offset Size Type   Description
+    ====== ==== ====== ===========
+    0      1    u8     Mask, 1=name 2=frames
+    1      1    u8     Clip index
+    2      44   char[] Name
+    46     20   ?      padding
+    66     2    u16    Number of frames
+    ====== ==== ====== ===========
+
+    """
+
+    def __init__(self, index, name, frames):
+        """
+        :param index: Clip index
+        :param name: Name of the clip
+        :param frames: Number of uploaded frames in the clip
+        """
+        self.index = index
+        self.name = name
+        self.frames = frames
+
+    def get_command(self):
+        data = struct.pack('>BB 44s 20x H', 3, self.index, self.name.encode(), self.frames)
+        return self._make_command('SMPC', data)
+
+
 class DkeyOnairCommand(Command):
     """
     Implementation of the `CDsL` command.  This sets the On Air state of the
@@ -3090,24 +3147,35 @@ class TransferCompleteCommand(Command):
     0      2    u16    Store
     2      2    u16    Slot
     4      1    bool   Is upload
-    5      3    x      padding
+    5      1    u8     Status
+    6      2    u16    Transfer id
     ====== ==== ====== ===========
 
+    The status is 0 when the transfer completed and 1 when the proxy doesn't have the base frame for a delta upload,
+    the client should send the full frame again in that case. Downloads that the proxy couldn't do have status 2.
     """
 
-    def __init__(self, store, slot, upload):
+    STATUS_OK = 0
+    STATUS_BASE_MISSING = 1
+    STATUS_FAILED = 2
+
+    def __init__(self, store, slot, upload, status=0, transfer=0):
         """
         :param store: Transfer store index
         :param slot: Transfer slot index
         :param upload: True if an upload was completed; False if a download
                        was completed
+        :param status: STATUS_OK, STATUS_BASE_MISSING or STATUS_FAILED
+        :param transfer: Transfer id the client used for the transfer
         """
         self.store = store
         self.slot = slot
         self.upload = upload
+        self.status = status
+        self.transfer = transfer
 
     def get_command(self):
-        data = struct.pack('>HH ?xxx', self.store, self.slot, self.upload)
+        data = struct.pack('>HH ?BH', self.store, self.slot, self.upload, self.status, self.transfer)
         return self._make_command('*XFC', data)
 
 
@@ -1,21 +1,66 @@
 # Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
 # SPDX-License-Identifier: LGPL-3.0-only
+import array
 import colorsys
 import struct
 import math
+import sys
 
 from pyatem.command import ColorGeneratorCommand, DkeyTieCommand, DkeyRateCommand, DkeySetFillCommand, \
     DkeySetKeyCommand, DkeyGainCommand, DkeyMaskCommand, SupersourceBoxPropertiesCommand, SupersourcePropertiesCommand
 from pyatem.hexdump import hexdump
 
+try:
+    import numpy
+except ModuleNotFoundError:
+    numpy = None
+
 
 class FieldBase:
+    @classmethod
+    def lazy(cls, raw):
+        """
+        Create a field instance without decoding the data yet. The raw data is kept as a memoryview and is only
+        decoded when an attribute is accessed for the first time, after that the decoded attributes are normal
+        instance attributes.
+
+        :param raw: bytes or memoryview with the field data, without the field header
+        """
+        self = cls.__new__(cls)
+        self._lazy = memoryview(raw)
+        return self
+
+    def __getattr__(self, name):
+        # Only called for attributes that don't exist, which for a lazy field means it hasn't been decoded yet
+        lazy = self.__dict__.pop('_lazy', None)
+        if lazy is None:
+            raise AttributeError(name)
+        self.__init__(bytes(lazy))
+        return getattr(self, name)
+
+    def decode(self):
+        """Decode the field now if it was created with lazy()"""
+        lazy = self.__dict__.pop('_lazy', None)
+        if lazy is not None:
+            self.__init__(bytes(lazy))
+        return self
+
+    def get_raw(self):
+        """The raw data of the field, for a lazy field this doesn't decode it"""
+        raw = self.__dict__.get('_lazy', None)
+        if raw is None:
+            raw = self.__dict__.get('raw', None)
+        return raw
+
     def _get_string(self, raw):
         return raw.split(b'\x00')[0].decode()
 
     def make_packet(self):
-        header = struct.pack('!H2x 4s', len(self.raw) + 8, self.__class__.CODE.encode())
-        return header + self.raw
+        raw = self.__dict__.get('_lazy', None)
+        if raw is None:
+            raw = self.raw
+        header = struct.pack('!H2x 4s', len(raw) + 8, self.__class__.CODE.encode())
+        return header + raw
 
     def serialize(self):
         return None
@@ -2947,50 +2992,95 @@ class AudioMeterLevelsField(FieldBase):
     :ivar master: Master levels
     :ivar monitor: Monitor levels
     :ivar input: All input levels as a dict, the key is the channel number and the value a level tuple
+    :ivar sources: Source index for every input channel, in the order they are in the packet
+    :ivar levels_array: All levels in dB as a single array. With numpy installed this is a (count + 2, 4) array with
+                        the master, monitor and then the input levels in the order of `sources`. Without numpy this is
+                        a flat array.array with the same values.
     """
 
     CODE = "AMLv"
+    STRUCT_HEADER = struct.Struct('>H2x 4I 4I')
+    REFERENCE = 20 * math.log10(128 * 65536)
 
     def __init__(self, raw):
         self.raw = raw
-        field = struct.unpack_from('>H2x 4I 4I', raw, 0)
-        self.count = field[0]
-        self.master = (
-            self._level(field[1]),
-            self._level(field[2]),
-            self._level(field[3]),
-            self._level(field[4])
-        )
-        self.monitor = (
-            self._level(field[5]),
-            self._level(field[6]),
-            self._level(field[7]),
-            self._level(field[8])
-        )
-        self.input = {}
-        offset = struct.calcsize('>H2x 4I 4I')
-        sources = struct.unpack_from('>{}H'.format(self.count), raw, offset)
+        self.count, = struct.unpack_from('>H', raw, 0)
+        offset = self.STRUCT_HEADER.size
+        self.sources = struct.unpack_from('>{}H'.format(self.count), raw, offset)
         offset = int(math.ceil((offset + (2 * self.count)) / 4.0) * 4)
-        field = struct.unpack_from('>{}I'.format(self.count * 4), raw, offset)
-        for i in range(0, self.count * 4, 4):
-            level = (
-                self._level(field[i]),
-                self._level(field[i + 1]),
-                self._level(field[i + 2]),
-                self._level(field[i + 3])
-            )
-            self.input[sources[i // 4]] = level
-
-    def _level(self, value):
-        if value == 0:
-            return -60
-        val = math.log10(value / (128 * 65536)) * 20
-        return val
+
+        # Decode the master, monitor and input levels in one go, the first row is master and the second row monitor,
+        # the rest of the rows are the inputs in the order of the sources list.
+        self.levels_array = self._levels(raw[4:self.STRUCT_HEADER.size] + raw[offset:offset + (16 * self.count)])
+
+        if numpy is not None:
+            rows = [tuple(row) for row in self.levels_array.tolist()]
+        else:
+            flat = self.levels_array
+            rows = [tuple(flat[i:i + 4]) for i in range(0, len(flat), 4)]
+        self.master = rows[0]
+        self.monitor = rows[1]
+        self.input = dict(zip(self.sources, rows[2:]))
+
+    def _levels(self, block):
+        """
+        Convert a block of big endian u32 levels to dB. With numpy available this returns a (n, 4) numpy array,
+        otherwise a flat array.array with the same values.
+        """
+        if numpy is not None:
+            values = numpy.frombuffer(block, dtype='>u4')
+            with numpy.errstate(divide='ignore'):
+                result = numpy.log10(values) * 20 - self.REFERENCE
+            result[values == 0] = -60
+            return result.reshape((-1, 4))
+
+        values = array.array('I', block)
+        if sys.byteorder == 'little':
+            values.byteswap()
+        return array.array('d', [math.log10(value) * 20 - self.REFERENCE if value else -60 for value in values])
 
     def __repr__(self):
         return '<audio-meter-levels count={}>'.format(self.count)
 
 
+_fairlight_table = None
+
+
+def _fairlight_level(value):
+    if value == 0:
+        return 0
+    value += 10000
+    value /= 10000
+    if value == 0:
+        return -60
+    coeff = 10 ** (40 / 20)
+    val = (math.exp((math.log(coeff + 1) * value)) - 1) / coeff
+    val = val * 60 - 60
+    return val
+
+
+def _fairlight_levels(raw, offset, count):
+    """
+    Convert a block of big endian i16 fairlight levels to dB. Instead of running the exp() for every value the
+    levels are looked up in a table that has the result for every possible i16 value. With numpy available this
+    returns a numpy array, otherwise an array.array.
+    """
+    global _fairlight_table
+    if _fairlight_table is None:
+        table = array.array('d', [_fairlight_level(value) for value in range(-32768, 32768)])
+        if numpy is not None:
+            table = numpy.frombuffer(table, dtype=numpy.float64)
+        _fairlight_table = table
+
+    if numpy is not None:
+        # Flipping the sign bit of the i16 value gives the table index, value + 32768
+        values = numpy.frombuffer(raw, dtype='>u2', count=count, offset=offset)
+        return _fairlight_table.take(values ^ 0x8000)
+
+    values = struct.unpack_from('>{}h'.format(count), raw, offset)
+    return array.array('d', [_fairlight_table[value + 32768] for value in values])
+
+
 class FairlightMeterLevelsField(FieldBase):
     """
     Data from the `FMLv`. This contains the realtime audio levels for the fairlight audio mixer
@@ -3031,57 +3121,29 @@ class FairlightMeterLevelsField(FieldBase):
     :ivar expander_gr: Gain reduction by the expander
     :ivar compressor_gr: Gain reduction by the compressor
     :ivar limiter_gr: Gain reduction by the limiter
+    :ivar levels_array: All 15 levels in dB in the order of the packet, as numpy array if available or array.array
     """
 
     CODE = "FMLv"
-    COEFF = 10 ** (40 / 20)
 
     def __init__(self, raw):
         self.raw = raw
-        field = struct.unpack_from('>6xBBH 15h', raw, 0)
-        self.index = field[2]
-        self.is_split = field[0]
-        self.subchannel = field[1]
+        self.is_split, self.subchannel, self.index = struct.unpack_from('>6xBBH', raw, 0)
 
         if self.is_split == 0xff:
             self.strip_id = f"{self.index}.{self.subchannel}"
         else:
             self.strip_id = f"{self.index}.0"
 
-        self.input = (
-            self._level(field[3]),
-            self._level(field[4]),
-            self._level(field[5]),
-            self._level(field[6])
-        )
+        self.levels_array = _fairlight_levels(raw, 10, 15)
+        field = self.levels_array.tolist()
 
-        self.expander_gr = self._level(field[7])
-        self.compressor_gr = self._level(field[8])
-        self.limiter_gr = self._level(field[9])
-
-        self.output = (
-            self._level(field[10]),
-            self._level(field[11]),
-            self._level(field[12]),
-            self._level(field[13])
-        )
-        self.level = (
-            self._level(field[14]),
-            self._level(field[15]),
-            self._level(field[16]),
-            self._level(field[17])
-        )
-
-    def _level(self, value):
-        if value == 0:
-            return 0
-        value += 10000
-        value /= 10000
-        if value == 0:
-            return -60
-        val = (math.exp((math.log(self.COEFF + 1) * value)) - 1) / self.COEFF
-        val = val * 60 - 60
-        return val
+        self.input = tuple(field[0:4])
+        self.expander_gr = field[4]
+        self.compressor_gr = field[5]
+        self.limiter_gr = field[6]
+        self.output = tuple(field[7:11])
+        self.level = tuple(field[11:15])
 
     def __repr__(self):
         return '<fairlight-meter-levels source={}>'.format(self.strip_id)
@@ -3116,48 +3178,21 @@ class FairlightMasterLevelsField(FieldBase):
     :ivar level: Volume level after fader
     :ivar compressor_gr: Gain reduction by the compressor
     :ivar limiter_gr: Gain reduction by the limiter
+    :ivar levels_array: All 14 levels in dB in the order of the packet, as numpy array if available or array.array
     """
 
     CODE = "FDLv"
-    COEFF = 10 ** (40 / 20)
 
     def __init__(self, raw):
         self.raw = raw
-        field = struct.unpack_from('>14h', raw, 0)
+        self.levels_array = _fairlight_levels(raw, 0, 14)
+        field = self.levels_array.tolist()
 
-        self.input = (
-            self._level(field[0]),
-            self._level(field[1]),
-            self._level(field[2]),
-            self._level(field[3])
-        )
-
-        self.compressor_gr = self._level(field[4])
-        self.limiter_gr = self._level(field[5])
-
-        self.output = (
-            self._level(field[6]),
-            self._level(field[7]),
-            self._level(field[8]),
-            self._level(field[9])
-        )
-        self.level = (
-            self._level(field[10]),
-            self._level(field[11]),
-            self._level(field[12]),
-            self._level(field[13])
-        )
-
-    def _level(self, value):
-        if value == 0:
-            return 0
-        value += 10000
-        value /= 10000
-        if value == 0:
-            return -60
-        val = (math.exp((math.log(self.COEFF + 1) * value)) - 1) / self.COEFF
-        val = val * 60 - 60
-        return val
+        self.input = tuple(field[0:4])
+        self.compressor_gr = field[4]
+        self.limiter_gr = field[5]
+        self.output = tuple(field[6:10])
+        self.level = tuple(field[10:14])
 
     def __repr__(self):
         return '<fairlight-master-levels>'
@@ -3507,7 +3542,8 @@ class TransferCompleteField(FieldBase):
     0      2    u16    Store
     2      2    u16    Slot
     4      1    bool   Is upload
-    5      3    x      padding
+    5      1    u8     Status
+    6      2    u16    Transfer id, 0 for older proxies
     ====== ==== ====== ===========
 
     After parsing:
@@ -3515,16 +3551,122 @@ class TransferCompleteField(FieldBase):
     :ivar store: Transfer store index
     :ivar slot: Transfer slot index
     :ivar upload: True if the transfer was an upload, False if the transfer was a download
+    :ivar transfer: Transfer id of the client, 0 if the proxy doesn't send it
+    :ivar status: 0 if the transfer completed, 1 if the proxy didn't have the base frame of a delta upload, 2 if the
+                  proxy couldn't download the slot
     """
 
     CODE = "*XFC"
+    STATUS_BASE_MISSING = 1
+    STATUS_FAILED = 2
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.store, self.slot, self.upload, self.status, self.transfer = struct.unpack('>HH ?BH', raw)
+
+    def __repr__(self):
+        return '<*transfer-complete: store={} slot={} upload={} status={}>'.format(self.store, self.slot, self.upload,
+                                                                                   self.status)
+
+
+class ProxyTransferField(FieldBase):
+    """
+    Data from the `*XFR`. This is an command that's part of OpenSwitcher for the TCP protocol and not part
+    of the actual ATEM protocol. This contains a chunk of a file transfer between the client and the proxy, with the
+    header of the transfer in front of it.
+
+    ====== ==== ====== ===========
+    Offset Size Type   Description
+    ====== ==== ====== ===========
+    0      2    u16    Transfer id
+    2      2    u16    Store
+    4      2    u16    Slot
+    6      1    u8     Flags
+    7      1    bool   Is upload
+    8      64   char[] Name
+    72     128  char[] Description
+    200    16   u8[]   MD5 hash of the uncompressed frame
+    216    4    u32    Total length of the sent data
+    220    4    u32    Length of the uncompressed frame
+    224    ?    u8[]   Chunk of the data
+    ====== ==== ====== ===========
+
+    After parsing:
+
+    :ivar transfer: Transfer id
+    :ivar store: Transfer store index
+    :ivar slot: Transfer slot index
+    :ivar flags: Transfer flags
+    :ivar upload: True if the transfer is an upload, False if the transfer is a download
+    :ivar name: Name of the file
+    :ivar description: Description of the file
+    :ivar hash: MD5 hash of the uncompressed frame
+    :ivar send_length: Total length of the data in all the chunks
+    :ivar data_length: Length of the uncompressed frame
+    :ivar data: Chunk of the data
+    """
+
+    CODE = "*XFR"
+
+    def __init__(self, raw):
+        self.raw = raw
+        field = struct.unpack_from('>HH HB? 64s 128s 16s II', raw, 0)
+        self.transfer, self.store, self.slot, self.flags, self.upload = field[0:5]
+        self.name = field[5].split(b'\x00')[0].decode()
+        self.description = field[6].split(b'\x00')[0].decode()
+        self.hash, self.send_length, self.data_length = field[7:10]
+        self.data = raw[224:]
+
+    def __repr__(self):
+        return '<*proxy-transfer: store={} slot={} upload={} data={}>'.format(self.store, self.slot, self.upload,
+                                                                              len(self.data))
+
+
+class ProxyTransferStartField(ProxyTransferField):
+    """
+    Data from the `*XFS`. This is an command that's part of OpenSwitcher for the TCP protocol and not part
+    of the actual ATEM protocol. This starts a streaming transfer in version 2 of the TCP protocol, it has the same
+    header as the `*XFR` field without any data. The data follows in `*XFD` fields.
+    """
+
+    CODE = "*XFS"
+
+
+class ProxyTransferDataField(FieldBase):
+    """
+    Data from the `*XFD`. This is an command that's part of OpenSwitcher for the TCP protocol and not part
+    of the actual ATEM protocol. This contains a chunk of a streaming transfer that was started with `*XFS`.
+
+    ====== ==== ====== ===========
+    Offset Size Type   Description
+    ====== ==== ====== ===========
+    0      2    u16    Store
+    2      2    u16    Slot
+    4      1    bool   Is upload
+    5      1    x      padding
+    6      2    u16    Transfer id
+    8      ?    u8[]   Chunk of the data
+    ====== ==== ====== ===========
+
+    After parsing:
+
+    :ivar store: Transfer store index
+    :ivar slot: Transfer slot index
+    :ivar upload: True if the transfer is an upload, False if the transfer is a download
+    :ivar transfer: Transfer id from the `*XFS` that started the transfer
+    :ivar data: Chunk of the data
+    """
+
+    CODE = "*XFD"
 
     def __init__(self, raw):
         self.raw = raw
-        self.store, self.slot, self.upload = struct.unpack('>HH ?xxx', raw)
+        self.store, self.slot, self.upload, self.transfer = struct.unpack_from('>HH ?xH', raw, 0)
+        self.data = raw[8:]
 
     def __repr__(self):
-        return '<*transfer-complete: store={} slot={} upload={}>'.format(self.store, self.slot, self.upload)
+        return '<*proxy-transfer-data: store={} slot={} upload={} data={}>'.format(self.store, self.slot, self.upload,
+                                                                                   len(self.data))
 
 
 class SupersourcePropertiesField(FieldBase):
@@ -1,30 +1,154 @@
 # Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
 # SPDX-License-Identifier: LGPL-3.0-only
+import hashlib
+import mmap
+import os
 import struct
 import pyatem.mediaconvert as mc
 
 
-def atem_to_image(data, width, height):
-    """Decompress and decode an atem frame to RGBA8888"""
-    data = rle_decode(data)
-    data = mc.atem_to_rgb(data, width, height)
-    return data
+def atem_to_image(data, width, height, output=None):
+    """
+    Decompress and decode an atem frame to RGBA8888. This is done in a single pass without materializing the
+    decompressed frame, repeated blocks are only converted once.
+
+    :param output: Optional writable buffer to write the RGBA data into, like a bytearray or a numpy array
+    :return: The RGBA data, or the number of bytes written when output is given
+    """
+    return mc.atem_rle_to_rgb(data, width, height, output)
 
 
-def image_to_atem(data, width, height):
+def image_to_atem(data, width, height, premultiply=False, threads=1, fixed=False):
     """Convert a frame to atem format and compress it"""
-    data = mc.rgb_to_atem(data, width, height)
+    data = mc.rgb_to_atem(data, width, height, premultiply, threads, fixed)
     return rle_encode(data)
 
 
-def atem_to_rgb(data, width, height):
-    """Wrapper for the native function"""
-    return mc.atem_to_rgb(data, width, height)
+def atem_to_rgb(data, width, height, output=None, threads=1, fixed=False):
+    """
+    Wrapper for the native function, optionally writing into a preallocated buffer.
+
+    The conversion runs without holding the GIL. With threads set higher than 1 the frame is split in bands of rows
+    that are converted in parallel, 0 uses a thread per core.
+
+    With fixed set the integer implementation of the conversion is used, it's faster and within 1 LSB of the default
+    floating point implementation. Out of range colors are clamped instead of wrapped.
+    """
+    return mc.atem_to_rgb(data, width, height, output, threads, fixed)
+
+
+def rgb_to_atem(data, width, height, premultiply=False, threads=1, fixed=False):
+    """Wrapper for the native function, threads and fixed work the same as for atem_to_rgb"""
+    return mc.rgb_to_atem(data, width, height, premultiply, threads, fixed)
+
+
+def map_frame(path, size=None):
+    """
+    Memory map a frame file. Without size the existing file is mapped read-only, with size a new file of that size
+    is created and mapped writable. The returned mmap can be passed to all the conversion functions in this module
+    and should be closed when done, the frame data is paged in and out by the OS instead of being copied in memory.
+    """
+    if size is None:
+        with open(path, 'rb') as handle:
+            return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    with open(path, 'w+b') as handle:
+        handle.truncate(size)
+        return mmap.mmap(handle.fileno(), size, access=mmap.ACCESS_WRITE)
+
+
+def export_frame(data, path, width, height, rgba=True, compressed=False, threads=1, fixed=False):
+    """
+    Write a frame to a file without holding a decoded copy in memory, the output is written straight into the
+    memory mapped file.
+
+    :param data: Uncompressed ATEM frame like the result of a download, or an RLE compressed frame with compressed set
+    :param rgba: Write raw RGBA8888 data, otherwise the uncompressed ATEM frame is written
+    :param compressed: The data is RLE compressed
+    """
+    frame = map_frame(path, width * height * 4)
+    try:
+        if rgba and compressed:
+            atem_to_image(data, width, height, output=frame)
+        elif rgba:
+            atem_to_rgb(data, width, height, output=frame, threads=threads, fixed=fixed)
+        elif compressed:
+            rle_decode(data, output=frame)
+        else:
+            frame[:] = data
+        frame.flush()
+    finally:
+        frame.close()
+
+
+def import_frame(path, width, height, rgba=True, premultiply=False, threads=1, fixed=False):
+    """
+    Load a raw frame file for uploading. The file is memory mapped so raw ATEM frames are hashed and compressed
+    without reading them into memory, RGBA files only need memory for the converted frame.
+
+    :param rgba: The file contains raw RGBA8888 data, otherwise it's an uncompressed ATEM frame
+    :return: (compressed data, uncompressed size, md5 hash) ready for AtemProtocol.upload with compressed set
+    """
+    size = width * height * 4
+    if os.path.getsize(path) != size:
+        raise ValueError(f'{path} is not a {width}x{height} frame')
+
+    frame = map_frame(path)
+    try:
+        if rgba:
+            atem = rgb_to_atem(frame, width, height, premultiply=premultiply, threads=threads, fixed=fixed)
+            return rle_encode(atem), size, hashlib.md5(atem).digest()
+        return rle_encode(frame), size, hashlib.md5(frame).digest()
+    finally:
+        frame.close()
+
+
+STRUCT_DELTA = struct.Struct('>III')
 
 
-def rgb_to_atem(data, width, height, premultiply=False):
-    """Wrapper for the native function"""
-    return mc.rgb_to_atem(data, width, height, premultiply)
+def frame_delta(base, frame, chunk=4096):
+    """
+    Encode the difference between two uncompressed frames of the same size. The frames are compared in chunks of
+    `chunk` bytes, runs of changed chunks are stored as an (offset, length, compressed length) header followed by the
+    RLE compressed data of that part of the new frame. Unchanged parts of the frame take no space at all.
+
+    :return: The delta, apply_delta(base, delta) gives back the new frame
+    """
+    if len(base) != len(frame):
+        raise ValueError('Frames are not the same size')
+    if chunk % 8 != 0:
+        raise ValueError('Chunk size needs to be a multiple of 8')
+
+    base = memoryview(base)
+    frame = memoryview(frame)
+    result = bytearray()
+    start = None
+    for offset in range(0, len(frame) + chunk, chunk):
+        changed = offset < len(frame) and base[offset:offset + chunk] != frame[offset:offset + chunk]
+        if changed and start is None:
+            start = offset
+        elif not changed and start is not None:
+            end = min(offset, len(frame))
+            compressed = rle_encode(frame[start:end])
+            result += STRUCT_DELTA.pack(start, end - start, len(compressed))
+            result += compressed
+            start = None
+    return bytes(result)
+
+
+def apply_delta(base, delta):
+    """Rebuild a frame from the base frame and a delta created by frame_delta, returns a new bytearray"""
+    result = bytearray(base)
+    view = memoryview(result)
+    offset = 0
+    while offset < len(delta):
+        start, length, size = STRUCT_DELTA.unpack_from(delta, offset)
+        offset += STRUCT_DELTA.size
+        if start + length > len(result) or offset + size > len(delta):
+            raise ValueError('Delta does not match the base frame')
+        if rle_decode(delta[offset:offset + size], view[start:start + length]) != length:
+            raise ValueError('Delta does not match the base frame')
+        offset += size
+    return result
 
 
 def rle_encode_slow(data):
@@ -67,7 +191,18 @@ def rle_encode(data):
     return mc.rle_encode(data)
 
 
-def rle_decode(data):
+def rle_decode(data, output=None):
+    """
+    Decompress an ATEM frame with the native decoder, see rle_decode_slow for the format description.
+
+    :param data: Compressed data, any object supporting the buffer protocol
+    :param output: Optional writable buffer to decode into, it needs to be large enough for the decoded frame
+    :return: The decoded data, or the number of bytes written when output is given
+    """
+    return mc.rle_decode(data, output)
+
+
+def rle_decode_slow(data):
     """
     ATEM frames are compressed with a custom RLE encoding. Data in the frame is grouped in 8 byte chunks since
     that is exactly 2 pixels in the 10-bit YCbCr 4:2:2 data. Most of the data is sent without compression but
@@ -107,6 +242,61 @@ def rle_decode(data):
     return result
 
 
+class RleDecoder:
+    """
+    Incremental version of rle_decode for data that arrives in chunks. The decoded data is written into a buffer of
+    the expected size that is allocated once, the raw parts are copied in one slice instead of per 8-byte block.
+
+    :ivar length: Number of decoded bytes so far
+    """
+    MARKER = b'\xfe\xfe\xfe\xfe\xfe\xfe\xfe\xfe'
+
+    def __init__(self, size):
+        self.output = bytearray(size)
+        self.length = 0
+        self.pending = b''
+
+    def _find_marker(self, data, offset):
+        # Only RLE headers aligned to the 8 byte blocks count, 0xfe bytes can also occur inside pixel data
+        marker = data.find(self.MARKER, offset)
+        while marker != -1 and (marker - offset) % 8 != 0:
+            marker = data.find(self.MARKER, marker + 1)
+        return marker
+
+    def feed(self, data):
+        if len(self.pending) > 0:
+            data = self.pending + data
+        output = self.output
+        length = self.length
+        offset = 0
+        while True:
+            marker = self._find_marker(data, offset)
+
+            # Copy the raw blocks up to the next RLE header in one go
+            stop = len(data) if marker == -1 else marker
+            stop -= (stop - offset) % 8
+            output[length:stop - offset + length] = data[offset:stop]
+            length += stop - offset
+            offset = stop
+
+            # Keep incomplete blocks around until the next chunk arrives
+            if marker == -1 or len(data) - marker < 24:
+                break
+
+            count, = struct.unpack_from('>Q', data, marker + 8)
+            output[length:length + count * 8] = data[marker + 16:marker + 24] * count
+            length += count * 8
+            offset = marker + 24
+
+        self.pending = bytes(data[offset:])
+        self.length = length
+
+    def result(self):
+        if self.length == len(self.output):
+            return self.output
+        return self.output[0:self.length]
+
+
 if __name__ == '__main__':
     with open('/workspace/test.bin', 'wb') as handle:
         handle.write(
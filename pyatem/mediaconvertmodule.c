@@ -6,6 +6,10 @@ SPDX-License-Identifier: LGPL-3.0-only
 #define RLE_HEADER 0xFEFEFEFEFEFEFEFE
 
 #include <Python.h>
+#include <pthread.h>
+#include <unistd.h>
+
+#define MAX_THREADS 64
 
 const double bt709_coeff_r = 0.2126;
 const double bt709_coeff_g = 0.7152;
@@ -38,96 +42,246 @@ clamp(unsigned short v, unsigned short min, unsigned short max)
     return t > max ? max : t;
 }
 
-static PyObject *
-method_atem_to_rgb(PyObject *self, PyObject *args)
+void
+atem_block_to_rgb(const char *buffer, unsigned char *outbuffer)
 {
-    Py_buffer input_buffer;
-    Py_ssize_t data_length;
-    unsigned int width, height;
-    PyObject *res;
+    // Convert 10-bit BT.709 Y'CbCrA 4:2:2 to RGB
+    // Unpack bytes to 2xY 2xA and a B and R pair
+    unsigned short a1 = (buffer[0] << 4) + ((buffer[1] & 0xf0) >> 4);
+    unsigned short a2 = (buffer[4] << 4) + ((buffer[5] & 0xf0) >> 4);
+    unsigned short cb = ((buffer[1] & 0x0f) << 6) + ((buffer[2] & 0xfc) >> 2);
+    unsigned short cr = ((buffer[5] & 0x0f) << 6) + ((buffer[6] & 0xfc) >> 2);
+    unsigned short y1 = ((buffer[2] & 0x03) << 8) + (buffer[3] & 0xff);
+    unsigned short y2 = ((buffer[6] & 0x03) << 8) + (buffer[7] & 0xff);
+
+    float cbf = bt709_bi_range * ((cb << 6) - cr_offset);
+    float crf = bt709_ri_range * ((cr << 6) - cr_offset);
+    float y1f = ((double) (y1 << 6) - y_offset) / y_range;
+    float y2f = ((double) (y2 << 6) - y_offset) / y_range;
+
+    float r1f = fmin(255, y1f + crf);
+    float g1f = fmin(255, y1f - cbf * bt709_coeff_bg - crf * bt709_coeff_rg);
+    float b1f = fmin(255, y1f + cbf);
+    float r2f = fmin(255, y2f + crf);
+    float g2f = fmin(255, y2f - cbf * bt709_coeff_bg - crf * bt709_coeff_rg);
+    float b2f = fmin(255, y2f + cbf);
+
+    outbuffer[0] = (unsigned char) r1f;
+    outbuffer[1] = (unsigned char) g1f;
+    outbuffer[2] = (unsigned char) b1f;
+    outbuffer[3] = (unsigned char) (((double) (a1 - 16)) / 3.6);
+    outbuffer[4] = (unsigned char) r2f;
+    outbuffer[5] = (unsigned char) g2f;
+    outbuffer[6] = (unsigned char) b2f;
+    outbuffer[7] = (unsigned char) (((double) (a2 - 16)) / 3.6);
+}
 
-    /* Parse arguments */
-    if (!PyArg_ParseTuple(args, "y*II", &input_buffer, &width, &height)) {
-        return NULL;
+int
+get_output_buffer(PyObject *output, Py_buffer *view, Py_ssize_t length)
+{
+    // Get a writable buffer from the caller supplied output object that fits at least length bytes
+    if (PyObject_GetBuffer(output, view, PyBUF_WRITABLE) < 0) {
+        return -1;
     }
+    if (view->len < length) {
+        PyBuffer_Release(view);
+        PyErr_SetString(PyExc_ValueError, "Output buffer too small for decoded data");
+        return -1;
+    }
+    return 0;
+}
 
-    data_length = input_buffer.len;
-    char *buffer;
-    char *resbuffer = (char *) malloc(data_length);
+void
+atem_to_rgb_range(const unsigned char *buffer, unsigned char *outbuffer, Py_ssize_t length, int premultiply)
+{
+    for (Py_ssize_t i = 0; i < length; i += 8) {
+        atem_block_to_rgb((const char *) buffer + i, outbuffer + i);
+    }
+}
 
-    if (resbuffer == NULL) {
-        return PyErr_NoMemory();
+// Fixed point version of atem_to_rgb_range. The coefficients are scaled by 2^16 and all math is done with 32 bit
+// integers without branches so the compiler can vectorize the loop. For legal range input the result is within 1 LSB
+// of the float version, out of range values are clamped instead of wrapping around.
+#define FIX16(x) ((int32_t) ((x) * 65536.0 + 0.5))
+#define FIX21(x) ((int32_t) ((x) * 2097152.0 + 0.5))
+
+static inline int32_t
+clamp_int(int32_t v, int32_t min, int32_t max)
+{
+    const int32_t t = v < min ? min : v;
+    return t > max ? max : t;
+}
+
+void
+atem_to_rgb_range_fixed(const unsigned char *buffer, unsigned char *outbuffer, Py_ssize_t length, int premultiply)
+{
+    const int32_t k_y = FIX16(64.0 / 219.0);
+    const int32_t k_cr_r = FIX16(64.0 * 0.7874 / 112.0);
+    const int32_t k_cb_b = FIX16(64.0 * 0.9278 / 112.0);
+    const int32_t k_cb_g = FIX16(64.0 * 0.9278 / 112.0 * 0.0722 / 0.7152);
+    const int32_t k_cr_g = FIX16(64.0 * 0.7874 / 112.0 * 0.2126 / 0.7152);
+    const int32_t k_a = FIX16(1.0 / 3.6);
+
+    for (Py_ssize_t i = 0; i < length; i += 8) {
+        const unsigned char *in = buffer + i;
+        unsigned char *out = outbuffer + i;
+
+        int32_t a1 = (in[0] << 4) | (in[1] >> 4);
+        int32_t a2 = (in[4] << 4) | (in[5] >> 4);
+        int32_t cb = (((in[1] & 0x0f) << 6) | (in[2] >> 2)) - 512;
+        int32_t cr = (((in[5] & 0x0f) << 6) | (in[6] >> 2)) - 512;
+        int32_t y1 = ((((in[2] & 0x03) << 8) | in[3]) - 64) * k_y;
+        int32_t y2 = ((((in[6] & 0x03) << 8) | in[7]) - 64) * k_y;
+
+        int32_t r = cr * k_cr_r;
+        int32_t g = -cb * k_cb_g - cr * k_cr_g;
+        int32_t b = cb * k_cb_b;
+
+        out[0] = (unsigned char) clamp_int((y1 + r) >> 16, 0, 255);
+        out[1] = (unsigned char) clamp_int((y1 + g) >> 16, 0, 255);
+        out[2] = (unsigned char) clamp_int((y1 + b) >> 16, 0, 255);
+        out[3] = (unsigned char) clamp_int(((a1 - 16) * k_a) >> 16, 0, 255);
+        out[4] = (unsigned char) clamp_int((y2 + r) >> 16, 0, 255);
+        out[5] = (unsigned char) clamp_int((y2 + g) >> 16, 0, 255);
+        out[6] = (unsigned char) clamp_int((y2 + b) >> 16, 0, 255);
+        out[7] = (unsigned char) clamp_int(((a2 - 16) * k_a) >> 16, 0, 255);
     }
+}
 
-    char *outbuffer = resbuffer;
+struct convert_job {
+    void (*func)(const unsigned char *, unsigned char *, Py_ssize_t, int);
+    const unsigned char *input;
+    unsigned char *output;
+    Py_ssize_t length;
+    int premultiply;
+};
 
-    int pixel_size = 8;
-    buffer = input_buffer.buf;
-    for (int i = 0; i < data_length; i += pixel_size) {
-        // Convert 10-bit BT.709 Y'CbCrA 4:2:2 to RGB
-        // Unpack bytes to 2xY 2xA and a B and R pair
-        unsigned short a1 = (buffer[0] << 4) + ((buffer[1] & 0xf0) >> 4);
-        unsigned short a2 = (buffer[4] << 4) + ((buffer[5] & 0xf0) >> 4);
-        unsigned short cb = ((buffer[1] & 0x0f) << 6) + ((buffer[2] & 0xfc) >> 2);
-        unsigned short cr = ((buffer[5] & 0x0f) << 6) + ((buffer[6] & 0xfc) >> 2);
-        unsigned short y1 = ((buffer[2] & 0x03) << 8) + (buffer[3] & 0xff);
-        unsigned short y2 = ((buffer[6] & 0x03) << 8) + (buffer[7] & 0xff);
-
-        float cbf = bt709_bi_range * ((cb << 6) - cr_offset);
-        float crf = bt709_ri_range * ((cr << 6) - cr_offset);
-        float y1f = ((double) (y1 << 6) - y_offset) / y_range;
-        float y2f = ((double) (y2 << 6) - y_offset) / y_range;
-
-        float r1f = fmin(255, y1f + crf);
-        float g1f = fmin(255, y1f - cbf * bt709_coeff_bg - crf * bt709_coeff_rg);
-        float b1f = fmin(255, y1f + cbf);
-        float r2f = fmin(255, y2f + crf);
-        float g2f = fmin(255, y2f - cbf * bt709_coeff_bg - crf * bt709_coeff_rg);
-        float b2f = fmin(255, y2f + cbf);
-
-        outbuffer[0] = (unsigned char) r1f;
-        outbuffer[1] = (unsigned char) g1f;
-        outbuffer[2] = (unsigned char) b1f;
-        outbuffer[3] = (unsigned char) (((double) (a1 - 16)) / 3.6);
-        outbuffer[4] = (unsigned char) r2f;
-        outbuffer[5] = (unsigned char) g2f;
-        outbuffer[6] = (unsigned char) b2f;
-        outbuffer[7] = (unsigned char) (((double) (a2 - 16)) / 3.6);
-        outbuffer += pixel_size;
-        buffer += pixel_size;
+void *
+convert_thread(void *arg)
+{
+    struct convert_job *job = arg;
+    job->func(job->input, job->output, job->length, job->premultiply);
+    return NULL;
+}
+
+int
+thread_count(int threads)
+{
+    // 0 means one thread per core
+    if (threads <= 0) {
+        threads = (int) sysconf(_SC_NPROCESSORS_ONLN);
+    }
+    if (threads < 1) {
+        return 1;
     }
+    return threads > MAX_THREADS ? MAX_THREADS : threads;
+}
 
-    res = Py_BuildValue("y#", resbuffer, data_length);
-    free(resbuffer);
-    return res;
+void
+convert_bands(void (*func)(const unsigned char *, unsigned char *, Py_ssize_t, int), const unsigned char *input,
+              unsigned char *output, Py_ssize_t length, unsigned int width, int premultiply, int threads)
+{
+    // Split the frame in bands of rows and convert every band in its own thread, the calling thread does the
+    // last band. Has to be called without holding the GIL.
+    struct convert_job jobs[MAX_THREADS];
+    pthread_t handles[MAX_THREADS];
+    int started[MAX_THREADS];
+    Py_ssize_t row_size = (Py_ssize_t) width * 4;
+    if (row_size < 8) {
+        row_size = 8;
+    }
+    Py_ssize_t rows = (length + row_size - 1) / row_size;
+    if (threads > rows) {
+        threads = (int) rows;
+    }
+    if (threads <= 1) {
+        func(input, output, length, premultiply);
+        return;
+    }
+
+    // Bands are rounded up to complete 2-pixel blocks
+    Py_ssize_t band = ((rows + threads - 1) / threads) * row_size;
+    band = (band + 7) & ~((Py_ssize_t) 7);
+
+    int count = 0;
+    for (Py_ssize_t offset = 0; offset < length; offset += band) {
+        jobs[count].func = func;
+        jobs[count].input = input + offset;
+        jobs[count].output = output + offset;
+        jobs[count].length = length - offset < band ? length - offset : band;
+        jobs[count].premultiply = premultiply;
+        count++;
+    }
+    for (int i = 0; i < count - 1; i++) {
+        started[i] = pthread_create(&handles[i], NULL, convert_thread, &jobs[i]) == 0;
+        if (!started[i]) {
+            // Couldn't start a thread, convert the band here instead
+            convert_thread(&jobs[i]);
+        }
+    }
+    convert_thread(&jobs[count - 1]);
+    for (int i = 0; i < count - 1; i++) {
+        if (started[i]) {
+            pthread_join(handles[i], NULL);
+        }
+    }
 }
 
 static PyObject *
-method_rgb_to_atem(PyObject *self, PyObject *args)
+method_atem_to_rgb(PyObject *self, PyObject *args)
 {
     Py_buffer input_buffer;
+    Py_buffer output_buffer;
     Py_ssize_t data_length;
-    unsigned int width, height, premultiply;
-    PyObject *res;
+    unsigned int width, height;
+    int threads = 1;
+    int fixed = 0;
+    PyObject *output = Py_None;
+    PyObject *res = NULL;
+    unsigned char *outbuffer;
 
     /* Parse arguments */
-    if (!PyArg_ParseTuple(args, "y*IIp", &input_buffer, &width, &height, &premultiply)) {
+    if (!PyArg_ParseTuple(args, "y*II|Oip", &input_buffer, &width, &height, &output, &threads, &fixed)) {
         return NULL;
     }
 
-    data_length = input_buffer.len;
-    unsigned char *buffer;
-    buffer = input_buffer.buf;
+    // Only complete 2-pixel blocks can be converted
+    data_length = input_buffer.len - (input_buffer.len % 8);
 
-    char *outbuffer = (char *) malloc(data_length);
-    if (outbuffer == NULL) {
-        return PyErr_NoMemory();
+    if (output != Py_None) {
+        if (get_output_buffer(output, &output_buffer, data_length) < 0) {
+            PyBuffer_Release(&input_buffer);
+            return NULL;
+        }
+        outbuffer = output_buffer.buf;
+    } else {
+        res = PyBytes_FromStringAndSize(NULL, data_length);
+        if (res == NULL) {
+            PyBuffer_Release(&input_buffer);
+            return NULL;
+        }
+        outbuffer = (unsigned char *) PyBytes_AS_STRING(res);
     }
 
-    char *writepointer = outbuffer;
+    threads = thread_count(threads);
+    Py_BEGIN_ALLOW_THREADS
+    convert_bands(fixed ? atem_to_rgb_range_fixed : atem_to_rgb_range, input_buffer.buf, outbuffer, data_length, width,
+                  0, threads);
+    Py_END_ALLOW_THREADS
 
+    PyBuffer_Release(&input_buffer);
+    if (output != Py_None) {
+        PyBuffer_Release(&output_buffer);
+        return PyLong_FromSsize_t(data_length);
+    }
+    return res;
+}
+
+void
+rgb_to_atem_range(const unsigned char *buffer, unsigned char *writepointer, Py_ssize_t length, int premultiply)
+{
     int pixel_size = 8;
-    for (int i = 0; i < data_length; i += pixel_size) {
+    for (Py_ssize_t i = 0; i < length; i += pixel_size) {
         // Convert RGBA 8888 to 10-bit BT.709 Y'CbCrA
         float r1 = (float)buffer[0] / 255;
         float g1 = (float)buffer[1] / 255;
@@ -171,9 +325,86 @@ method_rgb_to_atem(PyObject *self, PyObject *args)
         writepointer += pixel_size;
         buffer += pixel_size;
     }
+}
+
+void
+rgb_to_atem_range_fixed(const unsigned char *buffer, unsigned char *outbuffer, Py_ssize_t length, int premultiply)
+{
+    // Fixed point version of rgb_to_atem_range. The color channels are multiplied by the alpha, or by 255 without
+    // premultiplying, so both cases share the coefficients which are scaled by 2^21/65025
+    const int32_t k_y_r = FIX21(0.2126 * 876.0 / 65025.0);
+    const int32_t k_y_g = FIX21(0.7152 * 876.0 / 65025.0);
+    const int32_t k_y_b = FIX21(0.0722 * 876.0 / 65025.0);
+    const int32_t k_cb_r = FIX21(0.2126 * 896.0 / 1.8556 / 65025.0);
+    const int32_t k_cb_g = FIX21(0.7152 * 896.0 / 1.8556 / 65025.0);
+    const int32_t k_cb_b = FIX21(0.9278 * 896.0 / 1.8556 / 65025.0);
+    const int32_t k_cr_r = FIX21(0.7874 * 896.0 / 1.5748 / 65025.0);
+    const int32_t k_cr_g = FIX21(0.7152 * 896.0 / 1.5748 / 65025.0);
+    const int32_t k_cr_b = FIX21(0.0722 * 896.0 / 1.5748 / 65025.0);
+
+    for (Py_ssize_t i = 0; i < length; i += 8) {
+        const unsigned char *in = buffer + i;
+        unsigned char *out = outbuffer + i;
+
+        int32_t m1 = premultiply ? in[3] : 255;
+        int32_t m2 = premultiply ? in[7] : 255;
+        int32_t r1 = in[0] * m1;
+        int32_t g1 = in[1] * m1;
+        int32_t b1 = in[2] * m1;
+        int32_t r2 = in[4] * m2;
+        int32_t g2 = in[5] * m2;
+        int32_t b2 = in[6] * m2;
+
+        int32_t y10a = clamp_int((r1 * k_y_r + g1 * k_y_g + b1 * k_y_b + (64 << 21)) >> 21, 64, 940);
+        int32_t y10b = clamp_int((r2 * k_y_r + g2 * k_y_g + b2 * k_y_b + (64 << 21)) >> 21, 64, 940);
+        int32_t cb10 = clamp_int((b2 * k_cb_b + (512 << 21) - r2 * k_cb_r - g2 * k_cb_g) >> 21, 44, 960);
+        int32_t cr10 = clamp_int((r2 * k_cr_r + (512 << 21) - g2 * k_cr_g - b2 * k_cr_b) >> 21, 44, 960);
+        int32_t a10a = ((in[3] << 2) * 219 / 255) + (15 << 2) + 1;
+        int32_t a10b = ((in[7] << 2) * 219 / 255) + (15 << 2) + 1;
+
+        out[0] = (unsigned char) (a10a >> 4);
+        out[1] = (unsigned char) (((a10a & 0x0f) << 4) | (cb10 >> 6));
+        out[2] = (unsigned char) (((cb10 & 0x3f) << 2) | (y10a >> 8));
+        out[3] = (unsigned char) (y10a & 0xff);
+        out[4] = (unsigned char) (a10b >> 4);
+        out[5] = (unsigned char) (((a10b & 0x0f) << 4) | (cr10 >> 6));
+        out[6] = (unsigned char) (((cr10 & 0x3f) << 2) | (y10b >> 8));
+        out[7] = (unsigned char) (y10b & 0xff);
+    }
+}
 
-    res = Py_BuildValue("y#", outbuffer, data_length);
-    free(outbuffer);
+static PyObject *
+method_rgb_to_atem(PyObject *self, PyObject *args)
+{
+    Py_buffer input_buffer;
+    Py_ssize_t data_length;
+    unsigned int width, height;
+    int premultiply;
+    int threads = 1;
+    int fixed = 0;
+    PyObject *res;
+
+    /* Parse arguments */
+    if (!PyArg_ParseTuple(args, "y*IIp|ip", &input_buffer, &width, &height, &premultiply, &threads, &fixed)) {
+        return NULL;
+    }
+
+    // Only complete 2-pixel blocks can be converted
+    data_length = input_buffer.len - (input_buffer.len % 8);
+
+    res = PyBytes_FromStringAndSize(NULL, data_length);
+    if (res == NULL) {
+        PyBuffer_Release(&input_buffer);
+        return NULL;
+    }
+
+    threads = thread_count(threads);
+    Py_BEGIN_ALLOW_THREADS
+    convert_bands(fixed ? rgb_to_atem_range_fixed : rgb_to_atem_range, input_buffer.buf,
+                  (unsigned char *) PyBytes_AS_STRING(res), data_length, width, premultiply, threads);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&input_buffer);
     return res;
 }
 
@@ -192,6 +423,10 @@ method_rle_encode(PyObject *self, PyObject *args)
     Py_ssize_t c = 0, i, w;
     uint64_t *data = input_buffer.buf;
     uint64_t *buf = malloc(input_buffer.len);
+    if (buf == NULL && input_buffer.len > 0) {
+        PyBuffer_Release(&input_buffer);
+        return PyErr_NoMemory();
+    }
     for (i = 0, w = 0, c = 0; i < input_buffer.len / 8; ++i) {
         assert(data[i] != RLE_HEADER);
         if (i != 0 && data[i - 1] == data[i]) {
@@ -226,13 +461,168 @@ method_rle_encode(PyObject *self, PyObject *args)
 
     res = Py_BuildValue("y#", buf, w * 8);
     free(buf);
+    PyBuffer_Release(&input_buffer);
+    return res;
+}
+
+uint64_t
+begetu64(const unsigned char *buf)
+{
+    uint64_t v = 0;
+    for (int i = 0; i < 8; i++) v = (v << 8) | buf[i];
+    return v;
+}
+
+int
+is_rle_header(const unsigned char *buf)
+{
+    for (int i = 0; i < 8; i++) {
+        if (buf[i] != 0xfe) return 0;
+    }
+    return 1;
+}
+
+Py_ssize_t
+rle_decode_into(const unsigned char *data, Py_ssize_t len, unsigned char *out, Py_ssize_t out_len, int convert)
+{
+    // Decode the RLE data into out, with out set to NULL only the decoded length is calculated. With convert set the
+    // blocks are converted to RGBA while decoding, repeated blocks are only converted once.
+    // Returns -1 with a Python exception set on invalid data or when out is too small.
+    Py_ssize_t i = 0, w = 0;
+    unsigned char block[8];
+    while (i < len) {
+        if (len - i >= 8 && is_rle_header(data + i)) {
+            if (len - i < 24) {
+                PyErr_SetString(PyExc_ValueError, "Truncated RLE block");
+                return -1;
+            }
+            uint64_t count = begetu64(data + i + 8);
+            if (count > (uint64_t) (PY_SSIZE_T_MAX - w) / 8) {
+                PyErr_SetString(PyExc_ValueError, "RLE repeat count too large");
+                return -1;
+            }
+            Py_ssize_t size = (Py_ssize_t) count * 8;
+            if (out != NULL) {
+                if (size > out_len - w) {
+                    PyErr_SetString(PyExc_ValueError, "Output buffer too small for decoded data");
+                    return -1;
+                }
+                if (convert) {
+                    atem_block_to_rgb((const char *) data + i + 16, block);
+                } else {
+                    memcpy(block, data + i + 16, 8);
+                }
+                for (uint64_t j = 0; j < count; j++) {
+                    memcpy(out + w + j * 8, block, 8);
+                }
+            }
+            w += size;
+            i += 24;
+        } else {
+            // Copy the raw blocks up to the next RLE header at once
+            Py_ssize_t start = i;
+            i += 8;
+            while (i + 8 <= len && !is_rle_header(data + i)) {
+                i += 8;
+            }
+            if (i > len) {
+                // Trailing partial block, there's no pixels to convert in it
+                i = len;
+                if (convert) {
+                    break;
+                }
+            }
+            if (out != NULL) {
+                if (i - start > out_len - w) {
+                    PyErr_SetString(PyExc_ValueError, "Output buffer too small for decoded data");
+                    return -1;
+                }
+                if (convert) {
+                    for (Py_ssize_t j = start; j < i; j += 8) {
+                        atem_block_to_rgb((const char *) data + j, out + w + j - start);
+                    }
+                } else {
+                    memcpy(out + w, data + start, i - start);
+                }
+            }
+            w += i - start;
+        }
+    }
+    return w;
+}
+
+PyObject *
+rle_decode_buffer(Py_buffer *input_buffer, PyObject *output, int convert)
+{
+    // Shared implementation for rle_decode and atem_rle_to_rgb, releases the input buffer
+    Py_buffer output_buffer;
+    PyObject *res;
+    Py_ssize_t length;
+
+    if (output != Py_None) {
+        // Decode into the buffer supplied by the caller and return the decoded length
+        if (PyObject_GetBuffer(output, &output_buffer, PyBUF_WRITABLE) < 0) {
+            PyBuffer_Release(input_buffer);
+            return NULL;
+        }
+        length = rle_decode_into(input_buffer->buf, input_buffer->len, output_buffer.buf, output_buffer.len, convert);
+        PyBuffer_Release(&output_buffer);
+        PyBuffer_Release(input_buffer);
+        if (length < 0) {
+            return NULL;
+        }
+        return PyLong_FromSsize_t(length);
+    }
+
+    // Scan the headers first so the result can be allocated once
+    length = rle_decode_into(input_buffer->buf, input_buffer->len, NULL, 0, convert);
+    if (length < 0) {
+        PyBuffer_Release(input_buffer);
+        return NULL;
+    }
+    res = PyBytes_FromStringAndSize(NULL, length);
+    if (res == NULL) {
+        PyBuffer_Release(input_buffer);
+        return NULL;
+    }
+    rle_decode_into(input_buffer->buf, input_buffer->len, (unsigned char *) PyBytes_AS_STRING(res), length, convert);
+    PyBuffer_Release(input_buffer);
     return res;
 }
 
+static PyObject *
+method_rle_decode(PyObject *self, PyObject *args)
+{
+    Py_buffer input_buffer;
+    PyObject *output = Py_None;
+
+    /* Parse arguments */
+    if (!PyArg_ParseTuple(args, "y*|O", &input_buffer, &output)) {
+        return NULL;
+    }
+    return rle_decode_buffer(&input_buffer, output, 0);
+}
+
+static PyObject *
+method_atem_rle_to_rgb(PyObject *self, PyObject *args)
+{
+    Py_buffer input_buffer;
+    unsigned int width, height;
+    PyObject *output = Py_None;
+
+    /* Parse arguments */
+    if (!PyArg_ParseTuple(args, "y*II|O", &input_buffer, &width, &height, &output)) {
+        return NULL;
+    }
+    return rle_decode_buffer(&input_buffer, output, 1);
+}
+
 static PyMethodDef MediaConvertMethods[] = {
     {"atem_to_rgb", method_atem_to_rgb, METH_VARARGS, "Convert an Atem YCbCrA frame to RGB8888"},
     {"rgb_to_atem", method_rgb_to_atem, METH_VARARGS, "Convert an RGB8888 frame to Atem YCbCrA"},
     {"rle_encode",  method_rle_encode,  METH_VARARGS, "Compress data using the custom Atem RLE encoding"},
+    {"rle_decode",  method_rle_decode,  METH_VARARGS, "Decompress Atem RLE data, optionally into a writable buffer"},
+    {"atem_rle_to_rgb", method_atem_rle_to_rgb, METH_VARARGS, "Decompress and convert an Atem frame to RGB8888 in one pass"},
     {NULL,          NULL,               0,            NULL},
 };
 
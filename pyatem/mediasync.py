@@ -0,0 +1,172 @@
+# Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pyatem.media
+from pyatem.stillcache import CachedFrame
+
+try:
+    from PIL import Image
+except ModuleNotFoundError:
+    Image = None
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+
+class SyncEntry:
+    """
+    A single still that should end up in a media pool slot
+
+    :ivar slot: Zero based index of the still slot
+    :ivar path: Image file for the slot
+    :ivar name: Name for the slot, defaults to the filename without extension
+    :ivar hash: md5 hash of the converted frame, the same hash the switcher reports in mediaplayer-file-info
+    """
+
+    def __init__(self, slot, path, name=None):
+        self.slot = slot
+        self.path = path
+        self.name = name if name is not None else os.path.splitext(os.path.basename(path))[0]
+        self.hash = None
+
+    def __repr__(self):
+        return f'<SyncEntry slot={self.slot} path={self.path}>'
+
+
+def load_image(path, resolution):
+    """Load an image with pillow and fit it in a frame of the resolution, returns the RGBA data"""
+    im = Image.open(path)
+    frame = Image.new('RGBA', resolution)
+    im.thumbnail(resolution, Image.Resampling.LANCZOS)
+    frame.paste(im)
+    return frame.tobytes()
+
+
+def image_files(path):
+    """The image files in a directory sorted by filename"""
+    files = sorted(name for name in os.listdir(path) if name.lower().endswith(IMAGE_EXTENSIONS))
+    return [os.path.join(path, name) for name in files]
+
+
+def entries_from_directory(path, first_slot=0):
+    """Create sync entries for all images in a directory, sorted by filename and assigned to consecutive slots"""
+    return [SyncEntry(first_slot + i, file) for i, file in enumerate(image_files(path))]
+
+
+def entries_from_manifest(path):
+    """
+    Load sync entries from a JSON manifest. The manifest maps slot numbers to image files, the slot numbers start at 1
+    like in the control software. Paths are relative to the manifest. An entry can also be an object with a file and
+    a name::
+
+        {
+            "1": "intro.png",
+            "2": {"file": "logo.png", "name": "Logo"}
+        }
+    """
+    with open(path) as handle:
+        manifest = json.load(handle)
+
+    base = os.path.dirname(os.path.abspath(path))
+    result = []
+    for slot, entry in manifest.items():
+        name = None
+        if isinstance(entry, dict):
+            name = entry.get('name')
+            entry = entry['file']
+        result.append(SyncEntry(int(slot) - 1, os.path.join(base, entry), name))
+    result.sort(key=lambda e: e.slot)
+    return result
+
+
+class MediaSync:
+    """
+    Synchronize a set of stills to the media pool of a connected switcher. The images are converted to frames in
+    parallel and only the slots where the md5 hash of the frame differs from the hash in mediaplayer-file-info are
+    uploaded.
+
+    :param switcher: Connected AtemProtocol instance
+    :param threads: Number of images converted at the same time, 0 for one per core
+    :param premultiply: Premultiply the alpha channel of the images
+    :param cache: Optional StillCache, images that have been converted before are not converted again
+    """
+
+    def __init__(self, switcher, threads=0, premultiply=False, cache=None):
+        if Image is None:
+            raise RuntimeError("Media sync requires pillow to load the images")
+        self.switcher = switcher
+        self.threads = threads if threads > 0 else (os.cpu_count() or 1)
+        self.premultiply = premultiply
+        self.cache = cache
+        self.log = logging.getLogger('MediaSync')
+
+    def _resolution(self):
+        return self.switcher.mixerstate['video-mode'].get_resolution()
+
+    def _slot_hash(self, slot):
+        info = self.switcher.mixerstate.get('mediaplayer-file-info', {}).get(slot)
+        if info is None or not info.is_used:
+            return None
+        return info.hash
+
+    def convert(self, path, resolution):
+        """Load an image and convert it to an uncompressed frame at the resolution"""
+        return pyatem.media.rgb_to_atem(load_image(path, resolution), *resolution, premultiply=self.premultiply)
+
+    def _check(self, entry, resolution):
+        # Returns the converted frame or the CachedFrame if the slot needs to be uploaded, None if it's up to date
+        if self.cache is not None:
+            frame = self.cache.frame_for_file(entry.path, resolution, self.premultiply,
+                                              lambda path: self.convert(path, resolution))
+            entry.hash = frame.hash
+        else:
+            frame = self.convert(entry.path, resolution)
+            entry.hash = hashlib.md5(frame).digest()
+        if entry.hash == self._slot_hash(entry.slot):
+            return None
+        return frame
+
+    def _compare(self, entries):
+        """
+        Convert the images in batches of the thread count and yield the entries with the frame if the slot differs
+        from the switcher or None if it's up to date. Only a single batch of frames is kept in memory.
+        """
+        stills = self.switcher.mixerstate['mediaplayer-slots'].stills
+        for entry in entries:
+            if entry.slot < 0 or entry.slot >= stills:
+                raise ValueError(f'Slot {entry.slot + 1} out of range, this hardware has {stills} still slots')
+
+        resolution = self._resolution()
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            for start in range(0, len(entries), self.threads):
+                batch = entries[start:start + self.threads]
+                yield from zip(batch, pool.map(lambda e: self._check(e, resolution), batch))
+
+    def plan(self, entries):
+        """Convert and hash the images of the entries and return the entries for the slots that need an upload"""
+        result = [entry for entry, frame in self._compare(entries) if frame is not None]
+        self.log.info(f'{len(result)} of {len(entries)} stills differ from the media pool')
+        return result
+
+    def sync(self, entries):
+        """
+        Upload the stills that differ from the media pool, the uploads of a batch are queued before the next batch
+        is converted. The uploads are queued with switcher.call_threadsafe(), returns a concurrent.futures.Future for
+        every queued upload that resolves to its TransferTask.
+        """
+        tasks = []
+        for entry, frame in self._compare(entries):
+            if frame is None:
+                self.log.debug(f'Slot {entry.slot + 1} is up to date')
+                continue
+            self.log.info(f'Upload {entry.path} to slot {entry.slot + 1}')
+            if isinstance(frame, CachedFrame):
+                tasks.append(frame.upload(self.switcher, entry.slot, name=entry.name))
+            else:
+                tasks.append(self.switcher.call_threadsafe(self.switcher.upload, 0, entry.slot, frame, name=entry.name))
+        self.log.info(f'Uploading {len(tasks)} of {len(entries)} stills')
+        return tasks
@@ -1,16 +1,31 @@
 # Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
 # SPDX-License-Identifier: LGPL-3.0-only
+import asyncio
+import concurrent.futures
 import logging
+import queue
 import struct
 
-from pyatem.transfer import TransferTask, TransferQueueFlushed
-from pyatem.transport import UdpProtocol, Packet, UsbProtocol, TcpProtocol, ConnectionReady
+from pyatem.transfer import TransferTask, TransferQueueFlushed, TransferQueueProgress
+from pyatem.transport import UdpProtocol, Packet, UsbProtocol, TcpProtocol, ConnectionReady, AsyncUdpProtocol
 from pyatem.command import LockCommand, TransferDownloadRequestCommand, TransferAckCommand, \
     TransferUploadRequestCommand, TransferDataCommand, TransferFileDataCommand, PartialLockCommand, TimeRequestCommand
 from pyatem.media import rle_decode
 import pyatem.field as fieldmodule
 
 
+def _make_field_registry(pretty, unique, strip):
+    """
+    Build the lookup table for incoming fields, this maps the 4-byte field code from the wire to a tuple of
+    (pretty name, field class, index struct, has strip id). The class and index struct are None if they don't exist.
+    """
+    registry = {}
+    for code, key in pretty.items():
+        classname = key.title().replace('-', '') + "Field"
+        registry[code.encode()] = (key, getattr(fieldmodule, classname, None), unique.get(key), key in strip)
+    return registry
+
+
 class AtemProtocol:
     STRUCT_FIELD = struct.Struct('!H2x 4s')
 
@@ -121,6 +136,9 @@ class AtemProtocol:
         'FDLv': 'fairlight-master-levels',
         'CCdP': 'camera-control-data-packet',
         '*XFC': 'transfer-complete',
+        '*XFR': 'proxy-transfer',
+        '*XFS': 'proxy-transfer-start',
+        '*XFD': 'proxy-transfer-data',
         '_SSC': 'supersource-config',
         'SSrc': 'supersource-properties',
         'SSBP': 'supersource-box-properties',
@@ -176,16 +194,24 @@ class AtemProtocol:
         'supersource-properties': struct.Struct('>B'),
     }
 
-    def __init__(self, ip=None, port=9910, usb=None):
+    # Fields where the first index is replaced by the strip id decoded by the field class
+    FIELDNAME_STRIP = {
+        'fairlight-strip-properties',
+        'atem-eq-band-properties',
+        'audio-input',
+    }
+
+    FIELD_REGISTRY = _make_field_registry(FIELDNAME_PRETTY, FIELDNAME_UNIQUE, FIELDNAME_STRIP)
+
+    def __init__(self, ip=None, port=9910, usb=None, lazy_fields=False, skip_unchanged=False, coalesce_changes=False):
+        """
+        :param lazy_fields: Only decode fields when an attribute is accessed
+        :param skip_unchanged: Don't raise change events for fields that are byte-identical to the stored field
+        :param coalesce_changes: Also raise a single `changes` event with all changed fields of every packet
+        """
         if ip is None and usb is None:
             raise ValueError("Need either an ip or usb port")
-        if ip is not None:
-            if ip.startswith('tcp://'):
-                self.transport = TcpProtocol(url=ip)
-            else:
-                self.transport = UdpProtocol(ip, port)
-        else:
-            self.transport = UsbProtocol(usb)
+        self.transport = self._make_transport(ip, port, usb)
 
         self.log = logging.getLogger('AtemProtocol')
         self.transport.queue_callback = self.queue_callback
@@ -194,17 +220,27 @@ class AtemProtocol:
         self.inputs = {}
         self.callback_idx = 1
         self.connected = False
+        self.lazy_fields = lazy_fields
+        self.skip_unchanged = skip_unchanged
+        self.coalesce_changes = coalesce_changes
+        self._changes = None
 
         self.locks = {}
         self.mode = None
+        self.lock_requests = set()
         self.transfer_queue = {}
         self.transfer_id = 42
-        self.transfer_buffer = b''
-        self.transfer_buffer2 = []
-        self.transfer = None
-        self.transfer_requested = False
-        self.transfer_packets = 0
-        self.transfer_budget = []
+        self.transfers = {}
+        self.proxy_transfers = {}
+        self._calls = queue.SimpleQueue()
+        self.max_transfers = 4
+
+    def _make_transport(self, ip, port, usb):
+        if ip is not None:
+            if ip.startswith('tcp://'):
+                return TcpProtocol(url=ip)
+            return UdpProtocol(ip, port)
+        return UsbProtocol(usb)
 
     @classmethod
     def usb_exists(cls):
@@ -215,8 +251,36 @@ class AtemProtocol:
         self.transport.connect()
 
     def loop(self):
+        self._run_calls()
         self.log.debug('Waiting for data packet...')
         packet = self.transport.receive_packet()
+        self._process_packet(packet)
+        self._run_calls()
+
+    def call_threadsafe(self, func, *args, **kwargs):
+        """
+        Run a function on the thread that calls loop(), returns a concurrent.futures.Future with the result. The
+        transfer queues are only changed from that thread, use this to queue or cancel transfers from other threads.
+        The function runs the next time loop() handles a packet.
+        """
+        result = concurrent.futures.Future()
+        self._calls.put((result, func, args, kwargs))
+        return result
+
+    def _run_calls(self):
+        while True:
+            try:
+                result, func, args, kwargs = self._calls.get_nowait()
+            except queue.Empty:
+                return
+            if not result.set_running_or_notify_cancel():
+                continue
+            try:
+                result.set_result(func(*args, **kwargs))
+            except Exception as e:
+                result.set_exception(e)
+
+    def _process_packet(self, packet):
         if packet is None:
             # Disconnected from hardware
             if self.connected:
@@ -233,6 +297,11 @@ class AtemProtocol:
         if isinstance(packet, TransferQueueFlushed):
             self._queue_flushed()
             return
+        if isinstance(packet, TransferQueueProgress):
+            self.queue_callback(packet.remaining, packet.size, packet.transfer)
+            return
+        if self.coalesce_changes:
+            self._changes = []
         try:
             for fieldname, data in self.decode_packet(packet.data):
                 self.save_field_data(fieldname, data)
@@ -241,6 +310,12 @@ class AtemProtocol:
             self._raise('disconnected')
             self.mixerstate = {}
             self.connected = False
+            return
+        finally:
+            changes = self._changes
+            self._changes = None
+        if changes:
+            self._raise('changes', changes)
 
     def on(self, event, callback):
         if event not in self.callbacks:
@@ -257,6 +332,9 @@ class AtemProtocol:
     def get_link_quality(self):
         return self.transport.get_link_quality()
 
+    def get_window_occupancy(self):
+        return self.transport.get_window_occupancy()
+
     def _raise(self, event, *args, **kwargs):
         if event in self.callbacks:
             for cbidx in self.callbacks[event]:
@@ -264,6 +342,7 @@ class AtemProtocol:
 
     def decode_packet(self, data):
         offset = 0
+        view = memoryview(data)
         while offset < len(data):
             datalen, cmd = self.STRUCT_FIELD.unpack_from(data, offset)
 
@@ -272,18 +351,34 @@ class AtemProtocol:
             if datalen == 0:
                 raise ConnectionError()
 
-            raw = data[offset + 8:offset + datalen]
+            raw = view[offset + 8:offset + datalen]
             yield (cmd, raw)
             offset += datalen
 
     def save_field_data(self, fieldname, contents):
         raw = contents
-        key = fieldname.decode()
-        if key in self.FIELDNAME_PRETTY:
-            key = self.FIELDNAME_PRETTY[key]
-            classname = key.title().replace('-', '') + "Field"
-            if hasattr(fieldmodule, classname):
-                contents = getattr(fieldmodule, classname)(contents)
+        registered = self.FIELD_REGISTRY.get(fieldname)
+        if registered is None:
+            key = fieldname.decode()
+            fieldclass = None
+            index_struct = None
+            has_strip_id = False
+        else:
+            key, fieldclass, index_struct, has_strip_id = registered
+
+        # The switcher sends a lot of state again that didn't change, skip those fields before doing any work. The
+        # index of fields with a strip id is only known after decoding, those are checked further down.
+        if self.skip_unchanged and not has_strip_id and key != 'InCm':
+            idxes = index_struct.unpack_from(raw, 0) if index_struct is not None else ()
+            if self._is_unchanged(key, idxes, raw):
+                return
+
+        if fieldclass is None:
+            contents = bytes(raw)
+        elif self.lazy_fields:
+            contents = fieldclass.lazy(raw)
+        else:
+            contents = fieldclass(bytes(raw))
 
         if key == 'CapA':
             return
@@ -291,7 +386,8 @@ class AtemProtocol:
         if key == 'lock-obtained':
             self.log.info('Got lock for {}'.format(contents.store))
             self.locks[contents.store] = True
-            self._transfer_trigger(contents.store)
+            self.lock_requests.discard(contents.store)
+            self._transfer_trigger()
             return
         elif key == 'lock-state':
             if contents.state:
@@ -303,97 +399,141 @@ class AtemProtocol:
             self.log.debug(contents)
             return
         elif key == 'file-transfer-continue-data':
-            self.transfer_budget = contents
-            old = self.transfer_budget.size
-            self.transfer_budget.size = self.transfer_budget.size // 8 * 8
-            if old != self.transfer_budget.size:
-                self.log.debug(f"Adjusted transfer chunk size from {old} to {self.transfer_budget.size}")
-            self._queue_chunks()
+            task = self.transfers.get(contents.transfer)
+            if task is None:
+                self.log.warning(f"Got FTCD for unknown transfer {contents.transfer}")
+                return
+            task.budget = contents
+            old = task.budget.size
+            task.budget.size = task.budget.size // 8 * 8
+            if old != task.budget.size:
+                self.log.debug(f"Adjusted transfer chunk size from {old} to {task.budget.size}")
+            task.state = 'sending'
+            self._queue_chunks(task)
             return
         elif key == 'file-transfer-data':
-            if contents.transfer == self.transfer.tid:
-                self.transfer_packets += 1
-                self.transfer_buffer += contents.data
-                if self.transfer_packets % 20 == 0:
-                    total_size = self.mixerstate['video-mode'].get_pixels() * 4
-                    transfer_progress = len(self.transfer_buffer) / total_size
-                    self._raise('transfer-progress', self.transfer.store, self.transfer.slot, transfer_progress)
-                # The 0 should be the transfer slot, but it seems it's always 0 in practice
-                self.send_commands([TransferAckCommand(self.transfer.tid, 0)])
-            else:
+            task = self.transfers.get(contents.transfer)
+            if task is None:
                 self.log.error('Got file transfer data for wrong transfer id')
+                return
+            task.receive(contents.data)
+            if task.packets % 20 == 0:
+                transfer_progress = task.download_progress()
+                if transfer_progress is not None:
+                    task.set_progress(transfer_progress)
+                    self._raise('transfer-progress', task.store, task.slot, transfer_progress)
+            # The 0 should be the transfer slot, but it seems it's always 0 in practice
+            self.send_commands([TransferAckCommand(task.tid, 0)])
             return
         elif key == 'file-transfer-error':
             self.log.error(f"file-transfer-error: {str(contents)}")
-            self.transfer_requested = False
+            task = self.transfers.get(contents.transfer)
+            if task is None:
+                return
             if contents.status == 1:
-                # Status is try-again
-                self.log.debug('Retrying transfer')
-                self._transfer_trigger(self.transfer.store, retry=True)
+                # Status is try-again. When other transfers are running the hardware is probably busy with those,
+                # wait for them to finish before asking again
+                if len(self.transfers) > 1:
+                    self.log.debug('Hardware busy, requeue transfer')
+                    self._requeue(task)
+                else:
+                    self.log.debug('Retrying transfer')
+                    self._start_transfer(task, retry=True)
             elif contents.status == 5:
-                self.locks[self.transfer.store] = False
-                self._transfer_trigger(self.transfer.store, retry=True)
+                self.locks[task.store] = False
+                self._requeue(task)
+                self._transfer_trigger()
+            else:
+                del self.transfers[task.tid]
+                task.state = 'failed'
+                if not task.future.done():
+                    task.future.set_exception(RuntimeError(f'Transfer failed: {contents}'))
+                self._transfer_trigger()
             return
         elif key == 'file-transfer-data-complete':
             self.log.debug('Transfer complete')
-            if self.transfer is None:
+            task = self.transfers.pop(contents.transfer, None)
+            if task is None:
                 self.log.warning("Got FTDC without transfer active")
                 return
-            if contents.transfer != self.transfer.tid:
-                return
-            # Remove current item from the transfer queue
-            queue = self.transfer_queue[self.transfer.store]
-            self.transfer_queue[self.transfer.store] = queue[1:]
+            task.state = 'done'
 
-            if self.transfer.upload:
-                self._raise('upload-done', self.transfer.store, self.transfer.slot)
-                self.transfer_requested = False
+            if task.upload:
+                task.set_progress(1)
+                self._raise('upload-done', task.store, task.slot)
+                if not task.future.done():
+                    task.future.set_result(None)
             else:
-                # Assemble the buffer
-                data = self.transfer_buffer
-                self.transfer_buffer = b''
-                self.transfer_requested = False
-
-                # Decompress the buffer if needed
-                if self.transfer.store == 0:
-                    data = rle_decode(data)
-
-                self._raise('download-done', self.transfer.store, self.transfer.slot, data)
-
-            # Start next transfer in the queue
-            self._transfer_trigger(self.transfer.store)
+                data = task.finish_download()
+                task.set_progress(1)
+                self._raise('download-done', task.store, task.slot, data)
+                if not task.future.done():
+                    task.future.set_result(data)
+
+            # Start the next transfers in the queue
+            self._transfer_trigger()
             return
         elif key == 'transfer-complete':
             self.log.debug('Proxy transfer complete')
+            task = self._proxy_task(contents)
+            if task is not None:
+                del self.proxy_transfers[task.tid]
+
+            status = contents.status
+            if status == fieldmodule.TransferCompleteField.STATUS_BASE_MISSING and task is not None and task.delta:
+                self.log.info('Proxy does not have the base frame for the delta, sending the full frame')
+                task.use_full()
+                self.proxy_transfers[task.tid] = task
+                self.transport.upload(task)
+                return
 
-            # Remove current item from the transfer queue
-            queue = self.transfer_queue[contents.store]
-            self.transfer_queue[contents.store] = queue[1:]
-
-            if contents.upload:
+            if status == fieldmodule.TransferCompleteField.STATUS_FAILED:
+                self.log.error(f'Transfer for {contents.store}:{contents.slot} failed on the proxy')
+                if task is not None:
+                    task.state = 'failed'
+                    if not task.future.done():
+                        task.future.set_exception(RuntimeError('Transfer failed on the proxy'))
+            elif contents.upload:
                 self._raise('upload-done', contents.store, contents.slot)
+                if task is not None:
+                    task.state = 'done'
+                    if not task.future.done():
+                        task.future.set_result(None)
+            elif task is None:
+                self.log.warning(f'Got download for {contents.store}:{contents.slot} that was not requested')
             else:
-                # TODO: Implement proxy download
-                pass
-            # Start next transfer in the queue
-            self._transfer_trigger(self.transfer.store)
+                data = task.finish_download()
+                task.state = 'done'
+                task.set_progress(1)
+                self._raise('download-done', task.store, task.slot, data)
+                if not task.future.done():
+                    task.future.set_result(data)
+            return
+        elif key in ('proxy-transfer', 'proxy-transfer-start', 'proxy-transfer-data'):
+            task = self._proxy_task(contents)
+            if task is None or task.upload:
+                self.log.warning(f'Got transfer data for {contents.store}:{contents.slot} that was not requested')
+                return
+            if len(contents.data) > 0:
+                task.receive(contents.data)
+                transfer_progress = task.download_progress()
+                if transfer_progress is not None:
+                    task.set_progress(transfer_progress)
+                    self._raise('transfer-progress', task.store, task.slot, transfer_progress)
             return
         elif key == 'key-properties-dve':
             preset = contents.mini_preset_key
             if preset is not None:
                 self._raise('pip-preset', preset)
 
-        if key in self.FIELDNAME_UNIQUE:
-            idxes = self.FIELDNAME_UNIQUE[key].unpack_from(raw, 0)
+        idxes = self.field_index(fieldname, contents)
+        if self.skip_unchanged and has_strip_id and self._is_unchanged(key, idxes, raw):
+            return
+
+        if index_struct is not None:
             if key not in self.mixerstate:
                 self.mixerstate[key] = {}
 
-            # Fairlight strips have weird numbering that's harder to parse here, read it back from the class
-            if hasattr(contents, 'strip_id'):
-                idxes = list(idxes)
-                idxes[0] = contents.strip_id
-                idxes = tuple(idxes)
-
             unique = self.make_unique_dict(contents, idxes)
             self.mixerstate[key] = self.recursive_merge(self.mixerstate[key], unique)
             self._raise('change:' + key + ':' + str(idxes[0]), contents)
@@ -409,6 +549,39 @@ class AtemProtocol:
             if isinstance(self.transport, TcpProtocol):
                 self._raise('connected')
         self._raise('change', key, contents)
+        if self._changes is not None:
+            self._changes.append((key, contents))
+
+    @classmethod
+    def field_index(cls, fieldname, contents):
+        """
+        The index of a field in the mixerstate, this is an empty tuple for fields that are stored directly under
+        their name
+
+        :param fieldname: The 4-byte field code
+        :param contents: The field instance, or the raw bytes for fields without a field class
+        """
+        registered = cls.FIELD_REGISTRY.get(fieldname)
+        if registered is None or registered[2] is None:
+            return ()
+        key, fieldclass, index_struct, has_strip_id = registered
+        raw = contents.get_raw() if isinstance(contents, fieldmodule.FieldBase) else contents
+        idxes = index_struct.unpack_from(raw, 0)
+
+        # Fairlight strips have weird numbering that's harder to parse here, read it back from the class
+        if has_strip_id:
+            idxes = (contents.strip_id,) + idxes[1:]
+        return idxes
+
+    def _is_unchanged(self, key, idxes, raw):
+        previous = self.mixerstate.get(key)
+        for idx in idxes:
+            if not isinstance(previous, dict):
+                return False
+            previous = previous.get(idx)
+        if isinstance(previous, fieldmodule.FieldBase):
+            previous = previous.get_raw()
+        return previous is not None and previous == raw
 
     def make_unique_dict(self, content, path):
         result = {}
@@ -436,43 +609,68 @@ class AtemProtocol:
         if len(data) > 1300:
             raise ValueError("Command list too long for UDP packet")
 
-        self.send_raw(data)
+        return self.send_raw(data)
 
     def send_raw(self, data):
         packet = Packet()
         packet.flags = UdpProtocol.FLAG_RELIABLE
         packet.data = data
-        self.transport.send_packet(packet)
+        return self.transport.send_packet(packet)
 
-    def queue_callback(self, remaining, size):
-        if not self.transfer:
+    def queue_callback(self, remaining, size, transfer=None):
+        task = self.transfers.get(transfer)
+        if task is None or not task.upload:
             return
 
-        self.transfer.send_done += size
-        fraction = self.transfer.send_done / self.transfer.send_length
-        self._raise('upload-progress', self.transfer.store, self.transfer.slot, fraction * 100, self.transfer.send_done,
-                    self.transfer.send_length)
+        task.send_done += size
+        fraction = task.send_done / task.send_length
+        task.set_progress(fraction)
+        self._raise('upload-progress', task.store, task.slot, fraction * 100, task.send_done, task.send_length)
 
-    def download(self, store, index):
+    def download(self, store, index, priority=0):
         self.log.info("Queue download of {}:{}".format(store, index))
         if store not in self.transfer_queue:
             self.transfer_queue[store] = []
-        self.transfer_queue[store].append(TransferTask(store, index))
-        self._transfer_trigger(store)
+        task = TransferTask(store, index, priority=priority)
+        if isinstance(self.transport, TcpProtocol):
+            # The proxy does the transfer from the hardware and sends the data back in one go
+            self._prepare_download(task)
+            task.state = 'requested'
+            # The id is a u16 in the TCP protocol, 0 means it's not set
+            self.transfer_id = self.transfer_id % 0xffff + 1
+            task.tid = self.transfer_id
+            self.proxy_transfers[task.tid] = task
+            self.transport.download(task)
+            return task
+        self.transfer_queue[store].append(task)
+        self._transfer_trigger()
+        return task
 
     def upload(self, store, index, data, compress=True, compressed=False, name=None, description=None, size=None,
-               task=None):
+               task=None, priority=0, hash=None, base=None):
+        """
+        Queue an upload. With compressed set the data is already RLE compressed, when the md5 hash and the uncompressed
+        size of the frame are passed as well the data doesn't have to be decompressed again to calculate them.
+
+        When connected through the TCP proxy base can be set to the uncompressed frame that's currently in the slot.
+        If the difference to that frame is smaller than the compressed frame only the difference is sent to the
+        proxy, the number of bytes this saves is stored in task.bytes_saved. The hardware itself always receives the
+        full frame.
+        """
         self.log.info("Queue upload of {}:{}".format(store, index))
         if store not in self.transfer_queue:
             self.transfer_queue[store] = []
 
         if task is None:
-            task = TransferTask(store, index, upload=True)
+            task = TransferTask(store, index, upload=True, priority=priority)
             task.data = data
             task.send_length = len(data)
             task.name = name
             task.description = description
-            if compressed:
+            if compressed and hash is not None and size is not None:
+                task.hash = hash
+                task.data_length = size
+            elif compressed:
                 uncompressed = rle_decode(data)
                 task.data = uncompressed
                 task.calculate_hash()
@@ -481,122 +679,265 @@ class AtemProtocol:
                 task.calculate_hash()
             if compress:
                 task.compress()
-            elif compressed:
+            elif compressed and task.data_length is None:
                 task.data_length = len(rle_decode(data))
+            if base is not None and isinstance(self.transport, TcpProtocol):
+                frame = rle_decode(data) if compressed else data
+                if task.use_delta(frame, base):
+                    self.log.info(f'Sending the upload as delta, saves {task.bytes_saved} bytes')
 
         self.log.info(f'New upload task is {len(task.data)} bytes, {task.data_length} uncompressed')
 
         if isinstance(self.transport, TcpProtocol):
+            # The id is a u16 in the TCP protocol, 0 means it's not set
+            self.transfer_id = self.transfer_id % 0xffff + 1
+            task.tid = self.transfer_id
+            self.proxy_transfers[task.tid] = task
             self.transport.upload(task)
         else:
             self.transfer_queue[store].append(task)
-            self._transfer_trigger(store)
-
-    def _queue_chunks(self):
+            self._transfer_trigger()
+        return task
+
+    def cancel_transfer(self, task):
+        """
+        Cancel a queued or running transfer. Chunks of a running upload that are already queued on the transport are
+        still sent, the hardware drops the transfer when it doesn't complete.
+        """
+        if task.state in ('done', 'failed', 'cancelled'):
+            return False
+        queue = self.transfer_queue.get(task.store, [])
+        if task in queue:
+            queue.remove(task)
+        elif self.transfers.get(task.tid) is task:
+            del self.transfers[task.tid]
+        else:
+            return False
+        self.log.info(f'Cancelled {task}')
+        task.state = 'cancelled'
+        task.future.cancel()
+        self._transfer_trigger()
+        return True
+
+    def _queue_chunks(self, task):
         # Can't transfer without a chunk size
-        if self.transfer_budget is None:
+        if task.budget is None:
             self.log.error('Cannot transfer without chunk size')
             return
 
-        # Only queue chunks if an upload is planned
-        if self.transfer is None:
-            self.log.error('No transfer scheduled')
-            return
-
-        if not self.transfer.upload:
-            self.log.error('Current transfer is a download')
-            return
-
-        chunk_size = self.transfer_budget.size
-        self.log.debug(f'Queue {self.transfer_budget.count} chunks of {chunk_size}')
-        for i in range(0, self.transfer_budget.count):
-            if len(self.transfer.data) == 0:
+        chunk_size = task.budget.size
+        self.log.debug(f'Queue {task.budget.count} chunks of {chunk_size} for {task}')
+        data = memoryview(task.data)
+        for i in range(0, task.budget.count):
+            start = task.offset
+            if start >= len(data):
                 break
 
-            chunk = self.transfer.data[0:chunk_size]
-            used = chunk_size
-            if chunk[-8:] == b'\xFE\xFE\xFE\xFE\xFE\xFE\xFE\xFE':
-                chunk = self.transfer.data[0:chunk_size - 8]
-                used -= 8
-            elif chunk[-16:-8] == b'\xFE\xFE\xFE\xFE\xFE\xFE\xFE\xFE':
-                chunk = self.transfer.data[0:chunk_size - 16]
-                used -= 16
-            self.transfer.data = self.transfer.data[used:]
-
-            self.transfer_budget.count -= 1
-            if self.transfer_budget.count == 0:
+            # Don't split the chunks in the middle of an RLE header
+            end = min(start + chunk_size, len(data))
+            if data[end - 8:end] == b'\xFE\xFE\xFE\xFE\xFE\xFE\xFE\xFE':
+                end -= 8
+            elif data[end - 16:end - 8] == b'\xFE\xFE\xFE\xFE\xFE\xFE\xFE\xFE':
+                end -= 16
+            chunk = data[start:end]
+            task.offset = end
+
+            task.budget.count -= 1
+            if task.budget.count == 0:
                 self.log.debug('Transfer budget ran out')
-                self.transfer_budget = None
+                task.budget = None
 
-            cmd = TransferDataCommand(self.transfer.tid, chunk)
+            cmd = TransferDataCommand(task.tid, chunk)
             packet = Packet()
             packet.flags = UdpProtocol.FLAG_RELIABLE
             packet.data = cmd.get_command()
+            packet.transfer = task.tid
             self.transport.queue_packet(packet)
         self.transport.queue_trigger()
 
     def _queue_flushed(self):
         self.log.info('Queue flushed')
-        if len(self.transfer.data):
-            self._queue_chunks()
-            return
-        self.log.info('Sending file metadata')
-        cmd = TransferFileDataCommand(self.transfer.tid, self.transfer.hash,
-                                      name=self.transfer.name, description=self.transfer.description)
-        self.send_commands([cmd])
-
-    def _transfer_trigger(self, store, retry=False):
-        next = None
-
-        self.log.info(f'transfer trigger for store {store} (retry={retry})')
-
-        # Try the preferred queue
-        if store in self.transfer_queue:
-            if len(self.transfer_queue[store]) > 0:
-                next = self.transfer_queue[store][0]
-
-        # Try any queue
-        if next is None:
-            for store in self.transfer_queue:
-                if len(self.transfer_queue[store]) > 0:
-                    next = self.transfer_queue[store][0]
-                    break
+        for task in list(self.transfers.values()):
+            if not task.upload or task.state != 'sending':
+                continue
+            if task.remaining():
+                # Wait for the next FTCD if the chunk budget ran out
+                if task.budget is not None:
+                    self._queue_chunks(task)
+                continue
+            self.log.info(f'Sending file metadata for {task}')
+            task.state = 'finishing'
+            cmd = TransferFileDataCommand(task.tid, task.hash, name=task.name, description=task.description)
+            self.send_commands([cmd])
 
-        self.log.info(f'next transfer: {next}')
+    def _requeue(self, task):
+        del self.transfers[task.tid]
+        task.state = None
+        self.transfer_queue[task.store].insert(0, task)
+
+    def _transfer_trigger(self):
+        # Pick the next task for every store that doesn't have a running transfer, the highest priority first and
+        # in queue order for tasks with the same priority
+        active = {task.store for task in self.transfers.values()}
+        pending = []
+        for store, queue in self.transfer_queue.items():
+            if len(queue) > 0 and store not in active:
+                pending.append(max(queue, key=lambda task: task.priority))
+        pending.sort(key=lambda task: task.priority, reverse=True)
+
+        for task in pending:
+            if len(self.transfers) >= self.max_transfers:
+                break
 
-        # All transfers done, clean locks
-        if next is None:
-            for lock in self.locks:
-                if self.locks[lock]:
-                    self.log.info('Releasing lock {}'.format(lock))
-                    cmd = LockCommand(lock, False)
+            # Request a lock if needed
+            if task.store != 0xffff and not self.locks.get(task.store):
+                if task.store not in self.lock_requests:
+                    self.log.info('Requesting lock for {}'.format(task.store))
+                    self.lock_requests.add(task.store)
+                    cmd = PartialLockCommand(task.store, task.slot)
                     self.send_commands([cmd])
-            return
+                continue
 
-        # Request a lock if needed
-        if next.store != 0xffff and (next.store not in self.locks or not self.locks[next.store]):
-            self.log.info('Requesting lock for {}'.format(next.store))
-            cmd = PartialLockCommand(next.store, next.slot)
-            self.send_commands([cmd])
-            return
+            self._start_transfer(task)
 
-        # A transfer request is already running, don't start a new one
-        if self.transfer_requested:
-            self.log.info('Request already submitted, do nothing')
-            return
+        # Clean the locks of stores that have no transfers left
+        active = {task.store for task in self.transfers.values()}
+        for lock in self.locks:
+            if self.locks[lock] and lock not in active and len(self.transfer_queue.get(lock, [])) == 0:
+                self.log.info('Releasing lock {}'.format(lock))
+                self.locks[lock] = False
+                cmd = LockCommand(lock, False)
+                self.send_commands([cmd])
 
+    def _start_transfer(self, task, retry=False):
         # Assign a transfer id and start the transfer
         if not retry:
             self.transfer_id += 1
-        self.transfer = next
-        self.transfer.tid = self.transfer_id
-
-        if self.transfer.upload:
-            cmd = TransferUploadRequestCommand(self.transfer.tid, self.transfer.store, self.transfer.slot,
-                                               self.transfer.data_length, 1)
-            self.log.info('Requesting upload to {}:{}'.format(next.store, next.slot))
+            task.tid = self.transfer_id
+            self.transfer_queue[task.store].remove(task)
+            self.transfers[task.tid] = task
+            task.offset = 0
+        task.state = 'requested'
+
+        if task.upload:
+            cmd = TransferUploadRequestCommand(task.tid, task.store, task.slot, task.data_length, 1)
+            self.log.info('Requesting upload to {}:{}'.format(task.store, task.slot))
         else:
-            cmd = TransferDownloadRequestCommand(self.transfer.tid, self.transfer.store, self.transfer.slot)
-            self.log.info('Requesting download of {}:{}'.format(next.store, next.slot))
-        self.transfer_requested = True
+            self._prepare_download(task)
+            cmd = TransferDownloadRequestCommand(task.tid, task.store, task.slot)
+            self.log.info('Requesting download of {}:{}'.format(task.store, task.slot))
         self.send_commands([cmd])
+
+    def _proxy_task(self, contents):
+        # The transfer id is sent back by the proxy, older proxies only send the store and slot. In that case it's
+        # the oldest transfer for that slot since the proxy handles them in order.
+        task = self.proxy_transfers.get(contents.transfer)
+        if task is not None:
+            return task
+        for task in self.proxy_transfers.values():
+            if (task.store, task.slot, task.upload) == (contents.store, contents.slot, contents.upload):
+                return task
+        return None
+
+    def _prepare_download(self, task):
+        # Stills are RLE compressed frames, the size after decompression is known from the video mode
+        frame_size = None
+        if task.store != 0xffff and 'video-mode' in self.mixerstate:
+            frame_size = self.mixerstate['video-mode'].get_pixels() * 4
+        task.start_download(frame_size, compressed=task.store == 0)
+
+
+class AsyncAtemProtocol(AtemProtocol):
+    """
+    AtemProtocol running on an asyncio event loop instead of a receive thread. This only supports the UDP transport.
+
+    All methods have to be called from the event loop the connection was opened on. The send_commands, upload and
+    download methods return futures that can be awaited to wait for the switcher to acknowledge the commands or to
+    wait for the transfer to finish.
+    """
+
+    def __init__(self, ip, port=9910, lazy_fields=False, skip_unchanged=False, coalesce_changes=False):
+        super().__init__(ip=ip, port=port, lazy_fields=lazy_fields, skip_unchanged=skip_unchanged,
+                         coalesce_changes=coalesce_changes)
+        self.transport.packet_callback = self._process_packet
+        self._connected_waiters = []
+        self._event_queues = []
+
+    def _make_transport(self, ip, port, usb):
+        if ip is None or ip.startswith('tcp://'):
+            raise ValueError("AsyncAtemProtocol only supports connecting over UDP")
+        return AsyncUdpProtocol(ip, port)
+
+    async def connect(self):
+        """Open the connection and wait until the initial state has been received from the switcher"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._connected_waiters.append(waiter)
+        await self.transport.open()
+        super().connect()
+        await waiter
+
+    def close(self):
+        self.transport.close()
+
+    def loop(self):
+        raise RuntimeError("AsyncAtemProtocol is driven by the event loop, there is no need to call loop()")
+
+    def call_threadsafe(self, func, *args, **kwargs):
+        """Run a function on the event loop of the connection, returns a concurrent.futures.Future with the result"""
+        result = concurrent.futures.Future()
+        self._calls.put((result, func, args, kwargs))
+        self.transport._loop.call_soon_threadsafe(self._run_calls)
+        return result
+
+    def _wrap(self, task):
+        waiter = asyncio.wrap_future(task.future)
+        waiter.add_done_callback(lambda w: self.cancel_transfer(task) if w.cancelled() else None)
+        return waiter
+
+    def download(self, store, index, priority=0):
+        """Queue a download, the returned future resolves to the downloaded data"""
+        return self._wrap(super().download(store, index, priority=priority))
+
+    def upload(self, store, index, data, compress=True, compressed=False, name=None, description=None, size=None,
+               task=None, priority=0, hash=None, base=None):
+        """Queue an upload, the returned future resolves when the switcher has stored the data"""
+        return self._wrap(super().upload(store, index, data, compress=compress, compressed=compressed, name=name,
+                                         description=description, size=size, task=task, priority=priority,
+                                         hash=hash, base=base))
+
+    def _raise(self, event, *args, **kwargs):
+        super()._raise(event, *args, **kwargs)
+
+        if event == 'connected':
+            waiters = self._connected_waiters
+            self._connected_waiters = []
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+        for names, queue in self._event_queues:
+            if not names or event in names:
+                if queue.full():
+                    # The consumer doesn't keep up, drop the oldest event so the newest state comes through
+                    queue.get_nowait()
+                    self.log.debug('Event queue full, dropped an event')
+                queue.put_nowait((event, args))
+
+    async def events(self, *names, maxsize=1024):
+        """
+        Iterate over the events raised by this connection, limited to the event names passed in or every event if
+        no names are given. This yields (event, args) tuples:
+
+            async for event, args in switcher.events('change'):
+                key, contents = args
+
+        At most maxsize events are buffered while the consumer is busy, when that's full the oldest buffered event is
+        dropped for every new event.
+        """
+        subscription = (names, asyncio.Queue(maxsize))
+        self._event_queues.append(subscription)
+        try:
+            while True:
+                yield await subscription[1].get()
+        finally:
+            self._event_queues.remove(subscription)
@@ -0,0 +1,194 @@
+# Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+
+from pyatem.media import rle_encode, rle_decode
+
+
+def default_cache_dir():
+    """The pyatem stills directory in the XDG cache dir"""
+    base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'pyatem', 'stills')
+
+
+class CachedFrame:
+    """
+    A compressed frame from the cache
+
+    :ivar hash: md5 hash of the uncompressed frame, this matches the hash in mediaplayer-file-info
+    :ivar length: Size of the uncompressed frame
+    :ivar data: The RLE compressed frame
+    """
+
+    def __init__(self, hash, length, data):
+        self.hash = hash
+        self.length = length
+        self.data = data
+
+    def upload(self, switcher, index, name=None, description=None):
+        """
+        Queue an upload of this frame to a still slot without decompressing or hashing it again. The upload is queued
+        with switcher.call_threadsafe() so this works from any thread, returns a concurrent.futures.Future that resolves
+        to the TransferTask.
+        """
+        return switcher.call_threadsafe(switcher.upload, 0, index, self.data, compress=False, compressed=True,
+                                        name=name, description=description, size=self.length, hash=self.hash)
+
+    def __repr__(self):
+        return f'<CachedFrame hash={self.hash.hex()} length={self.length}>'
+
+
+class StillCache:
+    """
+    Content addressed on-disk cache of compressed ATEM frames.
+
+    Frames are stored by the md5 hash of the uncompressed frame, the same hash the switcher reports for the slots in
+    the media pool, so downloads can be skipped for frames that are already cached. Source images are mapped to the
+    frame they convert to by the sha256 of the file together with the resolution and the premultiply flag so uploads
+    of the same graphics don't need to be converted again.
+
+    When the frames take more than max_size bytes the least recently used frames are removed.
+    """
+    STRUCT_HEADER = struct.Struct('>Q')
+
+    def __init__(self, path=None, max_size=1024 * 1024 * 1024):
+        self.path = path or default_cache_dir()
+        self.max_size = max_size
+        self.log = logging.getLogger('StillCache')
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self.size = sum(os.path.getsize(p) for p in self._frames())
+
+    def _frames(self):
+        return [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith('.frame')]
+
+    def _frame_path(self, md5):
+        return os.path.join(self.path, md5.hex() + '.frame')
+
+    def _source_path(self, key):
+        return os.path.join(self.path, key + '.source')
+
+    def _write(self, path, data):
+        # Write to a temporary file first so a crash never leaves a truncated entry
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(data)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def source_key(path, resolution, premultiply=False):
+        """Cache key for the frame converted from an image file"""
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as handle:
+            for block in iter(lambda: handle.read(1024 * 1024), b''):
+                hasher.update(block)
+        hasher.update(struct.pack('>II?', resolution[0], resolution[1], premultiply))
+        return hasher.hexdigest()
+
+    def get_frame(self, md5):
+        """Get a frame by the md5 hash of the uncompressed frame, returns None if it's not cached"""
+        path = self._frame_path(md5)
+        try:
+            with open(path, 'rb') as handle:
+                raw = handle.read()
+            # Mark as recently used for the eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        length, = self.STRUCT_HEADER.unpack_from(raw, 0)
+        return CachedFrame(md5, length, raw[self.STRUCT_HEADER.size:])
+
+    def put_frame(self, frame):
+        """Compress an uncompressed frame and store it, returns the CachedFrame"""
+        return self.put_compressed(CachedFrame(hashlib.md5(frame).digest(), len(frame), rle_encode(frame)))
+
+    def put_compressed(self, cached):
+        """Store a CachedFrame of which the data is already compressed, returns the CachedFrame"""
+        path = self._frame_path(cached.hash)
+        with self.lock:
+            if not os.path.exists(path):
+                self._write(path, self.STRUCT_HEADER.pack(cached.length) + cached.data)
+                self.size += self.STRUCT_HEADER.size + len(cached.data)
+                self._evict(keep=path)
+        return cached
+
+    def upload(self, switcher, index, frame, name=None, description=None):
+        """
+        Upload an uncompressed frame to a still slot and store it in the cache. When the frame that's currently in the
+        slot is cached it's passed as base so only the changed parts are sent when connected through the TCP proxy,
+        task.bytes_saved on the returned task has the number of bytes that didn't need to be sent. The upload is queued
+        with switcher.call_threadsafe(), returns a concurrent.futures.Future that resolves to the TransferTask.
+        """
+        cached = self.put_frame(frame)
+        base = None
+        info = switcher.mixerstate.get('mediaplayer-file-info', {}).get(index)
+        if info is not None and info.is_used:
+            current = self.get_frame(info.hash)
+            if current is not None and current.length == cached.length:
+                base = rle_decode(current.data)
+        return switcher.call_threadsafe(switcher.upload, 0, index, cached.data, compress=False, compressed=True,
+                                        name=name, description=description, size=cached.length, hash=cached.hash,
+                                        base=base)
+
+    def get_source(self, key):
+        """Get the frame for a source key, returns None if the source or the frame isn't cached"""
+        try:
+            with open(self._source_path(key), 'rb') as handle:
+                md5 = handle.read()
+        except FileNotFoundError:
+            return None
+        return self.get_frame(md5)
+
+    def put_source(self, key, frame):
+        """Store an uncompressed frame converted from a source, returns the CachedFrame"""
+        cached = self.put_frame(frame)
+        self._write(self._source_path(key), cached.hash)
+        return cached
+
+    def frame_for_file(self, path, resolution, premultiply, convert):
+        """
+        Get the compressed frame for an image file. On a cache miss convert(path) is called to create the
+        uncompressed frame which is then stored.
+        """
+        key = self.source_key(path, resolution, premultiply)
+        cached = self.get_source(key)
+        if cached is not None:
+            self.log.debug(f'Cache hit for {path}')
+            return cached
+        return self.put_source(key, convert(path))
+
+    def _evict(self, keep=None):
+        if self.size <= self.max_size:
+            return
+
+        frames = sorted(self._frames(), key=lambda p: os.stat(p).st_mtime_ns)
+        for path in frames:
+            if self.size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                self.size -= os.path.getsize(path)
+                os.unlink(path)
+            except FileNotFoundError:
+                # Removed by another process using the same cache
+                continue
+            self.log.debug(f'Evicted {path}')
+
+        # Remove the source entries that point to removed frames
+        for name in os.listdir(self.path):
+            if not name.endswith('.source'):
+                continue
+            source = os.path.join(self.path, name)
+            try:
+                with open(source, 'rb') as handle:
+                    md5 = handle.read()
+                if not os.path.exists(self._frame_path(md5)):
+                    os.unlink(source)
+            except FileNotFoundError:
+                continue
@@ -0,0 +1,120 @@
+# Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import asyncio
+import hashlib
+import queue
+from concurrent.futures import Future
+from unittest import TestCase
+
+from pyatem.clipupload import ClipUploader
+from pyatem.command import MediaplayerClipClearCommand, MediaplayerClipSetCommand
+from pyatem.media import rle_decode, rle_encode
+from pyatem.protocol import AsyncAtemProtocol
+from pyatem.test_protocol import FakeSwitcher as UdpSwitcher, _packet
+from pyatem.transfer import TransferTask
+
+
+class FakeSwitcher:
+    """Records the uploads, the test completes them one by one like the hardware would"""
+
+    def __init__(self):
+        self.queued = queue.Queue()
+        self.cancelled = []
+        self.commands = []
+
+    def call_threadsafe(self, func, *args, **kwargs):
+        result = Future()
+        result.set_result(func(*args, **kwargs))
+        return result
+
+    def send_commands(self, commands):
+        self.commands.append([command.get_command() for command in commands])
+
+    def upload(self, store, index, data, task=None):
+        self.queued.put(task)
+        return task
+
+    def cancel_transfer(self, task):
+        self.cancelled.append(task)
+        task.future.cancel()
+
+
+class Test(TestCase):
+    def test_streaming_upload(self):
+        pulled = []
+
+        def frames():
+            for i in range(10):
+                pulled.append(i)
+                yield bytes([i] * 8) * 64
+
+        switcher = FakeSwitcher()
+        uploader = ClipUploader(switcher, 1, frames(), (16, 8), lookahead=3, convert=False)
+        progress = []
+        uploader.add_progress_callback(lambda u, done: progress.append(done))
+        future = uploader.start()
+        self.assertEqual([[MediaplayerClipClearCommand(1).get_command()]], switcher.commands)
+
+        for i in range(10):
+            task = switcher.queued.get(timeout=5)
+            self.assertEqual((2, i), (task.store, task.slot))
+            frame = bytes([i] * 8) * 64
+            self.assertEqual(frame, rle_decode(task.data))
+            self.assertEqual(hashlib.md5(frame).digest(), task.hash)
+            self.assertEqual(len(frame), task.data_length)
+
+            # Frames are only pulled from the generator when there is room in the look-ahead window
+            self.assertLessEqual(len(pulled), i + 3)
+            task.future.set_result(None)
+
+        self.assertEqual(10, future.result(timeout=5))
+        self.assertEqual(list(range(1, 11)), progress)
+
+        # The clip gets its name and frame count after all frames are uploaded
+        setup = MediaplayerClipSetCommand(1, '', 10).get_command()
+        self.assertEqual([setup], switcher.commands[-1])
+        self.assertEqual(2, len(switcher.commands))
+
+    def test_cancel(self):
+        def frames():
+            while True:
+                yield bytes(8) * 64
+
+        switcher = FakeSwitcher()
+        uploader = ClipUploader(switcher, 0, frames(), (16, 8), lookahead=2, convert=False)
+        future = uploader.start()
+        switcher.queued.get(timeout=5).future.set_result(None)
+        switcher.queued.get(timeout=5)
+        uploader.cancel()
+        self.assertTrue(future.cancelled())
+        self.assertGreaterEqual(len(switcher.cancelled), 1)
+
+    def test_async_protocol(self):
+        frames = [bytes([i] * 8) * 64 for i in range(5)]
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            initial = _packet([(b'InCm', b'\x01\x00\x00\x00')])
+            server, fake = await loop.create_datagram_endpoint(lambda: UdpSwitcher(initial),
+                                                               local_addr=('127.0.0.1', 0))
+            switcher = AsyncAtemProtocol('127.0.0.1', port=server.get_extra_info('sockname')[1])
+            try:
+                await asyncio.wait_for(switcher.connect(), 5)
+
+                # The uploads are queued from the worker thread through the event loop
+                uploader = ClipUploader(switcher, 0, iter(frames), (16, 8), lookahead=2, convert=False, name='Intro')
+                done = await asyncio.wait_for(asyncio.wrap_future(uploader.start()), 5)
+                self.assertEqual(5, done)
+                for i, frame in enumerate(frames):
+                    self.assertEqual(rle_encode(frame), fake.uploaded[(1, i)])
+
+                # The clip is cleared before the first frame and set up after the last one
+                await asyncio.sleep(0.1)
+                codes = [code for code, data in fake.commands if code in (b'CMPC', b'FTSD', b'FTFD', b'SMPC')]
+                self.assertEqual([b'CMPC'] + [b'FTSD', b'FTFD'] * 5 + [b'SMPC'], codes)
+                self.assertEqual(MediaplayerClipSetCommand(0, 'Intro', 5).get_command()[8:], fake.commands[-1][1])
+            finally:
+                switcher.close()
+                server.close()
+
+        asyncio.run(run())
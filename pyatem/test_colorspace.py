@@ -13,7 +13,9 @@ class Test(TestCase):
     def setUp(self):
         fixtures_dir = os.environ.get('TEST_FIXTURES', os.path.join(os.path.dirname(__file__), 'fixtures'))
         fixture = self._encode_test(os.path.join(fixtures_dir, 'ramps.png'))
+        self.fixture = fixture
         self.encoded = pyatem.media.rgb_to_atem(fixture, 1920, 1080)
+        self.encoded_fixed = pyatem.media.rgb_to_atem(fixture, 1920, 1080, fixed=True)
 
         with gzip.open(os.path.join(fixtures_dir, 'ramps-atemsc.data.gz'), 'rb') as handle:
             self.reference = handle.read()
@@ -49,17 +51,17 @@ class Test(TestCase):
             "a2": a2,
         }
 
-    def _test_primary(self, name, rgb, expect):
+    def _test_primary(self, name, rgb, expect, fixed=False):
         sequence = rgb + b'\xff' + rgb + b'\xff'
-        encoded = pyatem.media.rgb_to_atem(sequence, 2, 1)
+        encoded = pyatem.media.rgb_to_atem(sequence, 2, 1, fixed=fixed)
         dec = self._decompose(encoded)
         self.assertAlmostEqual(expect[0], dec['y1'], msg=f'{name} Y', delta=2)
         self.assertAlmostEqual(expect[1], dec['cb'], msg=f'{name} Cb', delta=2)
         self.assertAlmostEqual(expect[2], dec['cr'], msg=f'{name} Cr', delta=2)
 
-    def _assertClose(self, a, b, msg):
+    def _assertClose(self, a, b, msg, delta=5):
         for key in a:
-            self.assertAlmostEqual(a[key], b[key], msg=f'{msg} [{key}]', delta=5)
+            self.assertAlmostEqual(a[key], b[key], msg=f'{msg} [{key}]', delta=delta)
 
     def _compare_row(self, test, reference, row):
         stride = 1920 * 4
@@ -101,3 +103,26 @@ class Test(TestCase):
         self._test_primary('yellow', b'\xFF\xFF\x00', (219 * 4, 16 * 4, 138 * 4))
         self._test_primary('cyan', b'\x00\xFF\xFF', (188 * 4, 154 * 4, 16 * 4))
         self._test_primary('magenta', b'\xFF\x00\xFF', (78 * 4, 214 * 4, 230 * 4))
+
+    def test_fixed_point_encode(self):
+        for row in [0, 800, 885, 963, 1042]:
+            self._compare_row(self.encoded_fixed, self.reference, row)
+
+        # The fixed point path is within 1 LSB of the floating point path for every pixel
+        for premultiply in [False, True]:
+            encoded = pyatem.media.rgb_to_atem(self.fixture, 1920, 1080, premultiply)
+            encoded_fixed = pyatem.media.rgb_to_atem(self.fixture, 1920, 1080, premultiply, fixed=True)
+            for offset in range(0, len(encoded), 8 * 97):
+                r = self._decompose(encoded[offset:offset + 8])
+                t = self._decompose(encoded_fixed[offset:offset + 8])
+                self._assertClose(r, t, f'offset {offset}', delta=1)
+
+    def test_fixed_point_decode(self):
+        decoded = pyatem.media.atem_to_rgb(self.encoded, 1920, 1080)
+        decoded_fixed = pyatem.media.atem_to_rgb(self.encoded, 1920, 1080, fixed=True)
+        self.assertEqual(len(decoded), len(decoded_fixed))
+        for i in range(0, len(decoded), 13):
+            # Slightly negative values wrap around in the floating point path, the fixed point path clamps them
+            if decoded_fixed[i] == 0:
+                continue
+            self.assertAlmostEqual(decoded[i], decoded_fixed[i], msg=f'byte {i}', delta=1)
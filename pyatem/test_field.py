@@ -0,0 +1,71 @@
+# Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import math
+import struct
+from unittest import TestCase
+
+import pyatem.field
+from pyatem.field import AudioMeterLevelsField, FairlightMeterLevelsField
+
+
+class Test(TestCase):
+    def _audio_levels(self):
+        levels = [0, 128 * 65536, 64 * 65536, 1] * 2
+        inputs = [1, 2, 3]
+        for i in range(len(inputs)):
+            levels.extend([i * 65536, 0, 128 * 65536, 12345])
+        raw = struct.pack('>H2x 8I', len(inputs), *levels[0:8])
+        raw += struct.pack('>3H 2x', *inputs)
+        raw += struct.pack('>12I', *levels[8:])
+        return raw, inputs, levels
+
+    def _db(self, value):
+        if value == 0:
+            return -60
+        return math.log10(value / (128 * 65536)) * 20
+
+    def _check_audio_levels(self):
+        raw, inputs, levels = self._audio_levels()
+        field = AudioMeterLevelsField(raw)
+        self.assertEqual(3, field.count)
+        expected = [self._db(v) for v in levels]
+        for i in range(4):
+            self.assertAlmostEqual(expected[i], field.master[i])
+            self.assertAlmostEqual(expected[i + 4], field.monitor[i])
+        for row, source in enumerate(inputs):
+            for i in range(4):
+                self.assertAlmostEqual(expected[8 + (row * 4) + i], field.input[source][i])
+        flat = list(field.levels_array.tolist())
+        if isinstance(flat[0], list):
+            flat = [value for row in flat for value in row]
+        for a, b in zip(expected, flat):
+            self.assertAlmostEqual(a, b)
+
+    def _check_fairlight_levels(self):
+        values = [0, -10000, -5000, -1, -32768, 32767, 100, -9999, -2000, -3000, -4000, -6000, -7000, -8000, -20]
+        raw = struct.pack('>6xBBH 15h', 0xff, 1, 1301, *values)
+        field = FairlightMeterLevelsField(raw)
+        self.assertEqual('1301.1', field.strip_id)
+        self.assertEqual(0, field.input[0])
+        self.assertEqual(-60, field.input[1])
+        expected = [pyatem.field._fairlight_level(v) for v in values]
+        self.assertEqual(expected, list(field.levels_array.tolist()))
+        self.assertEqual(tuple(expected[11:15]), field.level)
+
+    def test_audio_meter_levels(self):
+        self._check_audio_levels()
+
+    def test_fairlight_meter_levels(self):
+        self._check_fairlight_levels()
+
+    def test_meter_levels_without_numpy(self):
+        numpy = pyatem.field.numpy
+        table = pyatem.field._fairlight_table
+        try:
+            pyatem.field.numpy = None
+            pyatem.field._fairlight_table = None
+            self._check_audio_levels()
+            self._check_fairlight_levels()
+        finally:
+            pyatem.field.numpy = numpy
+            pyatem.field._fairlight_table = table
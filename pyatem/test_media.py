@@ -1,11 +1,21 @@
 # Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
 # SPDX-License-Identifier: LGPL-3.0-only
+import gzip
+import hashlib
+import os
+import tempfile
 from unittest import TestCase
 
+import pyatem.media
 from pyatem.hexdump import hexdump
 from pyatem.media import rle_decode, rle_encode, atem_to_image, image_to_atem, rgb_to_atem
 from pyatem.mediaconvert import atem_to_rgb
 
+try:
+    import numpy
+except ModuleNotFoundError:
+    numpy = None
+
 
 class Test(TestCase):
     FRAME_1080_RED = b'\xfe\xfe\xfe\xfe\xfe\xfe\xfe\xfe\x00\x00\x00\x00\x00\x0f\xd2\x00:\x96d\xfa:\x9e\xfc\xfa'
@@ -43,3 +53,73 @@ class Test(TestCase):
         compressed = rle_encode(testframe)
         decompressed = rle_decode(compressed)
         self.assertEqual(testframe, decompressed)
+
+    def test_atem_to_image_fused(self):
+        fixtures_dir = os.environ.get('TEST_FIXTURES', os.path.join(os.path.dirname(__file__), 'fixtures'))
+        with gzip.open(os.path.join(fixtures_dir, 'ramps-atemsc.data.gz'), 'rb') as handle:
+            frame = handle.read()
+        compressed = rle_encode(frame) + rle_encode(rle_decode(self.FRAME_1080_RED))
+        expected = atem_to_rgb(rle_decode(compressed), 1920, 2160)
+        self.assertEqual(expected, atem_to_image(compressed, 1920, 2160))
+
+        output = bytearray(len(expected))
+        self.assertEqual(len(expected), atem_to_image(compressed, 1920, 2160, output))
+        self.assertEqual(expected, output)
+
+        with self.assertRaises(ValueError):
+            atem_to_image(compressed, 1920, 2160, bytearray(100))
+
+        if numpy is not None:
+            array = numpy.zeros((2160, 1920, 4), dtype=numpy.uint8)
+            atem_to_image(compressed, 1920, 2160, array)
+            self.assertEqual(expected, array.tobytes())
+
+    def test_threaded_conversion(self):
+        frame = rle_decode(self.FRAME_1080_RED)[0:1000 * 8] + bytes(range(256)) * 32
+        expected = atem_to_rgb(frame, 1920, 1080)
+        for threads in [2, 3, 7, 0]:
+            self.assertEqual(expected, pyatem.media.atem_to_rgb(frame, 1920, 1080, threads=threads), threads)
+            self.assertEqual(expected, pyatem.media.atem_to_rgb(frame, 5, 1800, threads=threads), threads)
+
+        expected = rgb_to_atem(frame, 1920, 1080, True)
+        for threads in [2, 3, 7, 0]:
+            self.assertEqual(expected, rgb_to_atem(frame, 1920, 1080, True, threads=threads), threads)
+
+    def test_mapped_frames(self):
+        frame = rle_decode(self.FRAME_1080_RED)
+        with tempfile.TemporaryDirectory() as tmp:
+            raw = os.path.join(tmp, 'frame.bin')
+            rgba = os.path.join(tmp, 'frame.rgba')
+
+            pyatem.media.export_frame(self.FRAME_1080_RED, raw, 1920, 1080, rgba=False, compressed=True)
+            with open(raw, 'rb') as handle:
+                self.assertEqual(frame, handle.read())
+            compressed, size, md5 = pyatem.media.import_frame(raw, 1920, 1080, rgba=False)
+            self.assertEqual(frame, rle_decode(compressed))
+            self.assertEqual((len(frame), hashlib.md5(frame).digest()), (size, md5))
+
+            pyatem.media.export_frame(frame, rgba, 1920, 1080, threads=2)
+            with open(rgba, 'rb') as handle:
+                self.assertEqual(atem_to_rgb(frame, 1920, 1080), handle.read())
+            compressed, size, md5 = pyatem.media.import_frame(rgba, 1920, 1080)
+            converted = rgb_to_atem(atem_to_rgb(frame, 1920, 1080), 1920, 1080)
+            self.assertEqual(converted, rle_decode(compressed))
+            self.assertEqual(hashlib.md5(converted).digest(), md5)
+
+            with self.assertRaises(ValueError):
+                pyatem.media.import_frame(rgba, 3840, 2160)
+
+    def test_frame_delta(self):
+        base = rle_decode(self.FRAME_1080_RED)
+        frame = bytearray(base)
+        frame[100000:100100] = bytes(range(100))
+        frame[-8:] = bytes(8)
+        delta = pyatem.media.frame_delta(base, frame)
+        self.assertLess(len(delta), 300)
+        self.assertEqual(frame, pyatem.media.apply_delta(base, delta))
+        self.assertEqual(b'', pyatem.media.frame_delta(base, base))
+
+        with self.assertRaises(ValueError):
+            pyatem.media.frame_delta(base, frame[0:-8])
+        with self.assertRaises(ValueError):
+            pyatem.media.apply_delta(base[0:100000], delta)
@@ -0,0 +1,83 @@
+# Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import json
+import os
+import struct
+import tempfile
+from concurrent.futures import Future
+from unittest import TestCase
+
+from PIL import Image
+
+from pyatem.field import VideoModeField, MediaplayerSlotsField, MediaplayerFileInfoField
+from pyatem.mediasync import MediaSync, entries_from_directory, entries_from_manifest
+
+
+class FakeSwitcher:
+    """The part of AtemProtocol the media sync uses, uploads are recorded instead of sent"""
+
+    def __init__(self, stills):
+        self.mixerstate = {
+            'video-mode': VideoModeField(struct.pack('>B3x', 0)),
+            'mediaplayer-slots': MediaplayerSlotsField(struct.pack('>2B2x', stills, 0)),
+            'mediaplayer-file-info': {},
+        }
+        self.uploads = []
+
+    def call_threadsafe(self, func, *args, **kwargs):
+        result = Future()
+        result.set_result(func(*args, **kwargs))
+        return result
+
+    def upload(self, store, index, data, name=None):
+        self.uploads.append((store, index, name))
+        return index
+
+    def set_slot(self, index, digest):
+        name = b'slot'
+        raw = struct.pack('>Bx H ? 16s 2x B', 0, index, True, digest, len(name)) + name
+        self.mixerstate['mediaplayer-file-info'][index] = MediaplayerFileInfoField(raw)
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        for i, color in enumerate([(255, 0, 0, 255), (0, 255, 0, 255), (0, 0, 255, 128)]):
+            Image.new('RGBA', (360, 240), color).save(os.path.join(self.dir.name, f'still{i}.png'))
+        with open(os.path.join(self.dir.name, 'notes.txt'), 'w') as handle:
+            handle.write('not an image')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_sync_uploads_changed_slots(self):
+        switcher = FakeSwitcher(stills=20)
+        sync = MediaSync(switcher, threads=2)
+        entries = entries_from_directory(self.dir.name)
+        self.assertEqual([0, 1, 2], [e.slot for e in entries])
+
+        # Nothing on the switcher yet, all stills are uploaded
+        self.assertEqual([0, 1, 2], [future.result() for future in sync.sync(entries)])
+        self.assertEqual([(0, 0, 'still0'), (0, 1, 'still1'), (0, 2, 'still2')], switcher.uploads)
+
+        # After the uploads the switcher reports the same hashes, only a changed still is uploaded again
+        for entry in entries:
+            switcher.set_slot(entry.slot, entry.hash)
+        switcher.uploads = []
+        self.assertEqual([], sync.plan(entries))
+        Image.new('RGBA', (360, 240), (255, 255, 0, 255)).save(os.path.join(self.dir.name, 'still1.png'))
+        self.assertEqual([1], [future.result() for future in sync.sync(entries)])
+        self.assertEqual([(0, 1, 'still1')], switcher.uploads)
+
+    def test_manifest(self):
+        path = os.path.join(self.dir.name, 'show.json')
+        with open(path, 'w') as handle:
+            json.dump({"5": "still2.png", "2": {"file": "still0.png", "name": "Opener"}}, handle)
+        entries = entries_from_manifest(path)
+        self.assertEqual([1, 4], [e.slot for e in entries])
+        self.assertEqual(['Opener', 'still2'], [e.name for e in entries])
+
+        switcher = FakeSwitcher(stills=4)
+        with self.assertRaises(ValueError):
+            MediaSync(switcher).sync(entries)
+        self.assertEqual([], switcher.uploads)
@@ -0,0 +1,335 @@
+# Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import asyncio
+import struct
+from unittest import TestCase
+
+from pyatem.command import ProgramInputCommand
+from pyatem.field import ProgramBusInputField
+from pyatem.media import rle_encode, rle_decode, apply_delta
+from pyatem.protocol import AtemProtocol, AsyncAtemProtocol
+from pyatem.transfer import TransferTask
+from pyatem.transport import Packet, UdpProtocol
+
+
+def _packet(fields):
+    result = b''
+    for code, data in fields:
+        result += struct.pack('!H2x 4s', len(data) + 8, code) + data
+    return result
+
+
+class FakeSwitcher(asyncio.DatagramProtocol):
+    """Minimal UDP switcher that completes the handshake, acknowledges commands, answers CPgI and accepts uploads"""
+
+    def __init__(self, initial):
+        self.initial = initial
+        self.sequence_number = 0
+        self.transport = None
+        self.address = None
+        self.transfers = {}
+        self.uploaded = {}
+        self.stored = {}
+        self.parallel = 0
+        self.commands = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def send(self, flags, data=None, ack=0):
+        packet = Packet()
+        packet.flags = flags
+        packet.session = 0x1337 if flags & UdpProtocol.FLAG_SYN else 0x8001
+        packet.acknowledgement_number = ack
+        if flags & UdpProtocol.FLAG_RELIABLE or data is None:
+            self.sequence_number += 1
+            packet.sequence_number = self.sequence_number
+        packet.data = data
+        self.transport.sendto(packet.to_bytes(), self.address)
+
+    def datagram_received(self, data, addr):
+        self.address = addr
+        packet = Packet.from_bytes(data)
+        if packet.flags & UdpProtocol.FLAG_SYN:
+            self.send(UdpProtocol.FLAG_SYN, bytes([0x02, 0, 0, 0, 0, 0, 0, 0]))
+        elif packet.label is None and packet.session == 0x1337:
+            # Third handshake packet, send the initial state followed by a ping
+            self.send(UdpProtocol.FLAG_RELIABLE, self.initial)
+            self.send(UdpProtocol.FLAG_ACK)
+        elif packet.flags & UdpProtocol.FLAG_RELIABLE:
+            self.send(UdpProtocol.FLAG_ACK, ack=packet.sequence_number)
+            offset = 0
+            while offset < len(packet.data):
+                length, code = struct.unpack_from('!H2x 4s', packet.data, offset)
+                self.command(code, packet.data[offset + 8:offset + length])
+                offset += length
+
+    def command(self, code, data):
+        self.commands.append((code, data))
+        if code == b'CPgI':
+            index, source = struct.unpack_from('>BxH', data)
+            self.send(UdpProtocol.FLAG_RELIABLE, _packet([(b'PrgI', struct.pack('>BxH', index, source))]))
+        elif code == b'PLCK':
+            self.send(UdpProtocol.FLAG_RELIABLE, _packet([(b'LKOB', data[0:2] + b'\x00\x00')]))
+        elif code == b'FTSD':
+            transfer, store, slot = struct.unpack_from('>HHxxH', data)
+            self.transfers[transfer] = {'slot': (store, slot), 'data': b''}
+            self.parallel = max(self.parallel, len(self.transfers))
+            self.continue_data(transfer)
+        elif code == b'FTSU':
+            transfer, store, slot = struct.unpack_from('>HHI', data)
+            stored = self.stored[(store, slot)]
+            for offset in range(0, len(stored), 1000):
+                chunk = stored[offset:offset + 1000]
+                packet = _packet([(b'FTDa', struct.pack('>HH', transfer, len(chunk)) + chunk)])
+                self.send(UdpProtocol.FLAG_RELIABLE, packet)
+            self.send(UdpProtocol.FLAG_RELIABLE, _packet([(b'FTDC', struct.pack('>HBB', transfer, 0, 0))]))
+        elif code == b'FTDa':
+            transfer, length = struct.unpack_from('>HH', data)
+            self.transfers[transfer]['data'] += data[4:4 + length]
+            self.transfers[transfer]['budget'] -= 1
+            if self.transfers[transfer]['budget'] == 0:
+                self.continue_data(transfer)
+        elif code == b'FTFD':
+            transfer, = struct.unpack_from('>H', data)
+            upload = self.transfers.pop(transfer)
+            self.uploaded[upload['slot']] = upload['data']
+            self.send(UdpProtocol.FLAG_RELIABLE, _packet([(b'FTDC', struct.pack('>HBB', transfer, 0, 0))]))
+
+    def continue_data(self, transfer):
+        self.transfers[transfer]['budget'] = 8
+        data = struct.pack('>H 4x HH 2x', transfer, 1000, 8)
+        self.send(UdpProtocol.FLAG_RELIABLE, _packet([(b'FTCD', data)]))
+
+
+class Test(TestCase):
+    def _receive(self, switcher, data):
+        for fieldname, contents in switcher.decode_packet(data):
+            switcher.save_field_data(fieldname, contents)
+
+    def test_decode_fields(self):
+        switcher = AtemProtocol('127.0.0.1')
+        packet = _packet([
+            (b'PrgI', struct.pack('>BxH', 0, 3)),
+            (b'PrgI', struct.pack('>BxH', 1, 4)),
+            (b'Xxxx', b'\x01\x02\x03\x04'),
+        ])
+        self._receive(switcher, packet)
+        self.assertEqual(3, switcher.mixerstate['program-bus-input'][0].source)
+        self.assertEqual(4, switcher.mixerstate['program-bus-input'][1].source)
+        self.assertEqual(b'\x01\x02\x03\x04', switcher.mixerstate['Xxxx'])
+
+    def test_lazy_fields(self):
+        switcher = AtemProtocol('127.0.0.1', lazy_fields=True)
+        packet = _packet([(b'PrgI', struct.pack('>BxH', 1, 1234))])
+        self._receive(switcher, packet)
+
+        field = switcher.mixerstate['program-bus-input'][1]
+        self.assertIsInstance(field, ProgramBusInputField)
+        self.assertNotIn('source', field.__dict__)
+        self.assertEqual(packet, field.make_packet())
+        self.assertNotIn('source', field.__dict__)
+
+        self.assertEqual(1234, field.source)
+        self.assertEqual(1, field.index)
+        self.assertIn('source', field.__dict__)
+        self.assertEqual(packet, field.make_packet())
+        with self.assertRaises(AttributeError):
+            field.does_not_exist
+
+    def test_skip_unchanged(self):
+        for lazy in [False, True]:
+            switcher = AtemProtocol('127.0.0.1', lazy_fields=lazy, skip_unchanged=True, coalesce_changes=True)
+            events = []
+            batches = []
+            switcher.on('change', lambda key, contents: events.append(key))
+            switcher.on('change:program-bus-input:1', lambda contents: events.append(contents.source))
+            switcher.on('changes', batches.append)
+
+            packet = Packet()
+            packet.data = _packet([
+                (b'PrgI', struct.pack('>BxH', 0, 3)),
+                (b'PrgI', struct.pack('>BxH', 1, 4)),
+                (b'Xxxx', b'\x01\x02\x03\x04'),
+            ])
+            switcher._process_packet(packet)
+            self.assertEqual(['program-bus-input', 4, 'program-bus-input', 'Xxxx'], events)
+            self.assertEqual(1, len(batches))
+            self.assertEqual(['program-bus-input', 'program-bus-input', 'Xxxx'], [key for key, c in batches[0]])
+
+            # Sending the same state again doesn't raise anything, only the changed field comes through
+            events.clear()
+            batches.clear()
+            packet.data = packet.data[0:12] + _packet([(b'PrgI', struct.pack('>BxH', 1, 5))]) + packet.data[24:]
+            switcher._process_packet(packet)
+            self.assertEqual([5, 'program-bus-input'], events)
+            self.assertEqual(1, len(batches[0]))
+            self.assertEqual(5, switcher.mixerstate['program-bus-input'][1].source)
+
+            switcher._process_packet(packet)
+            self.assertEqual(1, len(batches))
+
+        switcher = AtemProtocol('127.0.0.1')
+        events = []
+        switcher.on('change', lambda key, contents: events.append(key))
+        self._receive(switcher, packet.data)
+        self._receive(switcher, packet.data)
+        self.assertEqual(6, len(events))
+
+    def test_delta_upload(self):
+        switcher = AtemProtocol('tcp://127.0.0.1:1/mini')
+        sent = []
+        switcher.transport.upload = sent.append
+
+        base = bytes(range(256)) * 4096
+        frame = bytearray(base)
+        frame[8192:8200] = bytes(8)
+        task = switcher.upload(0, 3, bytes(frame), name='delta', base=base)
+        self.assertTrue(task.delta)
+        self.assertEqual(len(rle_encode(frame)) - len(task.data), task.bytes_saved)
+
+        # The proxy side rebuilds the full frame from the base frame
+        packets = task.to_tcp()
+        self.assertEqual(1, len(packets))
+        received = TransferTask.from_tcp(_packet(packets))
+        self.assertTrue(received.delta)
+        self.assertEqual(frame, apply_delta(base, received.data[16:]))
+
+        # Without the base frame on the proxy the full frame is sent again
+        self._receive(switcher, _packet([(b'*XFC', struct.pack('>HH ?Bxx', 0, 3, True, 1))]))
+        self.assertEqual(2, len(sent))
+        self.assertFalse(task.delta)
+        self.assertEqual(frame, rle_decode(task.data))
+        self.assertFalse(task.future.done())
+
+        self._receive(switcher, _packet([(b'*XFC', struct.pack('>HH ?Bxx', 0, 3, True, 0))]))
+        self.assertTrue(task.future.done())
+
+        # Completely different frames are sent in full
+        task = switcher.upload(0, 4, bytes(len(base)), base=base)
+        self.assertFalse(task.delta)
+
+        # An upload the proxy couldn't do fails the task without an upload-done event
+        uploaded = []
+        switcher.on('upload-done', lambda store, slot: uploaded.append(slot))
+        self._receive(switcher, _packet([(b'*XFC', struct.pack('>HH ?BH', 0, 4, True, 2, task.tid))]))
+        self.assertIsInstance(task.future.exception(timeout=0), RuntimeError)
+        self.assertEqual([], uploaded)
+
+    def test_proxy_download(self):
+        switcher = AtemProtocol('tcp://127.0.0.1:1/mini')
+        requested = []
+        switcher.transport.download = requested.append
+        done = []
+        switcher.on('download-done', lambda store, slot, data: done.append((store, slot, len(data))))
+
+        frame = bytes(range(256)) * 4096
+        for stream in (True, False):
+            task = switcher.download(0, 3)
+            self.assertEqual([task], requested[-1:])
+
+            # The proxy sends the still compressed, in streaming mode for version 2 of the protocol
+            sent = TransferTask(0, 3)
+            sent.data = rle_encode(frame)
+            sent.send_length = len(sent.data)
+            sent.data_length = len(frame)
+            sent.hash = bytes(16)
+            fields = sent.to_tcp_stream(chunksize=1000) if stream else sent.to_tcp()
+            self._receive(switcher, _packet(fields))
+            self.assertFalse(task.future.done())
+            self._receive(switcher, _packet([(b'*XFC', struct.pack('>HH ?Bxx', 0, 3, False, 0))]))
+            self.assertEqual(frame, task.future.result(timeout=0))
+            self.assertEqual((0, 3, len(frame)), done[-1])
+
+        task = switcher.download(0, 4)
+        self._receive(switcher, _packet([(b'*XFC', struct.pack('>HH ?Bxx', 0, 4, False, 2))]))
+        self.assertIsInstance(task.future.exception(timeout=0), RuntimeError)
+
+        # Transfers for the same slot are matched by the transfer id the proxy sends back
+        first = switcher.download(0, 5)
+        second = switcher.download(0, 5)
+        self.assertNotEqual(first.tid, second.tid)
+        self._receive(switcher, _packet([(b'*XFC', struct.pack('>HH ?BH', 0, 5, False, 2, second.tid))]))
+        self.assertFalse(first.future.done())
+        self.assertIsInstance(second.future.exception(timeout=0), RuntimeError)
+        self._receive(switcher, _packet([(b'*XFC', struct.pack('>HH ?BH', 0, 5, False, 2, first.tid))]))
+        self.assertTrue(first.future.done())
+
+    def test_async_events_bounded(self):
+        async def run():
+            switcher = AsyncAtemProtocol('127.0.0.1')
+            events = switcher.events('test', maxsize=2)
+            first = asyncio.ensure_future(events.__anext__())
+            await asyncio.sleep(0)
+
+            # Only the newest events are kept for a consumer that doesn't keep up
+            for i in range(4):
+                switcher._raise('test', i)
+            self.assertEqual(('test', (2,)), await first)
+            self.assertEqual(('test', (3,)), await events.__anext__())
+            await events.aclose()
+
+        asyncio.run(run())
+
+    def test_async_protocol(self):
+        async def run():
+            loop = asyncio.get_running_loop()
+            initial = _packet([
+                (b'PrgI', struct.pack('>BxH', 0, 1)),
+                (b'VidM', b'\x00\x00\x00\x00'),
+                (b'InCm', b'\x01\x00\x00\x00'),
+            ])
+            server, fake = await loop.create_datagram_endpoint(lambda: FakeSwitcher(initial),
+                                                               local_addr=('127.0.0.1', 0))
+            switcher = AsyncAtemProtocol('127.0.0.1', port=server.get_extra_info('sockname')[1])
+            try:
+                await asyncio.wait_for(switcher.connect(), 5)
+                self.assertEqual(1, switcher.mixerstate['program-bus-input'][0].source)
+
+                events = switcher.events('change:program-bus-input:0')
+                change = asyncio.ensure_future(events.__anext__())
+                await asyncio.wait_for(switcher.send_commands([ProgramInputCommand(0, 5)]), 5)
+                event, args = await asyncio.wait_for(change, 5)
+                self.assertEqual('change:program-bus-input:0', event)
+                self.assertEqual(5, args[0].source)
+                self.assertEqual(0, switcher.get_window_occupancy())
+                await events.aclose()
+
+                data = bytes(range(256)) * 200
+                progress = []
+                switcher.on('upload-progress', lambda store, slot, percent, done, total: progress.append(done))
+                await asyncio.wait_for(switcher.upload(0, 3, data, compress=False), 5)
+                self.assertEqual(data, fake.uploaded[(0, 3)])
+                self.assertEqual(len(data), progress[-1])
+
+                # Transfers to different stores run at the same time, the same store is done by priority
+                done = []
+                switcher.on('upload-done', lambda store, slot: done.append((store, slot)))
+                uploads = [
+                    switcher.upload(0, 4, data[0:20000], compress=False),
+                    switcher.upload(0, 5, data[0:10000], compress=False),
+                    switcher.upload(0, 6, data[0:10000], compress=False, priority=1),
+                    switcher.upload(1, 0, data[0:30000], compress=False),
+                ]
+                uploads[1].cancel()
+                await asyncio.wait_for(asyncio.gather(uploads[0], uploads[2], uploads[3]), 5)
+                self.assertEqual(2, fake.parallel)
+                self.assertEqual([(0, 6), (0, 4)], [slot for slot in done if slot[0] == 0])
+                self.assertNotIn((0, 5), fake.uploaded)
+                self.assertEqual(data[0:30000], fake.uploaded[(1, 0)])
+
+                # Stills are decompressed while they're downloaded
+                frame = bytearray(bytes(range(256)) * 5400)
+                frame[8000:400000] = b'\x11' * 392000
+                fake.stored[(0, 2)] = rle_encode(frame)
+                progress = []
+                download = switcher.download(0, 2)
+                switcher.on('transfer-progress', lambda store, slot, fraction: progress.append(fraction))
+                self.assertEqual(frame, await asyncio.wait_for(download, 5))
+                self.assertEqual(sorted(progress), progress)
+                self.assertAlmostEqual(1, progress[-1], delta=0.05)
+            finally:
+                switcher.close()
+                server.close()
+
+        asyncio.run(run())
@@ -3,7 +3,7 @@
 from unittest import TestCase
 
 from pyatem.hexdump import hexdump
-from pyatem.media import rle_decode, rle_encode
+from pyatem.media import rle_decode, rle_decode_slow, rle_encode, RleDecoder
 
 
 class Test(TestCase):
@@ -19,6 +19,11 @@ class Test(TestCase):
             hexdump(decoded)
 
         self.assertEqual(testdata, decoded, label)
+        self.assertEqual(testdata, rle_decode_slow(compressed), label)
+
+        output = bytearray(len(testdata) + 8)
+        self.assertEqual(len(testdata), rle_decode(compressed, output), label)
+        self.assertEqual(testdata, output[0:len(testdata)], label)
 
     def test_rle_uncompressable(self):
         testdata = b'\x01\x01\x01\x01\x01\x01\x01\x01'
@@ -67,3 +72,25 @@ class Test(TestCase):
         testdata += b'\x02\x02\x02\x02\x02\x02\x02\x02'
         testdata += b'\x02\x02\x02\x02\x02\x02\x02\x02'
         self._rle_loop_check('third block', testdata)
+
+    def test_rle_decoder_chunks(self):
+        testdata = b'\x01\xfe\xfe\xfe\xfe\xfe\xfe\xfe\xfe\x02\x02\x02\x02\x02\x02\x02' * 5
+        testdata += b'\x03\x03\x03\x03\x03\x03\x03\x03' * 40
+        testdata += bytes(range(256)) * 2
+        testdata += b'\x04\x04\x04\x04\x04\x04\x04\x04' * 40
+        compressed = rle_encode(testdata)
+        for chunk_size in [1, 7, 8, 13, 24, 100, len(compressed)]:
+            decoder = RleDecoder(len(testdata))
+            for offset in range(0, len(compressed), chunk_size):
+                decoder.feed(compressed[offset:offset + chunk_size])
+            self.assertEqual(len(testdata), decoder.length)
+            self.assertEqual(testdata, decoder.result(), f'chunk size {chunk_size}')
+
+    def test_rle_decode_invalid(self):
+        with self.assertRaises(ValueError):
+            rle_decode(b'\xfe\xfe\xfe\xfe\xfe\xfe\xfe\xfe\x00\x00\x00\x00')
+        with self.assertRaises(ValueError):
+            rle_decode(b'\xfe\xfe\xfe\xfe\xfe\xfe\xfe\xfe' + b'\xff' * 16)
+        compressed = rle_encode(b'\x01\x01\x01\x01\x01\x01\x01\x01' * 10)
+        with self.assertRaises(ValueError):
+            rle_decode(compressed, bytearray(72))
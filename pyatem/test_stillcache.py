@@ -0,0 +1,89 @@
+# Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import hashlib
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from pyatem.media import rle_decode
+from pyatem.protocol import AtemProtocol
+from pyatem.stillcache import StillCache
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _frame(self, value, blocks=1000):
+        return bytes([value] * 8) * blocks + bytes(range(64))
+
+    def test_frames(self):
+        cache = StillCache(self.dir.name)
+        frame = self._frame(1)
+        md5 = hashlib.md5(frame).digest()
+        self.assertIsNone(cache.get_frame(md5))
+
+        stored = cache.put_frame(frame)
+        self.assertEqual(md5, stored.hash)
+        cached = cache.get_frame(md5)
+        self.assertEqual(len(frame), cached.length)
+        self.assertEqual(frame, rle_decode(cached.data))
+
+        # A new instance picks up the existing entries
+        self.assertEqual(cache.size, StillCache(self.dir.name).size)
+
+    def test_sources(self):
+        cache = StillCache(self.dir.name)
+        image = os.path.join(self.dir.name, 'image.png')
+        with open(image, 'wb') as handle:
+            handle.write(b'not really a png')
+
+        converted = []
+
+        def convert(path):
+            converted.append(path)
+            return self._frame(2)
+
+        first = cache.frame_for_file(image, (1920, 1080), False, convert)
+        second = cache.frame_for_file(image, (1920, 1080), False, convert)
+        self.assertEqual(first.hash, second.hash)
+        self.assertEqual(1, len(converted))
+
+        # The resolution and premultiply flag are part of the key
+        cache.frame_for_file(image, (1920, 1080), True, convert)
+        cache.frame_for_file(image, (3840, 2160), False, convert)
+        self.assertEqual(3, len(converted))
+
+    def test_eviction(self):
+        cache = StillCache(self.dir.name, max_size=320)
+        frames = []
+        for i in range(3):
+            frames.append(cache.put_frame(self._frame(i)))
+            time.sleep(0.01)
+
+        # Using the first frame makes the second the least recently used one
+        self.assertIsNotNone(cache.get_frame(frames[0].hash))
+        cache.put_frame(self._frame(3))
+        self.assertIsNone(cache.get_frame(frames[1].hash))
+        self.assertIsNotNone(cache.get_frame(frames[0].hash))
+        self.assertLessEqual(cache.size, 320)
+
+    def test_upload_cached(self):
+        cache = StillCache(self.dir.name)
+        frame = self._frame(4)
+        cached = cache.put_frame(frame)
+
+        switcher = AtemProtocol('127.0.0.1')
+        queued = cached.upload(switcher, 3, name='still')
+
+        # The upload is only queued when the thread of the connection runs
+        self.assertFalse(queued.done())
+        switcher._run_calls()
+        task = queued.result()
+        self.assertEqual(hashlib.md5(frame).digest(), task.hash)
+        self.assertEqual(len(frame), task.data_length)
+        self.assertEqual(cached.data, task.data)
@@ -0,0 +1,259 @@
+# Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import hashlib
+import socket
+import struct
+import tempfile
+import threading
+from concurrent.futures import Future
+from unittest import TestCase
+
+from openswitcher_proxy.frontend_tcp import ClientQueue, Broadcaster, TCPHandler
+from openswitcher_proxy.hardware import HardwareLoop, LoopSwitcher
+from pyatem.command import TransferCompleteCommand
+from pyatem.field import ProgramBusInputField, AudioMeterLevelsField, InitCompleteField
+from pyatem.media import rle_encode
+from pyatem.stillcache import StillCache
+from pyatem.transfer import TransferTask
+from pyatem.transport import FrameReader, TcpProtocol
+
+
+def _program(index, source):
+    return ProgramBusInputField(struct.pack('>BxH', index, source))
+
+
+def _meter():
+    return AudioMeterLevelsField(struct.pack('>H2x', 0) + bytes(32))
+
+
+class FakeSwitcher:
+    """Just enough of the AtemProtocol for a Broadcaster"""
+
+    def __init__(self, mixerstate):
+        self.mixerstate = mixerstate
+        self.callbacks = {}
+
+    def on(self, event, callback):
+        self.callbacks[event] = callback
+        return event
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.sock, self.peer = socket.socketpair()
+        self.peer.settimeout(5)
+
+    def tearDown(self):
+        self.sock.close()
+        self.peer.close()
+
+    def _queued(self, queue):
+        return [(data, droppable) for data, droppable in queue.items]
+
+    def test_client_queue_drops_meters_first(self):
+        # The writer thread isn't started so everything stays queued
+        queue = ClientQueue(self.sock, 'test', 3)
+        queue.put(b'state1')
+        queue.put(b'meter1', droppable=True)
+        queue.put(b'meter2', droppable=True)
+        self.assertEqual(queue.depth(), 3)
+
+        # A full queue drops all queued meter packets to make room
+        queue.put(b'meter3', droppable=True)
+        self.assertEqual(self._queued(queue), [(b'state1', False), (b'meter3', True)])
+        self.assertEqual(queue.dropped, 2)
+
+        queue.put(b'state2')
+        queue.put(b'state3')
+        self.assertEqual(queue.dropped, 3)
+        self.assertEqual(self._queued(queue), [(b'state1', False), (b'state2', False), (b'state3', False)])
+
+        # Without meters to drop a new meter packet is dropped instead
+        queue.put(b'meter4', droppable=True)
+        self.assertEqual(queue.dropped, 4)
+        self.assertEqual(queue.depth(), 3)
+        self.assertFalse(queue.closed)
+
+    def test_client_queue_disconnects_slow_client(self):
+        queue = ClientQueue(self.sock, 'test', 2)
+        queue.put(b'state1')
+        queue.put(b'state2')
+        self.assertFalse(queue.closed)
+
+        # A state change that doesn't fit means the client lost track of the state
+        queue.put(b'state3')
+        self.assertTrue(queue.closed)
+        self.assertEqual(queue.depth(), 0)
+        self.assertEqual(self.peer.recv(1), b'')
+
+        # Everything after closing is ignored
+        queue.put(b'state4')
+        self.assertEqual(queue.depth(), 0)
+
+    def test_client_queue_send(self):
+        queue = ClientQueue(self.sock, 'test', 10)
+        queue.put(b'state1')
+        queue.put([b'transfer1', b'transfer2'])
+        queue.start()
+
+        reader = FrameReader(self.peer, TcpProtocol.STRUCT_HEADER)
+        self.assertEqual(reader.read(), b'state1')
+        self.assertEqual(reader.read(), b'transfer1')
+        self.assertEqual(reader.read(), b'transfer2')
+        queue.close()
+        queue.thread.join(5)
+
+    def test_client_queue_send_v2(self):
+        queue = ClientQueue(self.sock, 'test', 10, version=2)
+        queue.put(b'state1')
+        queue.put(b'state2', droppable=True)
+        queue.put(b'state3')
+        queue.put([b'transfer1', b'transfer2'])
+        queue.start()
+
+        # Version 2 combines the queued packets in a single frame, a list is never merged with the packets before it
+        reader = FrameReader(self.peer, TcpProtocol.STRUCT_HEADER_V2)
+        self.assertEqual(reader.read(), b'state1state2state3')
+        self.assertEqual(reader.read(), b'transfer1transfer2')
+        queue.close()
+        queue.thread.join(5)
+
+    def test_broadcaster_snapshot(self):
+        switcher = FakeSwitcher({
+            'program-bus-input': {0: _program(0, 1), 1: _program(1, 2)},
+        })
+        broadcaster = Broadcaster(switcher)
+        incm = InitCompleteField(b'\0\0\0\0').make_packet()
+
+        snapshot = broadcaster.get_snapshot()
+        self.assertEqual(snapshot, [_program(0, 1).make_packet() + _program(1, 2).make_packet() + incm])
+        self.assertIs(broadcaster.get_snapshot(), snapshot)
+
+        # A change replaces the field with the same index and rebuilds the snapshot
+        switcher.callbacks['changes']([('program-bus-input', _program(1, 3))])
+        self.assertEqual(broadcaster.get_snapshot(),
+                         [_program(0, 1).make_packet() + _program(1, 3).make_packet() + incm])
+
+        switcher.callbacks['disconnected']()
+        self.assertEqual(broadcaster.get_snapshot(), [incm])
+
+    def test_broadcaster_loop(self):
+        hwloop = HardwareLoop()
+        hwloop.daemon = True
+        hwloop.start()
+        threads = []
+
+        class LoopFake(FakeSwitcher):
+            def on(self, event, callback):
+                threads.append(threading.current_thread())
+                return super().on(event, callback)
+
+        try:
+            device = LoopFake({'program-bus-input': {0: _program(0, 1)}})
+            switcher = LoopSwitcher(device, hwloop)
+            broadcaster = Broadcaster(switcher)
+
+            # The callbacks are registered on the loop and the frontend gets a copy of the state
+            self.assertEqual([hwloop, hwloop], threads)
+            state = switcher.mixerstate
+            self.assertEqual(device.mixerstate, state)
+            self.assertIsNot(device.mixerstate['program-bus-input'], state['program-bus-input'])
+            incm = InitCompleteField(b'\0\0\0\0').make_packet()
+            self.assertEqual([_program(0, 1).make_packet() + incm], broadcaster.get_snapshot())
+        finally:
+            hwloop.loop.call_soon_threadsafe(hwloop.loop.stop)
+            hwloop.join(5)
+
+    def test_broadcaster_seed_keeps_changes(self):
+        switcher = FakeSwitcher({'program-bus-input': {0: _program(0, 1)}})
+        broadcaster = Broadcaster(switcher)
+
+        # A change that came in while the state was copied is newer than the copy
+        switcher.callbacks['changes']([('program-bus-input', _program(0, 2))])
+        broadcaster._seed()
+        incm = InitCompleteField(b'\0\0\0\0').make_packet()
+        self.assertEqual([_program(0, 2).make_packet() + incm], broadcaster.get_snapshot())
+
+    def test_broadcaster_pack(self):
+        packets = [bytes([i]) * 20000 for i in range(5)]
+
+        # Every packet has to fit the 16 bit frame length of version 1
+        packed = Broadcaster.pack(packets)
+        self.assertEqual(len(packed), 2)
+        self.assertTrue(all(len(data) <= 0xffff for data in packed))
+        self.assertEqual(b''.join(packed), b''.join(packets))
+
+    def test_broadcaster_changes(self):
+        switcher = FakeSwitcher({'program-bus-input': {0: _program(0, 1)}})
+        broadcaster = Broadcaster(switcher)
+        queue = ClientQueue(self.sock, 'test', 10)
+
+        broadcaster.add(queue)
+        self.assertEqual(self._queued(queue), [(data, False) for data in broadcaster.get_snapshot()])
+        queue.items.clear()
+
+        # Meter levels are queued separately so they can be dropped
+        switcher.callbacks['changes']([('program-bus-input', _program(0, 2)), ('audio-meter-levels', _meter())])
+        self.assertEqual(self._queued(queue), [
+            (_program(0, 2).make_packet(), False),
+            (_meter().make_packet(), True),
+        ])
+        queue.items.clear()
+
+        broadcaster.remove(queue)
+        switcher.callbacks['changes']([('program-bus-input', _program(0, 3))])
+        self.assertEqual(queue.depth(), 0)
+
+    def test_failed_upload(self):
+        # Only the parts of the handler the upload completion uses, without a server around it
+        handler = TCPHandler.__new__(TCPHandler)
+        handler.queue = ClientQueue(self.sock, 'test', 10)
+        handler.uploads = []
+        handler.uploads_lock = threading.Lock()
+
+        tasks = []
+        for tid in (1, 2):
+            task = TransferTask(0, 3)
+            task.tid = tid
+            handler.uploads.append(task)
+            queued = Future()
+            queued.set_result(task)
+            handler.on_upload_queued(task, queued)
+            tasks.append(task)
+
+        # The hardware failed the first upload, the client gets a failed completion with the transfer id
+        tasks[0].future.set_exception(RuntimeError('Transfer failed'))
+        failed = TransferCompleteCommand(0, 3, True, TransferCompleteCommand.STATUS_FAILED, 1).get_command()
+        self.assertEqual([(failed, False)], self._queued(handler.queue))
+        self.assertEqual([tasks[1]], handler.uploads)
+
+        # A successful upload is completed by the upload-done event of the hardware
+        handler.queue.items.clear()
+        handler.proxy_uploaded(0, 3)
+        tasks[1].future.set_result(None)
+        done = TransferCompleteCommand(0, 3, True, transfer=2).get_command()
+        self.assertEqual([(done, False)], self._queued(handler.queue))
+        self.assertEqual([], handler.uploads)
+
+    def test_cache_upload(self):
+        handler = TCPHandler.__new__(TCPHandler)
+        with tempfile.TemporaryDirectory() as path:
+            handler.stills = StillCache(path)
+            frame = bytes(range(256)) * 64
+            other = bytes(len(frame))
+
+            def upload(hash, data):
+                task = TransferTask(0, 3)
+                task.hash = hash
+                task.data = rle_encode(data)
+                task.data_length = len(frame)
+                handler.cache_upload(task)
+
+            # A hash that doesn't match the data would make the proxy serve the wrong frame to other clients
+            upload(hashlib.md5(other).digest(), frame)
+            self.assertIsNone(handler.stills.get_frame(hashlib.md5(other).digest()))
+            upload(hashlib.md5(frame).digest(), frame + frame)
+            self.assertIsNone(handler.stills.get_frame(hashlib.md5(frame).digest()))
+
+            upload(hashlib.md5(frame).digest(), frame)
+            self.assertEqual(rle_encode(frame), handler.stills.get_frame(hashlib.md5(frame).digest()).data)
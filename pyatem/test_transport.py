@@ -0,0 +1,187 @@
+# Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
+# SPDX-License-Identifier: LGPL-3.0-only
+import asyncio
+import socket
+import struct
+import threading
+from unittest import TestCase
+
+from pyatem.transfer import TransferTask
+from pyatem.transport import RetransmissionBuffer, Packet, CongestionControl, UdpProtocol, TcpProtocol, FrameReader, \
+    AsyncUdpProtocol
+
+
+class Test(TestCase):
+    def _packet(self, sequence_number, sent=None):
+        packet = Packet()
+        packet.sequence_number = sequence_number
+        packet.last_packet_time = sent
+        return packet
+
+    def test_retransmission_ack(self):
+        buffer = RetransmissionBuffer()
+        for i in range(1, 11):
+            buffer.add(self._packet(i))
+        released = buffer.ack(4)
+        self.assertEqual([1, 2, 3, 4], [p.sequence_number for p in released])
+        self.assertEqual(6, len(buffer))
+        self.assertEqual([7, 8, 9, 10], [p.sequence_number for p in buffer.since(7)])
+        buffer.ack(10)
+        self.assertEqual(0, len(buffer))
+
+    def test_retransmission_rollover(self):
+        buffer = RetransmissionBuffer()
+        for i in range(65530, 65536):
+            buffer.add(self._packet(i))
+        for i in range(0, 5):
+            buffer.add(self._packet(i))
+        self.assertEqual([65535, 0, 1, 2, 3, 4], [p.sequence_number for p in buffer.since(65535)])
+        buffer.ack(65533)
+        self.assertEqual(7, len(buffer))
+        buffer.ack(1)
+        self.assertEqual([2, 3, 4], [p.sequence_number for p in buffer.since(0)])
+
+    def test_retransmission_limit(self):
+        buffer = RetransmissionBuffer(size=8)
+        for i in range(0, 20):
+            buffer.add(self._packet(i))
+        self.assertEqual(8, len(buffer))
+        self.assertEqual(12, buffer.dropped)
+        self.assertEqual(12, buffer.since(0)[0].sequence_number)
+        self.assertEqual([12], [p.sequence_number for p in buffer.add(self._packet(20))])
+
+    def test_async_ack_waiters(self):
+        class FakeUdp:
+            def sendto(self, raw):
+                pass
+
+        async def run():
+            transport = AsyncUdpProtocol('127.0.0.1')
+            transport._loop = asyncio.get_running_loop()
+            transport.udp = FakeUdp()
+            transport.retransmission_buffer = RetransmissionBuffer(size=2)
+            packets = []
+            waiters = []
+            for i in range(3):
+                packet = Packet()
+                packet.flags = UdpProtocol.FLAG_RELIABLE
+                packet.data = b''
+                waiters.append(transport.send_packet(packet))
+                packets.append(packet)
+
+            # The first packet was dropped from the full buffer without being acknowledged
+            self.assertIsInstance(waiters[0].exception(), ConnectionError)
+            self.assertFalse(waiters[1].done())
+
+            transport._acknowledged(packets[1].sequence_number)
+            self.assertIsNone(waiters[1].result())
+            self.assertFalse(waiters[2].done())
+
+        asyncio.run(run())
+
+    def test_congestion_window(self):
+        congestion = CongestionControl(initial=4, maximum=16)
+        self.assertEqual(4, congestion.available(0, 0.0))
+        self.assertEqual(1, congestion.available(3, 0.0))
+
+        # Slow start doubles the window every round trip
+        congestion.on_ack(4, [self._packet(i, 0.0) for i in range(1, 5)], 0.01)
+        self.assertEqual(8, congestion.window)
+        self.assertAlmostEqual(0.01, congestion.srtt)
+        congestion.on_ack(20, [self._packet(i, 0.01) for i in range(5, 21)], 0.02)
+        self.assertEqual(16, congestion.window)
+
+        # A retransmission request halves the window once for the packets in flight
+        congestion.on_loss(30)
+        congestion.on_loss(31)
+        self.assertEqual(8, congestion.window)
+        self.assertEqual(1, congestion.losses)
+        congestion.on_ack(25, [self._packet(25, 0.02)], 0.03)
+        self.assertEqual(8, congestion.window)
+        congestion.on_ack(30, [self._packet(i, 0.02) for i in range(26, 31)], 0.03)
+        self.assertIsNone(congestion.recovery)
+        self.assertAlmostEqual(8 + 5 / 8, congestion.window)
+
+    def test_congestion_timeout(self):
+        congestion = CongestionControl(initial=4)
+        self.assertEqual(0, congestion.available(4, 0.5))
+        # No acknowledgements within the timeout, probe with a single packet
+        self.assertEqual(1, congestion.available(4, 1.5))
+        self.assertEqual(1, congestion.window)
+        self.assertEqual(1, congestion.timeouts)
+        self.assertEqual(0, congestion.available(4, 1.6))
+
+        retransmitted = self._packet(1, 0.0)
+        retransmitted.flags = UdpProtocol.FLAG_RETRANSMISSION
+        congestion.on_ack(1, [retransmitted], 2.0)
+        self.assertIsNone(congestion.srtt)
+
+    def test_tcp_v2_framing(self):
+        client = TcpProtocol(url='tcp://127.0.0.1:0/')
+        client.sock, peer = socket.socketpair()
+        client.version = 2
+        client.reader = FrameReader(client.sock, TcpProtocol.STRUCT_HEADER_V2, size=1024)
+        try:
+            # Frames larger than the 16 bit length of version 1
+            data = bytes(range(256)) * 1024
+            sender = threading.Thread(target=client._send_packet, args=(data,))
+            sender.start()
+            header = peer.recv(4, socket.MSG_WAITALL)
+            self.assertEqual(len(data), struct.unpack('!I', header)[0])
+            self.assertEqual(data, peer.recv(len(data), socket.MSG_WAITALL))
+            sender.join()
+
+            sender = threading.Thread(target=peer.sendall, args=(header + data,))
+            sender.start()
+            self.assertEqual(data, client._receive_packet().data)
+            sender.join()
+        finally:
+            client.sock.close()
+            peer.close()
+
+    def test_tcp_stream_transfer(self):
+        task = TransferTask(0, 3, upload=True)
+        task.tid = 7
+        task.data = bytes(range(256)) * 600
+        task.data_length = len(task.data)
+        task.send_length = len(task.data)
+        task.hash = bytes(16)
+        task.name = 'Still'
+        task.description = ''
+        fields = task.to_tcp_stream(chunksize=65000)
+        self.assertEqual(b'*XFS', fields[0][0])
+        self.assertEqual(4, len(fields))
+
+        # The header is only sent once, the data fields only have the store, slot and direction
+        received = TransferTask.from_tcp(struct.pack('!H2x 4s', len(fields[0][1]) + 8, b'*XFS') + fields[0][1])
+        self.assertEqual((0, 3, True, len(task.data)), (received.store, received.slot, received.upload,
+                                                        received.send_length))
+        data = b''
+        for cmd, value in fields[1:]:
+            self.assertEqual(b'*XFD', cmd)
+            self.assertEqual((0, 3, True, 7), TransferTask.STRUCT_STREAM.unpack_from(value, 0))
+            data += value[TransferTask.STRUCT_STREAM.size:]
+        self.assertEqual(task.data, data)
+
+    def test_frame_reader(self):
+        a, b = socket.socketpair()
+        try:
+            reader = FrameReader(a, TcpProtocol.STRUCT_HEADER, size=64)
+            frames = [bytes([i]) * (i * 10) for i in range(1, 20)]
+            b.sendall(b''.join(TcpProtocol.STRUCT_HEADER.pack(len(f)) + f for f in frames))
+
+            # Frames larger than the buffer and frames split over multiple reads
+            for frame in frames:
+                self.assertEqual(frame, reader.read())
+
+            b.sendall(TcpProtocol.STRUCT_HEADER.pack(5) + b'ab')
+            b.shutdown(socket.SHUT_WR)
+            self.assertIsNone(reader.read())
+
+            reader = FrameReader(b, TcpProtocol.STRUCT_HEADER_V2, limit=1000)
+            a.sendall(TcpProtocol.STRUCT_HEADER_V2.pack(2000))
+            with self.assertRaises(ValueError):
+                reader.read()
+        finally:
+            a.close()
+            b.close()
@@ -2,20 +2,34 @@
 # SPDX-License-Identifier: LGPL-3.0-only
 import hashlib
 import struct
+from concurrent.futures import Future
 
-from pyatem.media import rle_encode
+from pyatem.media import rle_encode, rle_decode, RleDecoder, frame_delta
 
 
 class TransferTask:
-    def __init__(self, store, slot, upload=False):
+    """
+    A single upload or download. The future resolves when the transfer is done, for downloads the result is the
+    downloaded data. The progress is a fraction between 0 and 1 and can be followed with add_progress_callback().
+    Tasks with a higher priority are started before other queued tasks.
+    """
+    FLAG_DELTA = 0x01
+    STRUCT_STREAM = struct.Struct('>HH ?xH')
+
+    def __init__(self, store, slot, upload=False, priority=0):
         self.tid = None
         self.state = None
         self.upload = upload
+        self.priority = priority
+        self.future = Future()
+        self.progress = 0
+        self.progress_callbacks = []
 
         self.store = store
         self.slot = slot
 
         self.data = None
+        self.offset = 0
         self.data_length = None
         self.hash = None
 
@@ -25,54 +39,167 @@ class TransferTask:
         self.name = None
         self.description = None
 
+        # Delta uploads over the TCP proxy, see use_delta()
+        self.delta = False
+        self.full_data = None
+        self.bytes_saved = 0
+
+        self.budget = None
+        self.buffer = None
+        self.decoder = None
+        self.compressed = False
+        self.received = 0
+        self.expected_length = None
+        self.packets = 0
+
+    def add_progress_callback(self, callback):
+        self.progress_callbacks.append(callback)
+
+    def set_progress(self, progress):
+        self.progress = progress
+        for callback in self.progress_callbacks:
+            callback(self, progress)
+
+    def start_download(self, expected_length=None, compressed=False):
+        """
+        Prepare for receiving the data of a download. The expected length is the uncompressed size of the data, if
+        it's known the compressed data is decoded into a buffer of that size while it's arriving.
+        """
+        self.received = 0
+        self.packets = 0
+        self.expected_length = expected_length
+        self.compressed = compressed
+        self.buffer = []
+        self.decoder = None
+        if compressed and expected_length is not None:
+            self.decoder = RleDecoder(expected_length)
+
+    def receive(self, data):
+        self.received += len(data)
+        self.packets += 1
+        if self.decoder is not None:
+            self.decoder.feed(data)
+        else:
+            self.buffer.append(data)
+
+    def download_progress(self):
+        """Fraction of the expected data that has been received, None if the size isn't known"""
+        if self.expected_length is None:
+            return None
+        done = self.decoder.length if self.decoder is not None else self.received
+        return min(done / self.expected_length, 1)
+
+    def finish_download(self):
+        if self.decoder is not None:
+            data = self.decoder.result()
+        else:
+            data = b''.join(self.buffer)
+            if self.compressed:
+                data = rle_decode(data)
+        self.buffer = None
+        self.decoder = None
+        return data
+
     def calculate_hash(self):
         hasher = hashlib.md5(self.data)
         self.hash = hasher.digest()
         self.data_length = len(self.data)
 
+    def remaining(self):
+        """Number of bytes of data that haven't been sent yet"""
+        return len(self.data) - self.offset
+
     def compress(self):
         compressed = rle_encode(self.data)
         self.data = compressed
         self.send_length = len(self.data)
 
+    def use_delta(self, frame, base):
+        """
+        Send the difference from the base frame instead of the full frame if that's smaller. This only works for
+        uploads through the TCP proxy, the proxy rebuilds the frame from its copy of the base frame and does the full
+        upload to the hardware. Call this after compress().
+
+        :param frame: The uncompressed frame of this upload
+        :param base: The uncompressed frame currently in the slot
+        :return: True if the delta is used
+        """
+        delta = frame_delta(base, frame)
+        if len(delta) + 16 >= len(self.data):
+            return False
+        self.full_data = self.data
+        self.delta = True
+        self.data = hashlib.md5(base).digest() + delta
+        self.send_length = len(self.data)
+        self.bytes_saved = len(self.full_data) - len(self.data)
+        return True
+
+    def use_full(self):
+        """Go back to sending the full frame after the proxy didn't have the base frame for a delta"""
+        self.data = self.full_data
+        self.send_length = len(self.data)
+        self.delta = False
+        self.full_data = None
+        self.bytes_saved = 0
+
     def __repr__(self):
         direction = 'upload' if self.upload else 'download'
         return f'<TransferTask {direction} store={self.store} slot={self.slot}>'
 
-    def to_tcp(self):
+    def _tcp_header(self):
         name = self.name.encode() if self.name else b''
         description = self.description.encode() if self.description else b''
-        header = struct.pack('>HH Hx? 64s 128s 16s II', self.tid or 0, self.store, self.slot, self.upload,
-                             name, description, self.hash, self.send_length, self.data_length)
+        flags = self.FLAG_DELTA if self.delta else 0
+        return struct.pack('>HH HB? 64s 128s 16s II', self.tid or 0, self.store, self.slot, flags, self.upload,
+                           name, description, self.hash, self.send_length, self.data_length)
+
+    def to_tcp(self):
+        header = self._tcp_header()
 
         # Large packets, let TCP fragmentation deal with it
         chunksize = 16000
-        buffer = self.data
+        view = memoryview(self.data)
         packets = []
-        while True:
-            chunk = buffer[0:chunksize]
-            buffer = buffer[chunksize:]
-            packet = header + chunk
-            packets.append((b'*XFR', packet))
-            if len(buffer) == 0:
-                break
+        for offset in range(0, max(len(view), 1), chunksize):
+            packets.append((b'*XFR', header + view[offset:offset + chunksize]))
+        return packets
+
+    def to_tcp_stream(self, chunksize=65480):
+        """
+        Fields for the streaming transfer mode of version 2 of the TCP protocol. The header is only sent once in the
+        *XFS field, the *XFD fields that follow only have the store, slot, direction and transfer id before the data.
+        """
+        packets = [(b'*XFS', self._tcp_header())]
+        prefix = self.STRUCT_STREAM.pack(self.store, self.slot, self.upload, self.tid or 0)
+        view = memoryview(self.data)
+        for offset in range(0, len(view), chunksize):
+            packets.append((b'*XFD', prefix + view[offset:offset + chunksize]))
         return packets
 
     @classmethod
     def from_tcp(cls, packet):
-        header = struct.unpack_from('>HH Hx? 64s 128s 16s II', packet, 8)
+        header = struct.unpack_from('>HH HB? 64s 128s 16s II', packet, 8)
         self = TransferTask(header[1], header[2])
         self.tid = header[0]
-        self.upload = header[3]
-        self.name = header[4].split(b'\x00')[0].decode()
-        self.description = header[5].split(b'\x00')[0].decode()
-        self.hash = header[6]
-        self.send_length = header[7]
-        self.data_length = header[8]
+        self.upload = header[4]
+        self.name = header[5].split(b'\x00')[0].decode()
+        self.description = header[6].split(b'\x00')[0].decode()
+        self.hash = header[7]
+        self.send_length = header[8]
+        self.data_length = header[9]
         self.data = packet[232:]
+        # For delta uploads the data is the md5 hash of the base frame followed by the frame_delta() data
+        self.delta = bool(header[3] & cls.FLAG_DELTA)
         return self
 
 
 class TransferQueueFlushed:
     def __init__(self):
         pass
+
+
+class TransferQueueProgress:
+    def __init__(self, remaining, size, transfer=None):
+        self.remaining = remaining
+        self.size = size
+        self.transfer = transfer
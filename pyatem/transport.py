@@ -1,5 +1,6 @@
 # Copyright 2021 - 2022, Martijn Braam and the OpenAtem contributors
 # SPDX-License-Identifier: LGPL-3.0-only
+import asyncio
 import select
 import socket
 import struct
@@ -14,7 +15,7 @@ import usb.core
 import usb.util
 
 from pyatem.socketqueue import SocketQueue
-from pyatem.transfer import TransferQueueFlushed, TransferTask
+from pyatem.transfer import TransferQueueFlushed, TransferQueueProgress, TransferTask
 
 
 class ConnectionReady:
@@ -38,6 +39,7 @@ class Packet:
         self.original = None
         self.label = None
         self.last_packet_time = None
+        self.transfer = None
 
     @classmethod
     def from_bytes(cls, packet):
@@ -119,30 +121,165 @@ class Packet:
         return flags
 
 
+def _sequence_after(sequence_number, reference):
+    # True if the sequence number is the same or newer than the reference, taking the 16-bit rollover into account
+    return (sequence_number - reference) % 2 ** 16 < 2 ** 15
+
+
+class RetransmissionBuffer:
+    """
+    Sliding window of the reliable packets that have been sent but not acknowledged yet. Packets are released when
+    the remote side acknowledges them and the oldest packets are dropped when the window is full.
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.packets = collections.OrderedDict()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.packets)
+
+    def add(self, packet):
+        """Add a sent packet, returns the unacknowledged packets that were dropped to make room for it"""
+        self.packets[packet.sequence_number] = packet
+        dropped = []
+        while len(self.packets) > self.size:
+            dropped.append(self.packets.popitem(last=False)[1])
+            self.dropped += 1
+        return dropped
+
+    def ack(self, sequence_number):
+        """Release all packets up to and including the acknowledged sequence number, returns the released packets"""
+        released = []
+        while len(self.packets) > 0:
+            oldest = next(iter(self.packets))
+            if not _sequence_after(sequence_number, oldest):
+                break
+            released.append(self.packets.pop(oldest))
+        return released
+
+    def since(self, sequence_number):
+        """Get the buffered packets starting from a sequence number, in the order they were sent"""
+        return [packet for seq, packet in self.packets.items() if _sequence_after(seq, sequence_number)]
+
+    def clear(self):
+        self.packets.clear()
+
+
+class CongestionControl:
+    """
+    AIMD congestion window for the bulk traffic in the send queue. The window is the amount of reliable packets that
+    can be unacknowledged at the same time. It grows while the hardware keeps acknowledging packets and is halved when
+    the hardware requests a retransmission.
+    """
+
+    def __init__(self, initial=5, minimum=1, maximum=64):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+
+        self.window = initial
+        self.threshold = maximum
+        self.srtt = None
+        self.rttvar = None
+        self.rto = 1.0
+        self.recovery = None
+        self.last_progress = 0
+        self.losses = 0
+        self.timeouts = 0
+
+    def reset(self):
+        self.window = self.initial
+        self.threshold = self.maximum
+        self.srtt = None
+        self.rttvar = None
+        self.rto = 1.0
+        self.recovery = None
+
+    def available(self, in_flight, now):
+        """Number of packets that can be sent right now with in_flight packets still unacknowledged"""
+        if in_flight == 0:
+            self.last_progress = now
+        elif now - self.last_progress > self.rto:
+            # Nothing got acknowledged for a while, the end of the window probably got lost. Probe with a single packet
+            # so the hardware notices the gap and requests a retransmission
+            self.timeouts += 1
+            self.threshold = max(self.minimum, self.window / 2)
+            self.window = self.minimum
+            self.rto = min(self.rto * 2, 10.0)
+            self.last_progress = now
+            return 1
+        return max(0, int(self.window) - in_flight)
+
+    def on_ack(self, sequence_number, released, now):
+        if len(released) == 0:
+            return
+        self.last_progress = now
+
+        # Take a round trip sample from the newest packet, retransmitted packets are ambiguous and skipped
+        packet = released[-1]
+        if not packet.flags & UdpProtocol.FLAG_RETRANSMISSION and packet.last_packet_time is not None:
+            self._sample(now - packet.last_packet_time)
+
+        if self.recovery is not None:
+            if not _sequence_after(sequence_number, self.recovery):
+                return
+            self.recovery = None
+
+        if self.window < self.threshold:
+            # Slow start
+            self.window += len(released)
+        else:
+            self.window += len(released) / self.window
+        self.window = min(self.window, self.maximum)
+
+    def on_loss(self, highest_sent):
+        # Only back off once for all the packets that were in flight when the loss happened
+        if self.recovery is not None:
+            return
+        self.losses += 1
+        self.threshold = max(self.minimum, self.window / 2)
+        self.window = self.threshold
+        self.recovery = highest_sent
+
+    def _sample(self, rtt):
+        # Smoothed round trip time and retransmission timeout as in RFC 6298
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, 0.2), 10.0)
+
+
 class BaseProtocol:
     def __init__(self):
         self.send_queue = collections.deque(maxlen=1024)
         self.queue_enabled = False
         self.queue_callback = None
+        self.window_callback = None
         self.mark_next_connected = False
         self.batch_size = 1
-        self.batch_delay = 0
 
     def _send_packet(self, packet):
         raise NotImplementedError()
 
+    def _send_budget(self):
+        return self.batch_size
+
     def queue_packet(self, packet):
         self.send_queue.append(packet)
 
     def queue_trigger(self):
         if len(self.send_queue) > 0:
             self.queue_enabled = True
-            for i in range(0, min(len(self.send_queue), self.batch_size)):
+            for i in range(0, min(len(self.send_queue), self._send_budget())):
                 p = self.send_queue.popleft()
                 self._send_packet(p)
                 if self.queue_callback is not None:
-                    self.queue_callback(len(self.send_queue), len(p.data) - 4)
-            time.sleep(self.batch_delay)
+                    self.queue_callback(len(self.send_queue), len(p.data) - 12, p.transfer)
         elif self.queue_enabled:
             self.queue_enabled = False
             return True
@@ -151,6 +288,10 @@ class BaseProtocol:
     def get_link_quality(self):
         return 100
 
+    def get_window_occupancy(self):
+        """Number of sent packets that haven't been acknowledged by the hardware yet"""
+        return 0
+
 
 class UdpProtocol(BaseProtocol):
     STATE_CLOSED = 0
@@ -169,12 +310,6 @@ class UdpProtocol(BaseProtocol):
         self.ip = ip
         self.port = port
 
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.settimeout(5)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024 * 16)
-
-        self.thread = threading.Thread(None, self._udp_thread, "atem-udp", daemon=True)
-
         self.local_sequence_number = 0
         self.local_ack_number = 0
         self.remote_sequence_number = 0
@@ -187,45 +322,96 @@ class UdpProtocol(BaseProtocol):
         self.had_traffic = False
 
         self.received_packets = collections.deque(maxlen=1024)
-        self.retransmission_buffer = {}
-
-        self.thread_queue = SocketQueue()
-        self.thread_recv_queue = Queue()
-
-        self.batch_size = 5
-        self.batch_delay = 0.003
+        self.retransmission_buffer = RetransmissionBuffer()
+        self.congestion = CongestionControl()
+        self.pacing_interval = 0.005
 
         self.log = logging.getLogger('UdpTransport')
         self.packet_sucess = 0
         self.packet_errors = 0
 
+        self._init_io()
+
+    def _init_io(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(5)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024 * 16)
+
+        self.thread = threading.Thread(None, self._udp_thread, "atem-udp", daemon=True)
+        self.thread_queue = SocketQueue()
+        self.thread_recv_queue = Queue()
+
     def _udp_thread(self):
         while True:
-            readable, _, _ = select.select([self.sock, self.thread_queue], [], [])
-            for queue in readable:
-                if queue is self.sock:
-                    packet = self._receive_packet_low()
-                    if packet is not None:
-                        self.thread_recv_queue.put(packet)
-                elif queue is self.thread_queue:
-                    try:
-                        self._send_packet_low(queue.get())
-                    except OSError as e:
-                        self.log.error(e)
-                        # Queue a None to signal the socket died
+            # Wake up regularly to pace out the queued bulk traffic, otherwise only wait for packets
+            timeout = self.pacing_interval if len(self.send_queue) > 0 else None
+            readable, _, _ = select.select([self.sock, self.thread_queue], [], [], timeout)
+            try:
+                for queue in readable:
+                    if queue is self.sock:
+                        packet = self._receive_packet_low()
+                        if packet is not None:
+                            self.thread_recv_queue.put(packet)
+                    elif queue is self.thread_queue:
+                        packet = queue.get()
+                        # A None is only queued to wake up the pacing
+                        if packet is not None:
+                            self._send_packet_low(packet)
+                    else:
                         self.thread_recv_queue.put(None)
-                        return
-                else:
-                    self.thread_recv_queue.put(None)
-                    RuntimeError("Unexpected result from select()")
+                        RuntimeError("Unexpected result from select()")
+                self._pace()
+            except OSError as e:
+                self.log.error(e)
+                # Queue a None to signal the socket died
+                self.thread_recv_queue.put(None)
+                return
 
     def get_link_quality(self):
         return 100 - (self.packet_errors / self.packet_sucess * 100)
 
+    def get_window_occupancy(self):
+        return len(self.retransmission_buffer)
+
+    def _window_changed(self):
+        if self.window_callback is not None:
+            self.window_callback(len(self.retransmission_buffer), self.retransmission_buffer.size)
+
     def _send_packet(self, packet):
         self.thread_queue.put(packet)
         self.packet_sucess += 1
 
+    def _send_budget(self):
+        # Packets still waiting for the udp thread are in flight as well
+        in_flight = len(self.retransmission_buffer) + self.thread_queue.qsize()
+        return self.congestion.available(in_flight, time.monotonic())
+
+    def queue_trigger(self):
+        # The queue is sent from the udp thread, only wake it up
+        self.thread_queue.put(None)
+        return False
+
+    def _queue_event(self, event):
+        self.thread_recv_queue.put(event)
+
+    def _pace(self):
+        # Send as much of the queued bulk traffic as the congestion window allows, this runs on the udp thread so
+        # it's independent of how fast the received packets are processed
+        if not self.enable_ack or len(self.send_queue) == 0:
+            return
+
+        sizes = {}
+        for i in range(0, min(len(self.send_queue), self._send_budget())):
+            packet = self.send_queue.popleft()
+            self._send_packet_low(packet)
+            self.packet_sucess += 1
+            # Payload size without the command header and the FTDa transfer id and length
+            sizes[packet.transfer] = sizes.get(packet.transfer, 0) + len(packet.data) - 12
+        for transfer, size in sizes.items():
+            self._queue_event(TransferQueueProgress(len(self.send_queue), size, transfer))
+        if len(self.send_queue) == 0:
+            self._queue_event(TransferQueueFlushed())
+
     def _send_packet_low(self, packet):
         packet.session = self.session_id
         if not packet.flags & UdpProtocol.FLAG_ACK:
@@ -233,19 +419,36 @@ class UdpProtocol(BaseProtocol):
                 self.local_sequence_number = 0
             packet.sequence_number = (self.local_sequence_number + 1) % 2 ** 16
         raw = packet.to_bytes()
-        self.sock.sendto(raw, (self.ip, self.port))
+        packet.last_packet_time = time.monotonic()
+        self._sendto(raw)
         self.log.debug('> {}'.format(packet))
         if packet.debug:
             # hexdump(raw)
             pass
         if packet.flags & (UdpProtocol.FLAG_SYN | UdpProtocol.FLAG_ACK) == 0:
             self.local_sequence_number = (self.local_sequence_number + 1) % 2 ** 16
-        self.retransmission_buffer[self.local_sequence_number] = packet
+        if packet.flags & UdpProtocol.FLAG_RELIABLE:
+            dropped = self.retransmission_buffer.add(packet)
+            if len(dropped) > 0:
+                self._dropped(dropped)
+            self._window_changed()
 
         if packet.label == "_handshake":
             # Clear temporary session id, use the session id received in the first packet from the remote
             self.session_id = None
 
+    def _sendto(self, raw):
+        self.sock.sendto(raw, (self.ip, self.port))
+
+    def _retransmit(self, sequence_number):
+        packets = self.retransmission_buffer.since(sequence_number)
+        if len(packets) == 0 or packets[0].sequence_number != sequence_number:
+            self.log.error(f"Can't retransmit packet {sequence_number}, it's not in the retransmission buffer")
+        for packet in packets:
+            packet.flags |= UdpProtocol.FLAG_RETRANSMISSION
+            self._sendto(packet.to_bytes())
+            self.log.debug('> {}'.format(packet))
+
     def _receive_packet(self):
         return self.thread_recv_queue.get()
 
@@ -257,6 +460,9 @@ class UdpProtocol(BaseProtocol):
             self.state = UdpProtocol.STATE_CLOSED
             self.connect()
             return
+        return self._parse_packet(data)
+
+    def _parse_packet(self, data):
         packet = Packet.from_bytes(data)
 
         if packet.flags & UdpProtocol.FLAG_RETRANSMISSION:
@@ -270,10 +476,14 @@ class UdpProtocol(BaseProtocol):
         else:
             self.packet_sucess += 1
 
+        if packet.flags & UdpProtocol.FLAG_ACK:
+            self._acknowledged(packet.acknowledgement_number)
+
         if packet.flags & UdpProtocol.FLAG_REQUEST_RETRANSMISSION:
             self.log.error("retransmission requested")
             self.packet_errors += 1
-            # hexdump(data)
+            self.congestion.on_loss(self.local_sequence_number)
+            self._retransmit(packet.remote_sequence_number)
 
         new_sequence_number = packet.sequence_number
         self.remote_sequence_number = new_sequence_number
@@ -300,6 +510,16 @@ class UdpProtocol(BaseProtocol):
 
         return packet
 
+    def _acknowledged(self, sequence_number):
+        released = self.retransmission_buffer.ack(sequence_number)
+        self.congestion.on_ack(sequence_number, released, time.monotonic())
+        self._window_changed()
+        return released
+
+    def _dropped(self, packets):
+        # These packets can't be retransmitted anymore, the hardware might never receive them
+        self.log.warning(f'Retransmission buffer full, dropped {len(packets)} unacknowledged packets')
+
     def _handshake(self, packet):
         if not packet.flags & UdpProtocol.FLAG_SYN:
             return
@@ -324,8 +544,7 @@ class UdpProtocol(BaseProtocol):
         if self.state != UdpProtocol.STATE_CLOSED:
             raise RuntimeError("Trying to open an connection that's already open")
 
-        if not self.thread.is_alive():
-            self.thread.start()
+        self._start()
 
         # Reset internal state
         self.local_sequence_number = -1
@@ -334,6 +553,8 @@ class UdpProtocol(BaseProtocol):
         self.remote_ack_numbe = 0
         self.session_id = 0x1337
         self.enable_ack = False
+        self.retransmission_buffer.clear()
+        self.congestion.reset()
 
         # Create first syn packet
         syn = Packet()
@@ -347,62 +568,218 @@ class UdpProtocol(BaseProtocol):
         self._send_packet(syn)
         self.state = UdpProtocol.STATE_SYN_SENT
 
+    def _start(self):
+        if not self.thread.is_alive():
+            self.thread.start()
+
     def receive_packet(self):
         while True:
-            packet = self._receive_packet()
+            result = self._handle_packet(self._receive_packet())
+            if result is not True:
+                return result
+
+    def _handle_packet(self, packet):
+        # Run a received packet through the connection state machine, returns True if there's nothing to pass on
+        # to the upper layer
+        if packet is True:
+            return True
+        if packet is None and not self.had_traffic:
+            return True
+        if packet is None and self.state == UdpProtocol.STATE_SYN_SENT:
+            # No response in connect, retry connection
+            self.state = UdpProtocol.STATE_CLOSED
+            self.had_traffic = False
+            self.connect()
+            return None
 
-            if packet is True:
-                continue
-            if packet is None and not self.had_traffic:
-                continue
-            if packet is None and self.state == UdpProtocol.STATE_SYN_SENT:
-                # No response in connect, retry connection
-                self.state = UdpProtocol.STATE_CLOSED
-                self.had_traffic = False
-                self.connect()
-                return None
+        if packet is None:
+            # When None is in the receive queue the socket has disconnected
+            return None
 
-            if packet is None:
-                # When None is in the receive queue the socket has disconnected
-                return None
+        if isinstance(packet, (TransferQueueFlushed, TransferQueueProgress)):
+            return packet
 
-            if self.mark_next_connected:
-                self.mark_next_connected = False
-                return ConnectionReady()
-
-            if self.enable_ack and self.queue_trigger():
-                return TransferQueueFlushed()
-
-            if self.state == UdpProtocol.STATE_SYN_SENT:
-                # Got response for the first handshake packet
-                self.had_traffic = True
-                self._handshake(packet)
-            elif self.state == UdpProtocol.STATE_ESTABLISHED:
-                if packet.length == 12:
-                    # This is a control packet, deal with it in the transport layer
-                    if not self.enable_ack:
-                        # This is the first ACK from the mixer, after this we should send ACKs bac
-                        self.enable_ack = True
-                        # self.local_sequence_number = 0
-                        ack = Packet()
-                        ack.flags = UdpProtocol.FLAG_ACK
-                        ack.acknowledgement_number = self.remote_sequence_number
-                        ack.remote_sequence_number = 0x61
-                        ack.label = 'initial ack after connection'
-                        self._send_packet(ack)
-                    # TODO: Implement other control packets, like request for retransmission
-
-                    # Send queued up bulk traffic after the ack
-                    if self.queue_trigger():
-                        return TransferQueueFlushed()
-                else:
-                    # Data packet for the upper layer
-                    return packet
+        if self.mark_next_connected:
+            self.mark_next_connected = False
+            return ConnectionReady()
+
+        if self.state == UdpProtocol.STATE_SYN_SENT:
+            # Got response for the first handshake packet
+            self.had_traffic = True
+            self._handshake(packet)
+        elif self.state == UdpProtocol.STATE_ESTABLISHED:
+            if packet.length == 12:
+                # This is a control packet, deal with it in the transport layer
+                if not self.enable_ack:
+                    # This is the first ACK from the mixer, after this we should send ACKs bac
+                    self.enable_ack = True
+                    # self.local_sequence_number = 0
+                    ack = Packet()
+                    ack.flags = UdpProtocol.FLAG_ACK
+                    ack.acknowledgement_number = self.remote_sequence_number
+                    ack.remote_sequence_number = 0x61
+                    ack.label = 'initial ack after connection'
+                    self._send_packet(ack)
+                # TODO: Implement other control packets, like request for retransmission
+            else:
+                # Data packet for the upper layer
+                return packet
+        return True
 
     def send_packet(self, packet):
         self._send_packet(packet)
 
 
+class AsyncUdpProtocol(UdpProtocol, asyncio.DatagramProtocol):
+    """
+    UDP transport running on an asyncio event loop instead of the atem-udp thread. The packets for the upper layer
+    are passed to the packet_callback from the event loop, the same way they would be returned by receive_packet()
+    in the threaded transport.
+    """
+
+    def __init__(self, ip, port=9910):
+        super().__init__(ip, port)
+        self.packet_callback = None
+        self.timeout = 5
+        self.last_received = 0
+        self._ack_waiters = {}
+
+    def _init_io(self):
+        # The socket is created by the event loop in open()
+        self.udp = None
+        self._loop = None
+        self._timer = None
+        self._pace_timer = None
+
+    async def open(self):
+        if self.udp is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        await self._loop.create_datagram_endpoint(lambda: self, remote_addr=(self.ip, self.port))
+
+    def close(self):
+        if self.udp is not None:
+            self.udp.close()
+
+    def connection_made(self, transport):
+        self.udp = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024 * 16)
+        self.last_received = self._loop.time()
+        self._timer = self._loop.call_later(self.timeout, self._check_timeout)
+
+    def connection_lost(self, exc):
+        self.udp = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pace_timer is not None:
+            self._pace_timer.cancel()
+            self._pace_timer = None
+        self._cancel_waiters()
+        self.state = UdpProtocol.STATE_CLOSED
+
+    def datagram_received(self, data, addr):
+        self.last_received = self._loop.time()
+        result = self._handle_packet(self._parse_packet(data))
+        if result is not True and self.packet_callback is not None:
+            self.packet_callback(result)
+        self._pace()
+        if len(self.send_queue) > 0:
+            self._schedule_pace(self.pacing_interval)
+
+    def error_received(self, exc):
+        # ICMP errors while the hardware is unreachable, the timeout takes care of reconnecting
+        self.log.debug(exc)
+
+    def _check_timeout(self):
+        now = self._loop.time()
+        if now - self.last_received >= self.timeout:
+            # No longer receiving data from the hardware, reset the state of the connection and re-init
+            self.state = UdpProtocol.STATE_CLOSED
+            self.connect()
+            self.last_received = now
+        self._timer = self._loop.call_later(self.last_received + self.timeout - now, self._check_timeout)
+
+    def _start(self):
+        if self.udp is None:
+            raise RuntimeError("The transport has to be opened before connecting")
+
+    def _cancel_waiters(self):
+        waiters = self._ack_waiters
+        self._ack_waiters = {}
+        for waiter in waiters.values():
+            waiter.cancel()
+
+    def connect(self):
+        # Sequence numbers restart on a new connection, the unacknowledged packets will never be acknowledged
+        self._cancel_waiters()
+        super().connect()
+
+    def _sendto(self, raw):
+        self.udp.sendto(raw)
+
+    def _send_budget(self):
+        return self.congestion.available(len(self.retransmission_buffer), time.monotonic())
+
+    def queue_trigger(self):
+        self._schedule_pace(0)
+        return False
+
+    def _queue_event(self, event):
+        if self.packet_callback is not None:
+            self.packet_callback(event)
+
+    def _schedule_pace(self, delay):
+        if self._pace_timer is None and self._loop is not None:
+            self._pace_timer = self._loop.call_later(delay, self._pace_tick)
+
+    def _pace_tick(self):
+        self._pace_timer = None
+        self._pace()
+        if len(self.send_queue) > 0:
+            self._schedule_pace(self.pacing_interval)
+
+    def _send_packet(self, packet):
+        self._send_packet_low(packet)
+        self.packet_sucess += 1
+
+    def _acknowledged(self, sequence_number):
+        # Only the packets that are released by this ack have been acknowledged, packets that were dropped from the
+        # retransmission buffer before are failed in _dropped()
+        released = super()._acknowledged(sequence_number)
+        for packet in released:
+            waiter = self._ack_waiters.pop(packet.sequence_number, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+        return released
+
+    def _dropped(self, packets):
+        super()._dropped(packets)
+        for packet in packets:
+            waiter = self._ack_waiters.pop(packet.sequence_number, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_exception(ConnectionError('Packet was dropped from the retransmission buffer before it '
+                                                     'was acknowledged'))
+
+    def receive_packet(self):
+        raise RuntimeError("AsyncUdpProtocol passes received packets to packet_callback")
+
+    def send_packet(self, packet):
+        """
+        Send a packet to the hardware, this returns a future that resolves when the hardware has acknowledged a
+        reliable packet. The future is cancelled when the connection is reset before that happens.
+        """
+        self._send_packet(packet)
+        waiter = self._loop.create_future()
+        if packet.flags & UdpProtocol.FLAG_RELIABLE and packet.sequence_number in self.retransmission_buffer.packets:
+            self._ack_waiters[packet.sequence_number] = waiter
+        else:
+            waiter.set_result(None)
+        return waiter
+
+
 class UsbProtocol(BaseProtocol):
     STATE_INIT = 0
     STATE_CONNECTED = 1
@@ -613,13 +990,77 @@ class UsbProtocol(BaseProtocol):
             pass
 
 
+class FrameReader:
+    """
+    Reads length prefixed frames from a stream socket. Data is received with recv_into in a reusable buffer so every
+    syscall can read as many frames as are available, the frames are parsed from that buffer one at a time.
+    """
+
+    def __init__(self, sock, header, size=256 * 1024, limit=None):
+        self.sock = sock
+        self.header = header
+        self.limit = limit
+        self.buffer = bytearray(size)
+        self.start = 0
+        self.end = 0
+
+    def read(self):
+        """Returns the data of the next frame, or None when the connection is closed"""
+        while True:
+            available = self.end - self.start
+            if available >= self.header.size:
+                length, = self.header.unpack_from(self.buffer, self.start)
+                if self.limit is not None and length > self.limit:
+                    raise ValueError(f"Received frame of {length} bytes, the limit is {self.limit}")
+                needed = self.header.size + length
+                if available >= needed:
+                    with memoryview(self.buffer) as view:
+                        data = bytes(view[self.start + self.header.size:self.start + needed])
+                    self.start += needed
+                    if self.start == self.end:
+                        self.start = 0
+                        self.end = 0
+                    return data
+            else:
+                needed = self.header.size
+            self._reserve(needed)
+            with memoryview(self.buffer) as view:
+                received = self.sock.recv_into(view[self.end:])
+            if received == 0:
+                return None
+            self.end += received
+
+    def _reserve(self, needed):
+        # Make room for the rest of the frame by moving the partial frame to the start of the buffer, the buffer is
+        # only grown for frames that don't fit at all
+        if self.start + needed <= len(self.buffer) and self.end < len(self.buffer):
+            return
+        pending = self.end - self.start
+        if needed > len(self.buffer):
+            buffer = bytearray(max(needed, len(self.buffer) * 2))
+            buffer[0:pending] = self.buffer[self.start:self.end]
+            self.buffer = buffer
+        else:
+            self.buffer[0:pending] = self.buffer[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+
 class TcpProtocol(BaseProtocol):
     STATE_INIT = 0
     STATE_AUTH = 1
     STATE_CONNECTED = 2
 
     STRUCT_HEADER = struct.Struct('!H')
+    STRUCT_HEADER_V2 = struct.Struct('!I')
     STRUCT_FIELD = struct.Struct('!H2x 4s')
+    STRUCT_VERSION = struct.Struct('!B3x')
+
+    # Highest protocol version this client supports, version 2 has 32 bit frame lengths and streaming transfers
+    VERSION = 2
+
+    # Fields are combined in frames up to this size when sending in version 2
+    MAX_FRAME = 1024 * 1024
 
     def __init__(self, url=None, host=None, port=None, username=None, password=None, device=None):
         super().__init__()
@@ -637,28 +1078,27 @@ class TcpProtocol(BaseProtocol):
         self.device = device
 
         self.sock = None
+        self.reader = None
         self.state = TcpProtocol.STATE_INIT
+        self.version = 1
 
         self.log = logging.getLogger('TcpTransport')
 
     def _send_packet(self, data):
-        header = self.STRUCT_HEADER.pack(len(data))
+        if self.version >= 2:
+            header = self.STRUCT_HEADER_V2.pack(len(data))
+        else:
+            header = self.STRUCT_HEADER.pack(len(data))
         self.sock.sendall(header + data)
 
     def _receive_packet(self):
         try:
-            header = self.sock.recv(2)
-            datalength, = self.STRUCT_HEADER.unpack(header)
-            data_left = datalength
-            data = b''
-            while data_left > 0:
-                block = self.sock.recv(data_left)
-                if len(block) == 0:
-                    self.log.error("Connection closed")
-                    return
-                data_left -= len(block)
-                data += block
-        except:
+            data = self.reader.read()
+        except OSError as e:
+            self.log.error(f"Could not receive from the proxy: {e}")
+            return None
+        if data is None:
+            self.log.error("Connection closed")
             return None
 
         packet = Packet()
@@ -685,9 +1125,12 @@ class TcpProtocol(BaseProtocol):
     def connect(self):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((self.host, self.port))
+        self.reader = FrameReader(self.sock, self.STRUCT_HEADER)
 
-        # Send magic packet to init the connection
-        self._send_packet(self.list_to_packets([(b'*SW*', b'')]))
+        # Send magic packet to init the connection, with the highest protocol version this client supports. Proxies
+        # that support version 2 acknowledge this with their own *SW* field, older ones ignore it.
+        self.version = 1
+        self._send_packet(self.list_to_packets([(b'*SW*', self.STRUCT_VERSION.pack(self.VERSION))]))
 
     def send_auth(self):
         if self.username is None or self.password is None:
@@ -706,10 +1149,16 @@ class TcpProtocol(BaseProtocol):
         while True:
             packet = self._receive_packet()
             if packet is None:
-                continue
+                return None
             if self.state == TcpProtocol.STATE_INIT:
                 fields = list(self.decode_packet(packet.data))
-                if fields[0][0] == b'AUTH':
+                if fields[0][0] == b'*SW*':
+                    version, = self.STRUCT_VERSION.unpack(fields[0][1])
+                    self.version = min(version, self.VERSION)
+                    self.reader.header = self.STRUCT_HEADER_V2 if self.version >= 2 else self.STRUCT_HEADER
+                    self.log.debug(f'Using version {self.version} of the TCP protocol')
+                    continue
+                elif fields[0][0] == b'AUTH':
                     self.send_auth()
                     continue
                 elif fields[0][0] == b'*HW*':
@@ -725,8 +1174,29 @@ class TcpProtocol(BaseProtocol):
     def upload(self, task):
         if not isinstance(task, TransferTask):
             raise ValueError()
-        for packet in task.to_tcp():
-            self._send_packet(self.list_to_packets([packet]))
+        if self.version < 2:
+            for packet in task.to_tcp():
+                self._send_packet(self.list_to_packets([packet]))
+            return
+
+        frame = []
+        size = 0
+        for packet in task.to_tcp_stream():
+            if size + len(packet[1]) + 8 > self.MAX_FRAME:
+                self._send_packet(self.list_to_packets(frame))
+                frame = []
+                size = 0
+            frame.append(packet)
+            size += len(packet[1]) + 8
+        self._send_packet(self.list_to_packets(frame))
 
     def download(self, task):
-        pass
+        if not isinstance(task, TransferTask):
+            raise ValueError()
+        # A download is requested with an *XFR field without data, the proxy sends the data back in transfer fields
+        # followed by a *XFC
+        task.data = b''
+        task.send_length = 0
+        task.data_length = 0
+        task.hash = bytes(16)
+        self._send_packet(self.list_to_packets(task.to_tcp()))
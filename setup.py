@@ -6,7 +6,8 @@ setup(
     name='pyatem',
     version='0.13.0',
     packages=['pyatem', 'pyatem.converters'],
-    ext_modules=[Extension('pyatem.mediaconvert', ['pyatem/mediaconvertmodule.c'])],
+    ext_modules=[Extension('pyatem.mediaconvert', ['pyatem/mediaconvertmodule.c'], extra_compile_args=['-pthread'],
+                           extra_link_args=['-pthread'])],
     url='https://git.sr.ht/~martijnbraam/pyatem',
     license='LGPL3',
     author='Martijn Braam',
@@ -0,0 +1,54 @@
+import argparse
+import gzip
+import os
+import time
+
+from pyatem.media import atem_to_rgb, rgb_to_atem
+import pyatem.test_colorspace
+
+RESOLUTIONS = [
+    ('1080p', 1920, 1080),
+    ('2160p', 3840, 2160),
+    ('4320p', 7680, 4320),
+]
+
+
+def measure(label, func, rounds, pixels):
+    func()
+    start = time.perf_counter()
+    for i in range(rounds):
+        func()
+    duration = time.perf_counter() - start
+    print(f'{label:<40} {duration / rounds * 1000:10.2f} ms {pixels * rounds / duration / 1e6:10.1f} Mpixel/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the colorspace conversion implementations")
+    parser.add_argument('--rounds', type=int, default=10, help='Number of times to convert each frame')
+    parser.add_argument('--threads', type=int, default=1, help='Number of threads, 0 for a thread per core')
+    args = parser.parse_args()
+
+    fixtures_dir = os.environ.get('TEST_FIXTURES',
+                                  os.path.join(os.path.dirname(pyatem.test_colorspace.__file__), 'fixtures'))
+    with gzip.open(os.path.join(fixtures_dir, 'ramps-atemsc.data.gz'), 'rb') as handle:
+        reference = handle.read()
+
+    for label, width, height in RESOLUTIONS:
+        # Tile the 1080p reference frame to fill the larger resolutions
+        tiles = (width * height) // (1920 * 1080)
+        atem = reference * tiles
+        rgba = atem_to_rgb(atem, width, height)
+        pixels = width * height
+
+        print(f'{label} ({width}x{height}, {args.threads} threads)')
+        for fixed in [False, True]:
+            name = 'fixed' if fixed else 'float'
+            measure(f'  atem_to_rgb {name}', lambda: atem_to_rgb(atem, width, height, threads=args.threads,
+                                                                 fixed=fixed), args.rounds, pixels)
+            measure(f'  rgb_to_atem {name}', lambda: rgb_to_atem(rgba, width, height, threads=args.threads,
+                                                                 fixed=fixed), args.rounds, pixels)
+        print()
+
+
+if __name__ == '__main__':
+    main()
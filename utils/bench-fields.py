@@ -0,0 +1,143 @@
+import argparse
+import struct
+import time
+
+from pyatem.protocol import AtemProtocol
+import pyatem.field as fieldmodule
+
+STRUCT_RECORD = struct.Struct('!I')
+
+
+class RecordingProtocol(AtemProtocol):
+    """AtemProtocol that keeps a copy of every received packet"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recording = []
+
+    def decode_packet(self, data):
+        self.recording.append(bytes(data))
+        return super().decode_packet(data)
+
+
+def record(device, path):
+    print(f"Connecting to {device}...")
+    if device == 'usb':
+        switcher = RecordingProtocol(usb='auto')
+    else:
+        switcher = RecordingProtocol(device)
+
+    def on_connected():
+        with open(path, 'wb') as handle:
+            for packet in switcher.recording:
+                handle.write(STRUCT_RECORD.pack(len(packet)))
+                handle.write(packet)
+        print(f"Recorded {len(switcher.recording)} packets of initial sync to {path}")
+        exit(0)
+
+    switcher.on('connected', on_connected)
+    switcher.connect()
+    while True:
+        switcher.loop()
+
+
+def load(path):
+    with open(path, 'rb') as handle:
+        raw = handle.read()
+    packets = []
+    offset = 0
+    while offset < len(raw):
+        length, = STRUCT_RECORD.unpack_from(raw, offset)
+        offset += STRUCT_RECORD.size
+        packets.append(raw[offset:offset + length])
+        offset += length
+    return packets
+
+
+def legacy_lookup(fieldname, contents):
+    """The per-field reflection that was used before the field registry existed"""
+    key = fieldname.decode()
+    if key in AtemProtocol.FIELDNAME_PRETTY:
+        key = AtemProtocol.FIELDNAME_PRETTY[key]
+        classname = key.title().replace('-', '') + "Field"
+        if hasattr(fieldmodule, classname):
+            contents = getattr(fieldmodule, classname)(contents)
+    return key, contents
+
+
+def registry_lookup(fieldname, contents):
+    registered = AtemProtocol.FIELD_REGISTRY.get(fieldname)
+    if registered is None:
+        return fieldname.decode(), contents
+    key, fieldclass, index_struct, has_strip_id = registered
+    if fieldclass is not None:
+        contents = fieldclass(contents)
+    return key, contents
+
+
+def measure(label, packets, rounds, func):
+    fields = 0
+    start = time.perf_counter()
+    for i in range(rounds):
+        fields += func(packets)
+    duration = time.perf_counter() - start
+    print(f'{label:<32} {fields / duration:12.0f} fields/s')
+
+
+def run(path, rounds):
+    packets = load(path)
+    switchers = {
+        False: AtemProtocol('127.0.0.1'),
+        True: AtemProtocol('127.0.0.1', lazy_fields=True),
+    }
+    fields = [(name, bytes(data)) for packet in packets for name, data in switchers[False].decode_packet(packet)]
+    print(f'Loaded {len(packets)} packets with {len(fields)} fields, replaying {rounds} times')
+    print()
+
+    def lookup(func):
+        def bench(packets):
+            for fieldname, contents in fields:
+                func(fieldname, contents)
+            return len(fields)
+
+        return bench
+
+    def pipeline(lazy):
+        def bench(packets):
+            switcher = switchers[lazy]
+            switcher.mixerstate = {}
+            count = 0
+            for packet in packets:
+                for fieldname, contents in switcher.decode_packet(packet):
+                    switcher.save_field_data(fieldname, contents)
+                    count += 1
+            return count
+
+        return bench
+
+    measure('lookup + decode (before)', packets, rounds, lookup(legacy_lookup))
+    measure('lookup + decode (after)', packets, rounds, lookup(registry_lookup))
+    measure('decode_packet + save_field_data', packets, rounds, pipeline(False))
+    measure('  with lazy_fields', packets, rounds, pipeline(True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the field decoding with a recorded initial sync")
+    subparsers = parser.add_subparsers(dest="action")
+    subparsers.required = True
+    record_parser = subparsers.add_parser('record', help='Record the initial sync of a switcher')
+    record_parser.add_argument('device', help="Device ip address or 'usb'")
+    record_parser.add_argument('dump', help='File to write the recorded packets to')
+    run_parser = subparsers.add_parser('run', help='Replay a recorded initial sync')
+    run_parser.add_argument('dump', help='File with recorded packets')
+    run_parser.add_argument('--rounds', type=int, default=20, help='Number of times to replay the dump')
+    args = parser.parse_args()
+
+    if args.action == 'record':
+        record(args.device, args.dump)
+    else:
+        run(args.dump, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import gzip
+import os
+import time
+from unittest import TestLoader
+
+from pyatem.media import rle_encode, rle_decode, rle_decode_slow, atem_to_image, atem_to_rgb
+import pyatem.test_rle
+from pyatem.test_media import Test as MediaTest
+
+
+class FixtureCollector(pyatem.test_rle.Test):
+    """Runs the test_rle cases but only keeps the data they would check"""
+    collected = []
+
+    def _rle_loop_check(self, label, testdata):
+        self.collected.append((label, rle_encode(testdata)))
+
+
+def rle_fixtures():
+    suite = TestLoader().loadTestsFromTestCase(FixtureCollector)
+    for test in suite:
+        if test._testMethodName.startswith('test_rle_decoder'):
+            continue
+        test.debug()
+    return FixtureCollector.collected
+
+
+def measure(label, func, rounds, size):
+    start = time.perf_counter()
+    for i in range(rounds):
+        func()
+    duration = time.perf_counter() - start
+    print(f'{label:<40} {duration / rounds * 1000:10.3f} ms {size * rounds / duration / 1e6:10.1f} MB/s')
+
+
+def compare(label, frames, rounds, slow_rounds):
+    size = sum(len(rle_decode(frame)) for frame in frames)
+    output = bytearray(max(len(rle_decode(frame)) for frame in frames))
+
+    def slow():
+        for frame in frames:
+            rle_decode_slow(frame)
+
+    def native():
+        for frame in frames:
+            rle_decode(frame)
+
+    def native_into():
+        for frame in frames:
+            rle_decode(frame, output)
+
+    print(label)
+    measure('  python', slow, slow_rounds, size)
+    measure('  native', native, rounds, size)
+    measure('  native into buffer', native_into, rounds, size)
+    print()
+
+
+def compare_convert(label, frame, rounds):
+    size = len(rle_decode(frame))
+    output = bytearray(size)
+
+    print(label)
+    measure('  rle_decode + atem_to_rgb', lambda: atem_to_rgb(rle_decode(frame), 1920, 1080), rounds, size)
+    measure('  atem_to_image', lambda: atem_to_image(frame, 1920, 1080), rounds, size)
+    measure('  atem_to_image into buffer', lambda: atem_to_image(frame, 1920, 1080, output), rounds, size)
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RLE decoder and frame conversion implementations")
+    parser.add_argument('--rounds', type=int, default=50, help='Number of times to decode each frame')
+    args = parser.parse_args()
+
+    fixtures = rle_fixtures()
+    compare(f'test_rle.py fixtures ({len(fixtures)} frames)', [data for label, data in fixtures],
+            args.rounds * 100, args.rounds * 100)
+
+    compare('1080p solid color', [MediaTest.FRAME_1080_RED], args.rounds, 2)
+
+    fixtures_dir = os.environ.get('TEST_FIXTURES', os.path.join(os.path.dirname(pyatem.test_rle.__file__), 'fixtures'))
+    with gzip.open(os.path.join(fixtures_dir, 'ramps-atemsc.data.gz'), 'rb') as handle:
+        ramps = rle_encode(handle.read())
+    compare('1080p ramps', [ramps], args.rounds, 2)
+
+    compare_convert('1080p solid color to RGBA', MediaTest.FRAME_1080_RED, args.rounds)
+    compare_convert('1080p ramps to RGBA', ramps, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
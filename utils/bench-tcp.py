@@ -0,0 +1,96 @@
+import argparse
+import socket
+import struct
+import threading
+import time
+
+from pyatem.transport import FrameReader, TcpProtocol
+
+
+def legacy_receive(sock, header_struct):
+    """The receive loop that was used before the FrameReader existed"""
+    header = sock.recv(header_struct.size)
+    if len(header) < header_struct.size:
+        return None
+    datalength, = header_struct.unpack(header)
+    data_left = datalength
+    data = b''
+    while data_left > 0:
+        block = sock.recv(data_left)
+        if len(block) == 0:
+            return None
+        data_left -= len(block)
+        data += block
+    return data
+
+
+def serve(blob):
+    """Loopback server standing in for the proxy, every connection gets the same stream of frames"""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+
+    def run():
+        while True:
+            conn, addr = server.accept()
+            conn.sendall(blob)
+            conn.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return server.getsockname()
+
+
+def connect(address, rcvbuf):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if rcvbuf:
+        # A small receive buffer makes the data arrive in small blocks like it would over a real network
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.connect(address)
+    return sock
+
+
+def measure(label, address, rounds, rcvbuf, size, receive):
+    frames = 0
+    start = time.perf_counter()
+    for i in range(rounds):
+        sock = connect(address, rcvbuf)
+        while receive(sock) is not None:
+            frames += 1
+        sock.close()
+    duration = time.perf_counter() - start
+    print(f'{label:<32} {frames / duration:12.0f} frames/s {size * rounds / duration / 1024 / 1024:10.1f} MiB/s')
+
+
+def compare(label, header_struct, frame_size, count, rounds, rcvbuf):
+    frame = bytes(range(256)) * (frame_size // 256) + bytes(frame_size % 256)
+    blob = (header_struct.pack(len(frame)) + frame) * count
+    address = serve(blob)
+
+    readers = {}
+
+    def buffered(sock):
+        if sock not in readers:
+            readers[sock] = FrameReader(sock, header_struct)
+        return readers[sock].read()
+
+    print(f'{label} ({count} frames of {frame_size} bytes)')
+    measure('  recv + concatenate (before)', address, rounds, rcvbuf, len(blob),
+            lambda s: legacy_receive(s, header_struct))
+    measure('  FrameReader', address, rounds, rcvbuf, len(blob), buffered)
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark receiving TCP protocol frames from a loopback connection")
+    parser.add_argument('--rounds', type=int, default=5, help='Number of connections per measurement')
+    parser.add_argument('--rcvbuf', type=int, help='Receive buffer size of the client socket')
+    args = parser.parse_args()
+
+    compare('State changes', TcpProtocol.STRUCT_HEADER, 200, 100000, args.rounds, args.rcvbuf)
+    compare('Initial sync', TcpProtocol.STRUCT_HEADER, 65000, 2000, args.rounds, args.rcvbuf)
+    compare('Version 2 transfer frames', TcpProtocol.STRUCT_HEADER_V2, TcpProtocol.MAX_FRAME, 100, args.rounds,
+            args.rcvbuf)
+
+
+if __name__ == '__main__':
+    main()